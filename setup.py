@@ -12,15 +12,21 @@ Options.docstrings = True
 MOD_NAMES = [
     "spacy_biaffine_parser.arc_predicter",
     "spacy_biaffine_parser.arc_labeler",
+    "spacy_biaffine_parser.biaffine_parser",
     "spacy_biaffine_parser.mst",
+    "spacy_biaffine_parser.eisner",
 ]
 
 COMPILE_OPTIONS = {
     "msvc": ["/Ox", "/EHsc"],
-    "mingw32": ["-O2", "-Wno-strict-prototypes", "-Wno-unused-function"],
-    "other": ["-O2", "-Wno-strict-prototypes", "-Wno-unused-function"],
+    "mingw32": ["-O2", "-pthread", "-Wno-strict-prototypes", "-Wno-unused-function"],
+    "other": ["-O2", "-pthread", "-Wno-strict-prototypes", "-Wno-unused-function"],
+}
+LINK_OPTIONS = {
+    "msvc": ["-std=c++11"],
+    "mingw32": ["-std=c++11", "-pthread"],
+    "other": ["-pthread"],
 }
-LINK_OPTIONS = {"msvc": ["-std=c++11"], "mingw32": ["-std=c++11"], "other": []}
 COMPILER_DIRECTIVES = {
     "language_level": -3,
     "embedsignature": True,
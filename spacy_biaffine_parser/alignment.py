@@ -0,0 +1,64 @@
+from typing import Tuple, cast
+import weakref
+
+import numpy as np
+from spacy.attrs import DEP, HEAD, ORTH
+from spacy.training import Example
+from thinc.types import Ints1d
+
+# Aligned parses, keyed by the reference doc. Entries are removed when the
+# reference doc is garbage collected.
+_aligned_parse_cache: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+
+
+def get_aligned_parse(example: Example) -> Tuple[Ints1d, np.ndarray]:
+    """Get the heads and labels of the reference doc aligned to the tokens
+    of the predicted doc, like `Example.get_aligned_parse` without
+    projectivization.
+
+    The heads are returned as an int32 array, where tokens that could not
+    be aligned have head -1. The labels are returned as a uint64 array of
+    string hashes, where tokens without a label have label 0.
+
+    The alignment is cached, since the components and the scorer all need
+    it and it does not change between training steps. The cache entry is
+    recomputed when the tokenization of the predicted doc or the parse of
+    the reference doc changes."""
+    predicted_key = example.predicted.to_array([ORTH])
+    reference_key = example.reference.to_array([ORTH, HEAD, DEP])
+
+    cached = _aligned_parse_cache.get(example.reference)
+    if cached is not None:
+        cached_predicted_key, cached_reference_key, heads, labels = cached
+        if np.array_equal(cached_predicted_key, predicted_key) and np.array_equal(
+            cached_reference_key, reference_key
+        ):
+            return heads, labels
+
+    aligned_heads, aligned_labels = example.get_aligned_parse(projectivize=False)
+    heads = np.array(
+        [-1 if head is None else head for head in aligned_heads], dtype=np.int32
+    )
+    strings = example.reference.vocab.strings
+    labels = np.array(
+        [0 if label is None else strings[label] for label in aligned_labels],
+        dtype=np.uint64,
+    )
+
+    # The arrays are shared between call sites, so they must not be
+    # modified.
+    heads.flags.writeable = False
+    labels.flags.writeable = False
+    _aligned_parse_cache[example.reference] = (
+        predicted_key,
+        reference_key,
+        heads,
+        labels,
+    )
+
+    return cast(Ints1d, heads), labels
+
+
+def clear_aligned_parse_cache():
+    """Remove all cached aligned parses."""
+    _aligned_parse_cache.clear()
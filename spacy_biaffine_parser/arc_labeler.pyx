@@ -9,6 +9,7 @@ from spacy.errors import Errors
 from spacy.pipeline.trainable_pipe cimport TrainablePipe
 from spacy.tokens.token cimport Token
 from spacy.tokens.doc cimport Doc
+from spacy.typedefs cimport attr_t
 from spacy.training import Example, validate_get_examples, validate_examples
 from spacy.util import minibatch
 import srsly
@@ -16,7 +17,9 @@ from thinc.api import Config, Model, Ops, Optimizer
 from thinc.api import to_numpy
 from thinc.types import Floats2d, Ints1d, Tuple
 
+from .alignment import get_aligned_parse
 from .eval import parser_score
+from .exported_scorers import ExportedScorers
 
 default_model_config = """
 [model]
@@ -40,7 +43,8 @@ DEFAULT_ARC_LABELER_MODEL = Config().from_str(default_model_config)["model"]
     assigns=["token.dep"],
     default_config={
         "model": DEFAULT_ARC_LABELER_MODEL,
-        "scorer": {"@scorers": "biaffine.parser_scorer.v1"}
+        "scorer": {"@scorers": "biaffine.parser_scorer.v1"},
+        "exported_scorers": None,
     },
 )
 def make_arc_labeler(
@@ -48,8 +52,9 @@ def make_arc_labeler(
     name: str,
     model: Model,
     scorer: Optional[Callable],
+    exported_scorers: Optional[str],
 ):
-    return ArcLabeler(nlp.vocab, model, name, scorer=scorer)
+    return ArcLabeler(nlp.vocab, model, name, scorer=scorer, exported_scorers=exported_scorers)
 
 
 class ArcLabeler(TrainablePipe):
@@ -60,7 +65,8 @@ class ArcLabeler(TrainablePipe):
         name: str = "arc_labeler",
         *,
         overwrite=False,
-        scorer=parser_score
+        scorer=parser_score,
+        exported_scorers: Optional[str] = None
     ):
         self.name = name
         self.model = model
@@ -69,40 +75,31 @@ class ArcLabeler(TrainablePipe):
         self.cfg = dict(sorted(cfg.items()))
         self.scorer = scorer
         self._label_to_i = None
+        # Score with scorers that were exported by export_scorers, rather
+        # than with the PyTorch model.
+        self.exported_scorers = None
+        if exported_scorers is not None:
+            self.exported_scorers = ExportedScorers(exported_scorers)
+            self.exported_scorers.get_layer("bilinear")
 
     def get_loss(self, examples: Iterable[Example], scores) -> Tuple[float, Floats2d]:
         validate_examples(examples, "ArcLabeler.get_loss")
 
-        def loss_func(guesses, target, mask):
-            d_scores = guesses - target
-            d_scores *= mask
+        def loss_func(guesses, rows, labels):
+            # Squared error against one-hot targets, computed from the
+            # indices of the gold labels, so that no dense target is needed.
+            d_scores = self.model.ops.alloc2f(*guesses.shape)
+            d_scores[rows] = guesses[rows]
+            d_scores[rows, labels] -= 1.0
             loss = (d_scores ** 2).sum()
             return d_scores, loss
 
-        target = np.zeros_like(scores)
-        mask = np.zeros(scores.shape[0], dtype=scores.dtype)
+        rows, labels = gold_labels(examples, self._label_to_i)
+        assert sum(len(eg.predicted) for eg in examples) == scores.shape[0]
 
-        offset = 0
-        for eg in examples:
-            aligned_heads, aligned_labels = eg.get_aligned_parse(projectivize=False)
-            for token in eg.predicted:
-                gold_head = aligned_heads[token.i]
-                gold_label = aligned_labels[token.i]
-
-                # Do not learn from misaligned tokens, since we could no use
-                # their correct head representations.
-                if gold_head is not None and gold_label is not None:
-                    target[offset, self._label_to_i[gold_label]] = 1.0
-                    mask[offset] = 1.0
-
-                offset += 1
-
-        assert offset == target.shape[0]
-
-        target = self.model.ops.asarray2f(target)
-        mask = self.model.ops.asarray2f(np.expand_dims(mask, -1))
-
-        d_scores, loss = loss_func(scores, target, mask)
+        rows = self.model.ops.asarray1i(rows)
+        labels = self.model.ops.asarray1i(labels)
+        d_scores, loss = loss_func(scores, rows, labels)
 
         return float(loss), d_scores
 
@@ -161,29 +158,36 @@ class ArcLabeler(TrainablePipe):
     def predict(self, docs: Iterable[Doc]):
         docs = list(docs)
         heads = heads_predicted(docs, self.model.ops)
-        scores = self.model.predict((docs, heads))
-        return to_numpy(scores.argmax(-1))
+        if self.exported_scorers is None:
+            scores = self.model.predict((docs, heads))
+        else:
+            self.exported_scorers.check_labels(self.labels)
+            X = self.model.ops.flatten(self.model.get_ref("tok2vec").predict(docs))
+            scores = self.exported_scorers.get_layer("bilinear").predict((X, heads))
+        return best_labels(self.model.ops, scores, heads, self.labels)
 
     def set_annotations(self, docs: Iterable[Doc], predictions):
         cdef Doc doc
-        cdef Token token
-
+        cdef int i, offset
+        cdef attr_t root = self.vocab.strings.add('ROOT')
+        cdef const attr_t [::1] label_ids_c = np.array(
+            [self.vocab.strings.add(label) for label in self.labels] or [0], dtype=np.uint64)
+        cdef const int [::1] predictions_c = np.ascontiguousarray(predictions, dtype=np.int32)
+
+        # Tokens are ordered by sentence, which is the same as the order
+        # of the tokens in the doc.
         offset = 0
         for doc in docs:
-            for sent in doc.sents:
-                for token in sent:
-                    label = self.cfg["labels"][predictions[offset]]
-                    doc.c[token.i].dep = self.vocab.strings[label]
-                    offset += 1
-
+            if offset + doc.length > predictions_c.shape[0]:
+                raise ValueError(f"Got {predictions_c.shape[0]} predictions, but the docs have more tokens")
             for i in range(doc.length):
                 if doc.c[i].head == 0:
-                    doc.c[i].dep = self.vocab.strings['ROOT']
-
-            # FIXME: we should enable this, but clears sentence boundaries
-            # set_children_from_heads(doc.c, 0, doc.length)
+                    doc.c[i].dep = root
+                else:
+                    doc.c[i].dep = label_ids_c[predictions_c[offset + i]]
+            offset += doc.length
 
-        assert offset == predictions.shape[0]
+        assert offset == predictions_c.shape[0]
 
     def update(
         self,
@@ -302,28 +306,69 @@ class ArcLabeler(TrainablePipe):
         self.model.initialize()
 
 
+def gold_labels(examples: Iterable[Example], label_to_i: Dict[str, int]) -> Tuple[Ints1d, Ints1d]:
+    """Get the gold labels of the tokens of the predicted docs. Returns the
+    indices of the tokens that have a gold head and label, and the indices
+    of their labels."""
+    rows = []
+    labels = []
+    offset = 0
+    for eg in examples:
+        aligned_heads, aligned_labels = get_aligned_parse(eg)
+        strings = eg.reference.vocab.strings
+        # Do not learn from misaligned tokens, since we could no use
+        # their correct head representations.
+        eg_rows = np.flatnonzero((aligned_heads != -1) & (aligned_labels != 0))
+        # Map the label hashes to label indices.
+        label_hashes, eg_labels = np.unique(aligned_labels[eg_rows], return_inverse=True)
+        label_ids = np.array([label_to_i[strings[int(label)]] for label in label_hashes], dtype=np.int32)
+        rows.append(offset + eg_rows)
+        labels.append(label_ids[eg_labels])
+        offset += aligned_heads.shape[0]
+
+    if not rows:
+        return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32)
+    return np.concatenate(rows).astype(np.int32), np.concatenate(labels).astype(np.int32)
+
+
+def best_labels(ops: Ops, scores: Floats2d, heads: Ints1d, labels: Tuple[str, ...]) -> Ints1d:
+    """Get the index of the best label of each token. The ROOT label is
+    only valid for roots (tokens that are their own head). The heads can
+    come from different decoders (e.g. windowed parsing of long
+    sentences), so this is enforced consistently rather than relying on
+    the model."""
+    if "ROOT" in labels and len(labels) > 1:
+        non_root = heads != ops.xp.arange(heads.shape[0])
+        scores = scores.copy()
+        scores[non_root, labels.index("ROOT")] = -ops.xp.inf
+
+    return to_numpy(scores.argmax(-1))
+
+
 def heads_gold(examples: Iterable[Example], ops: Ops) -> Ints1d:
     heads = []
+    offset = 0
     for eg in examples:
-        aligned_heads, _ = eg.get_aligned_parse(projectivize=False)
-        eg_offset = len(heads)
-        for idx, head in enumerate(aligned_heads):
-            if head == None:
-                heads.append(eg_offset + idx)
-            else:
-                heads.append(eg_offset + head)
+        aligned_heads, _ = get_aligned_parse(eg)
+        # Misaligned tokens are attached to themselves.
+        idx = np.arange(aligned_heads.shape[0], dtype=np.int32)
+        heads.append(offset + np.where(aligned_heads == -1, idx, aligned_heads))
+        offset += aligned_heads.shape[0]
 
-    return ops.asarray1i(heads)
+    return ops.asarray1i(np.concatenate(heads) if heads else [])
 
 def heads_predicted(docs: Iterable[Doc], ops: Ops) -> Ints1d:
-    heads = []
+    """Get the heads of the tokens of the docs, as indices into the
+    concatenation of the docs."""
+    cdef Doc doc
+    cdef int i, offset = 0
+    docs = list(docs)
+    heads = np.empty(sum(len(doc) for doc in docs), dtype=np.int32)
+    cdef int [::1] heads_c = heads
     for doc in docs:
-        doc_offset = len(heads)
-        for idx, token in enumerate(doc):
-            # FIXME: we should always get a head in prediction, make error?
-            if token.head == None:
-                heads.append(doc_offset + idx)
-            else:
-                heads.append(doc_offset + token.head.i)
+        # Heads are stored as offsets, a token without a head has offset 0.
+        for i in range(doc.length):
+            heads_c[offset + i] = offset + i + doc.c[i].head
+        offset += doc.length
 
     return ops.asarray1i(heads)
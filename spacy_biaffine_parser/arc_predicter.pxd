@@ -0,0 +1,4 @@
+from spacy.structs cimport TokenC
+
+
+cdef void set_children(TokenC *tokens, int length) nogil
@@ -1,5 +1,7 @@
 # cython: infer_types=True, profile=True, binding=True
 
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from itertools import islice
 import numpy as np
 from typing import Callable, Dict, Iterable, List, Optional
@@ -8,16 +10,24 @@ from spacy import Language, Vocab
 from spacy.errors import Errors
 from spacy.pipeline.trainable_pipe cimport TrainablePipe
 from spacy.tokens.token cimport Token
+from libcpp.vector cimport vector
+from spacy.structs cimport TokenC
 from spacy.tokens.doc cimport Doc
+from spacy.typedefs cimport attr_t
 from spacy.training import Example, validate_get_examples, validate_examples
 from spacy.util import minibatch
 import srsly
 from thinc.api import Config, Model, Ops, Optimizer
 from thinc.api import to_numpy
-from thinc.types import Floats2d, Ints1d, Tuple
+from thinc.types import Floats1d, Floats2d, Ints1d, Ints2d, Tuple
 
+from .alignment import get_aligned_parse
+from .eisner import eisner_decode_batch
 from .eval import parser_score
-from .mst import mst_decode
+from .exported_scorers import ExportedScorers
+from .mst import mst_decode_batch, mst_decode_sparse_batch
+from .pairwise_bilinear import pad_ragged_scores, ragged_row_offsets
+from .pairwise_bilinear import segment_indices, warm_up
 
 
 default_model_config = """
@@ -43,7 +53,15 @@ DEFAULT_ARC_PREDICTER_MODEL = Config().from_str(default_model_config)["model"]
     assigns=["token.head"],
     default_config={
         "model": DEFAULT_ARC_PREDICTER_MODEL,
-        "scorer": {"@scorers": "biaffine.parser_scorer.v1"}
+        "scorer": {"@scorers": "biaffine.parser_scorer.v1"},
+        "decoder": "mst",
+        "decoder_threads": 1,
+        "head_candidates": None,
+        "decode_workers": 0,
+        "decode_queue_depth": 2,
+        "max_score_cells": None,
+        "max_sentence_length": None,
+        "exported_scorers": None,
     },
 )
 def make_arc_predicter(
@@ -51,8 +69,29 @@ def make_arc_predicter(
     name: str,
     model: Model,
     scorer: Optional[Callable],
+    decoder: str,
+    decoder_threads: int,
+    head_candidates: Optional[int],
+    decode_workers: int,
+    decode_queue_depth: int,
+    max_score_cells: Optional[int],
+    max_sentence_length: Optional[int],
+    exported_scorers: Optional[str],
 ):
-    return ArcPredicter(nlp.vocab, model, name, scorer=scorer)
+    return ArcPredicter(
+        nlp.vocab,
+        model,
+        name,
+        scorer=scorer,
+        decoder=decoder,
+        decoder_threads=decoder_threads,
+        head_candidates=head_candidates,
+        decode_workers=decode_workers,
+        decode_queue_depth=decode_queue_depth,
+        max_score_cells=max_score_cells,
+        max_sentence_length=max_sentence_length,
+        exported_scorers=exported_scorers,
+    )
 
 
 class ArcPredicter(TrainablePipe):
@@ -63,7 +102,15 @@ class ArcPredicter(TrainablePipe):
         name: str = "arc_predicter",
         *,
         overwrite=False,
-        scorer=parser_score
+        scorer=parser_score,
+        decoder: str = "mst",
+        decoder_threads: int = 1,
+        head_candidates: Optional[int] = None,
+        decode_workers: int = 0,
+        decode_queue_depth: int = 2,
+        max_score_cells: Optional[int] = None,
+        max_sentence_length: Optional[int] = None,
+        exported_scorers: Optional[str] = None
     ):
         self.name = name
         self.model = model
@@ -71,44 +118,80 @@ class ArcPredicter(TrainablePipe):
         cfg = {"labels": [], "overwrite": overwrite}
         self.cfg = dict(sorted(cfg.items()))
         self.scorer = scorer
+        # The decoder is a property of the deployment rather than of the
+        # trained model, so it is not stored in the cfg.
+        if decoder not in DECODERS:
+            raise ValueError(f"Unknown decoder '{decoder}', expected one of: {', '.join(DECODERS)}")
+        self.decoder = decoder
+        self.decoder_threads = decoder_threads
+        # Only keep the given number of best heads of each token (plus the
+        # root) before decoding.
+        if head_candidates is not None:
+            if decoder != "mst":
+                raise ValueError(f"Head candidate pruning is only supported by the 'mst' decoder, got '{decoder}'")
+            if head_candidates < 1:
+                raise ValueError(f"The number of head candidates should be at least 1, got {head_candidates}")
+        self.head_candidates = head_candidates
+        # When decode_workers > 0, pipe decodes sentence buckets in that
+        # many background threads, while the model scores the next buckets.
+        # At most decode_queue_depth buckets are scored, but not yet
+        # decoded.
+        if decode_workers < 0:
+            raise ValueError(f"The number of decode workers should not be negative, got {decode_workers}")
+        if decode_queue_depth < 1:
+            raise ValueError(f"The decode queue depth should be at least 1, got {decode_queue_depth}")
+        self.decode_workers = decode_workers
+        self.decode_queue_depth = decode_queue_depth
+        # Upper bound on the number of cells of the padded score matrices
+        # that pipe computes at once, since they are quadratic in the
+        # sentence length.
+        if max_score_cells is not None and max_score_cells < 1:
+            raise ValueError(f"The maximum number of score cells should be at least 1, got {max_score_cells}")
+        self.max_score_cells = max_score_cells
+        # Longer sentences are parsed in overlapping windows of this length,
+        # which bounds the cost of a sentence at some loss of accuracy.
+        # Windows of a single token cannot overlap, so they could not be
+        # stitched into a tree.
+        if max_sentence_length is not None and max_sentence_length < 2:
+            raise ValueError(f"The maximum sentence length should be at least 2, got {max_sentence_length}")
+        self.max_sentence_length = max_sentence_length
+        # Score with scorers that were exported by export_scorers, rather
+        # than with the PyTorch models.
+        self.exported_scorers = None
+        if exported_scorers is not None:
+            self.exported_scorers = ExportedScorers(exported_scorers)
+            self.exported_scorers.get_layer("pairwise_bilinear")
 
     def get_loss(self, examples: Iterable[Example], scores) -> Tuple[float, Floats2d]:
         validate_examples(examples, "ArcPredicter.get_loss")
-
-        def loss_func(guesses, target, mask):
-            d_scores = guesses - target
-            d_scores *= mask
-            loss = (d_scores ** 2).sum()
-            return d_scores, loss
-
-        target = np.zeros_like(scores)
-        mask = np.zeros(scores.shape[0], dtype=scores.dtype)
-
-        offset = 0
-        for eg in examples:
-            aligned_heads, _ = eg.get_aligned_parse(projectivize=False)
-            for sent in eg.predicted.sents:
-                for token in sent:
-                    gold_head = aligned_heads[token.i]
-                    if gold_head is not None:
-                        # We only use the loss for token for which the correct head
-                        # lies within the sentence boundaries.
-                        if gold_head >= sent.start and gold_head < sent.end:
-                            gold_head_idx = gold_head - sent.start
-                            target[offset, gold_head_idx] = 1.0
-                            mask[offset] = 1
-
-                    offset += 1
-
-        assert offset == target.shape[0]
-
-        target = self.model.ops.asarray2f(target)
-        mask = self.model.ops.asarray2f(np.expand_dims(mask, -1))
-
-        d_scores, loss = loss_func(scores, target, mask)
-
+        d_scores, loss = self._arc_loss(examples, scores)
         return float(loss), d_scores
 
+    def _arc_loss(self, examples: Iterable[Example], scores):
+        # Squared error against one-hot targets, computed from the indices
+        # of the gold heads, so that no dense target is needed.
+        ops = self.model.ops
+        rows, heads = gold_sent_heads(examples)
+
+        if scores.ndim == 2:
+            assert sum(len(eg.predicted) for eg in examples) == scores.shape[0]
+            rows = ops.asarray1i(rows)
+            d_scores = ops.alloc2f(*scores.shape)
+            d_scores[rows] = scores[rows]
+            d_scores[rows, ops.asarray1i(heads)] -= 1.0
+            return d_scores, (d_scores ** 2).sum()
+
+        # Ragged scores: the row of a token is as long as its sentence.
+        lens = np.concatenate([doc_sent_lens(eg.predicted) for eg in examples])
+        assert int((lens.astype(np.int64) ** 2).sum()) == scores.shape[0]
+        row_offsets = ragged_row_offsets(lens)[rows]
+        row_lens = np.repeat(lens, lens)[rows]
+        elements = ops.asarray(segment_indices(row_offsets, row_lens))
+        d_scores = ops.alloc1f(scores.shape[0])
+        d_scores[elements] = scores[elements]
+        d_scores[ops.asarray(row_offsets + heads)] -= 1.0
+        return d_scores, (d_scores ** 2).sum()
+
     def initialize(
         self, get_examples: Callable[[], Iterable[Example]], *, nlp: Language = None
     ):
@@ -132,64 +215,204 @@ class ArcPredicter(TrainablePipe):
     def pipe(self, docs, *, int batch_size=128):
         cdef Doc doc
         error_handler = self.get_error_handler()
-        for batch in minibatch(docs, size=batch_size):
-            batch_in_order = list(batch)
-            try:
-                by_length = sorted(batch, key=lambda doc: len(doc))
-                for subbatch in minibatch(by_length, size=max(batch_size//4, 2)):
-                    subbatch = list(subbatch)
-                    predictions = self.predict(subbatch)
-                    self.set_annotations(subbatch, predictions)
-                yield from batch_in_order
-            except Exception as e:
-                error_handler(self.name, self, batch_in_order, e)
+        executor = None
+        if self.decode_workers > 0:
+            executor = ThreadPoolExecutor(max_workers=self.decode_workers)
+        try:
+            for batch in minibatch(docs, size=batch_size):
+                batch_in_order = list(batch)
+                try:
+                    self._pipe_batch(batch_in_order, max(batch_size//4, 2), executor)
+                    yield from batch_in_order
+                except Exception as e:
+                    error_handler(self.name, self, batch_in_order, e)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+    def _pipe_batch(self, docs: List[Doc], int bucket_size, executor: Optional[ThreadPoolExecutor]):
+        heads = self._predict_heads(docs, bucket_size, executor)
+        self.set_annotations(docs, heads)
 
     def predict(self, docs: Iterable[Doc]):
         docs = list(docs)
-        lens = sents2lens(docs, ops=self.model.ops)
-        scores = self.model.predict((docs, lens))
-
-        lens = to_numpy(lens)
-        scores = to_numpy(scores)
+        return self._predict_heads(docs, None, None)
+
+    def _predict_heads(self, docs: List[Doc], bucket_size: Optional[int], executor: Optional[ThreadPoolExecutor], X: Optional[Floats2d] = None):
+        # The pairwise scores are quadratic in the sentence length and
+        # sentences are padded to the longest sentence that they are scored
+        # with. So, rather than scoring documents together, the sentences of
+        # the whole batch are bucketed by length, within the score cell
+        # budget. The token representations are computed once for all
+        # documents, unless they are passed as X.
+        #
+        # Sentences that are longer than max_sentence_length are scored and
+        # decoded in overlapping windows, which are then stitched into a
+        # tree for the whole sentence.
+        #
+        # If an executor is given, buckets are decoded by the executor while
+        # the model scores the next buckets. The decoders release the GIL,
+        # so decoding runs in parallel with the model.
+        ops = self.model.ops
+        doc_lens = [doc_sent_lens(doc) for doc in docs]
+        doc_n_sents = [len(sent_lens) for sent_lens in doc_lens]
+        lens = np.concatenate(doc_lens) if doc_lens else np.empty(0, dtype=np.int32)
+        if lens.sum() == 0:
+            return [[] for _ in docs]
+
+        # Split sentences into units that are scored and decoded: either a
+        # sentence or a window of a long sentence.
+        starts = np.cumsum(lens) - lens
+        sent_windows = [[0] for _ in range(len(lens))]
+        if self.max_sentence_length is not None:
+            for sent_idx in np.flatnonzero(lens > self.max_sentence_length):
+                sent_windows[sent_idx] = window_starts(lens[sent_idx], self.max_sentence_length)
+        unit_starts = []
+        unit_lens = []
+        for sent_idx, windows in enumerate(sent_windows):
+            for start in windows:
+                unit_starts.append(starts[sent_idx] + start)
+                unit_lens.append(min(lens[sent_idx] - start, self.max_sentence_length or lens[sent_idx]))
+        unit_starts = np.array(unit_starts, dtype=np.int32)
+        unit_lens = np.array(unit_lens, dtype=np.int32)
+        has_windows = len(unit_lens) != len(lens)
+
+        if X is None:
+            X = ops.flatten(self.model.get_ref("tok2vec").predict(docs))
+        pairwise_bilinear = self._get_scorer("pairwise_bilinear")
+
+        unit_heads = [None] * len(unit_lens)
+        unit_scores = [None] * len(unit_lens)
+        pending = deque()
+
+        def collect(bucket, decoded):
+            flat_heads, flat_scores = decoded
+            offset = 0
+            for unit_idx in bucket:
+                unit_heads[unit_idx] = flat_heads[offset:offset + unit_lens[unit_idx]]
+                if flat_scores is not None:
+                    unit_scores[unit_idx] = flat_scores[offset:offset + unit_lens[unit_idx]]
+                offset += unit_lens[unit_idx]
+
+        if bucket_size is None:
+            bucket_size = len(unit_lens)
+
+        try:
+            for bucket in length_buckets(unit_lens, bucket_size, self.max_score_cells):
+                bucket_lens = unit_lens[bucket]
+                bucket_starts = np.cumsum(bucket_lens) - bucket_lens
+                rows = np.repeat(unit_starts[bucket] - bucket_starts, bucket_lens) + np.arange(bucket_lens.sum())
+                bucket_lens = ops.asarray1i(bucket_lens)
+                scores = pairwise_bilinear.predict((X[ops.asarray1i(rows)], bucket_lens))
+
+                if executor is None:
+                    collect(bucket, self._decode_units(bucket_lens, scores, has_windows))
+                    continue
+
+                pending.append((bucket, executor.submit(self._decode_units, bucket_lens, scores, has_windows)))
+                if len(pending) >= self.decode_queue_depth:
+                    bucket, decoded = pending.popleft()
+                    collect(bucket, decoded.result())
+            while pending:
+                bucket, decoded = pending.popleft()
+                collect(bucket, decoded.result())
+        finally:
+            # Do not leave decoders running when an error occurs.
+            for _, decoded in pending:
+                decoded.cancel()
+
+        sent_heads = []
+        unit_idx = 0
+        for sent_idx, windows in enumerate(sent_windows):
+            if len(windows) == 1:
+                sent_heads.append(unit_heads[unit_idx])
+            else:
+                sent_units = range(unit_idx, unit_idx + len(windows))
+                sent_heads.append(stitch_windows(
+                    lens[sent_idx], windows,
+                    [unit_heads[i] for i in sent_units],
+                    [unit_scores[i] for i in sent_units],
+                ))
+            unit_idx += len(windows)
 
         heads = []
-        sent_offset = 0
-        for doc in docs:
-            doc_heads = []
-            for sent in doc.sents:
-                sent_heads = mst_decode(scores[sent_offset:sent_offset + lens[0], :lens[0]])
-                doc_heads.append(sent_heads)
-
-                sent_offset += lens[0]
-                lens = lens[1:]
-
-            heads.append(doc_heads)
-
-        assert len(lens) == 0
-        assert sent_offset == scores.shape[0]
+        sent_idx = 0
+        for n_sents in doc_n_sents:
+            heads.append(sent_heads[sent_idx:sent_idx + n_sents])
+            sent_idx += n_sents
 
         return heads
 
+    def _get_scorer(self, name: str) -> Model:
+        if self.exported_scorers is not None:
+            return self.exported_scorers.get_layer(name)
+        return self.model.get_ref(name)
+
+    def _decode_units(self, lens: Ints1d, scores: Floats2d, bint with_scores):
+        flat_heads = self._decode_flat(lens, scores)
+        if not with_scores:
+            return flat_heads, None
+
+        # Scores of the chosen edges, used to stitch windows.
+        ops = self.model.ops
+        if scores.ndim == 1:
+            flat_scores = scores[ops.asarray(ragged_row_offsets(to_numpy(lens)) + flat_heads)]
+        else:
+            flat_scores = scores[ops.xp.arange(flat_heads.shape[0]), ops.asarray1i(flat_heads)]
+        return flat_heads, to_numpy(flat_scores)
+
+    def _decode_flat(self, lens: Ints1d, scores: Floats2d):
+        # Decode all sentences of the batch at once.
+        if self.head_candidates is None:
+            decode = DECODERS[self.decoder]
+            return decode(to_numpy(scores), to_numpy(lens), n_threads=self.decoder_threads)
+        else:
+            return self._decode_pruned(scores, lens)
+
+    def _decode_pruned(self, scores: Floats2d, lens: Ints1d):
+        # Pruning is done on the device of the model, so that only the
+        # candidates are copied to the host.
+        ops = self.model.ops
+        candidates, candidate_scores = prune_heads(ops, scores, lens, self.head_candidates)
+        # Every token is its own root candidate and sentences may have
+        # several roots, so the candidates of every sentence contain a
+        # spanning tree and no fallback to the full scores is needed.
+        flat_heads, has_tree = mst_decode_sparse_batch(
+            to_numpy(candidates), to_numpy(candidate_scores), to_numpy(lens), n_threads=self.decoder_threads
+        )
+        assert has_tree.all()
+
+        return flat_heads
+
     def set_annotations(self, docs: Iterable[Doc], heads):
         cdef Doc doc
-        cdef Token token
+        cdef const int [::1] heads_c
+        cdef int i, head
+        # FIXME: Set the dependency relation to a stub, so that we can
+        # evaluate UAS.
+        cdef attr_t dep = self.vocab.strings.add('dep')
+        cdef attr_t root = self.vocab.strings.add('ROOT')
 
         for (doc, doc_heads) in zip(docs, heads):
-            for (sent, sent_heads) in zip(doc.sents, doc_heads):
-                for i, head in enumerate(sent_heads):
-                    dep_i = sent.start + i
-                    head_i = sent.start + head
-                    doc.c[dep_i].head = head_i - dep_i
-                    # FIXME: Set the dependency relation to a stub, so that
-                    # we can evaluate UAS.
-                    doc.c[dep_i].dep = self.vocab.strings['dep']
+            if doc.length == 0:
+                continue
+
+            # Convert sentence-relative heads to heads within the doc.
+            sent_lens = np.array([len(sent_heads) for sent_heads in doc_heads], dtype=np.int32)
+            if sent_lens.sum() != doc.length:
+                raise ValueError(f"Got {sent_lens.sum()} heads for a doc of {doc.length} tokens")
+            sent_starts = np.cumsum(sent_lens) - sent_lens
+            heads_c = (np.concatenate(doc_heads) + np.repeat(sent_starts, sent_lens)).astype(np.int32)
 
             for i in range(doc.length):
-                if doc.c[i].head == 0:
-                    doc.c[i].dep = self.vocab.strings['ROOT']
+                head = heads_c[i]
+                doc.c[i].head = head - i
+                doc.c[i].dep = root if head == i else dep
 
-            # FIXME: we should enable this, but clears sentence boundaries
-            # set_children_from_heads(doc.c, 0, doc.length)
+            # spaCy's set_children_from_heads also resets the sentence
+            # boundaries from the tree, so use our own.
+            with nogil:
+                set_children(doc.c, doc.length)
 
     def update(
         self,
@@ -237,6 +460,7 @@ class ArcPredicter(TrainablePipe):
             "model": lambda b: self.model.from_bytes(b),
         }
         spacy.util.from_bytes(bytes_data, model_deserializers, exclude)
+        warm_up(self.model)
 
         return self
 
@@ -278,6 +502,7 @@ class ArcPredicter(TrainablePipe):
             "model": load_model,
         }
         spacy.util.from_disk(path, model_deserializers, exclude)
+        warm_up(self.model)
 
         return self
 
@@ -291,11 +516,247 @@ class ArcPredicter(TrainablePipe):
 
         self.model.initialize()
 
+cdef void set_children(TokenC *tokens, int length) nogil:
+    """Set the number of left/right children and the left/right edges of
+    the subtrees of the tokens from their heads, in time linear in the
+    number of tokens. In contrast to spaCy's set_children_from_heads, the
+    sentence boundaries are left untouched."""
+    cdef int i, head, child, k
+    # Children of each token in CSR format.
+    cdef vector[int] child_offsets = vector[int](length + 1, 0)
+    cdef vector[int] children = vector[int](length)
+    cdef vector[int] fill
+    # Tokens in breadth-first order, starting at the roots.
+    cdef vector[int] order
+    order.reserve(length)
+
+    for i in range(length):
+        tokens[i].l_kids = 0
+        tokens[i].r_kids = 0
+        tokens[i].l_edge = i
+        tokens[i].r_edge = i
+
+    for i in range(length):
+        head = i + tokens[i].head
+        if head == i:
+            order.push_back(i)
+            continue
+        if head > i:
+            tokens[head].l_kids += 1
+        else:
+            tokens[head].r_kids += 1
+        child_offsets[head + 1] += 1
+
+    for i in range(length):
+        child_offsets[i + 1] += child_offsets[i]
+    fill = child_offsets
+    for i in range(length):
+        head = i + tokens[i].head
+        if head != i:
+            children[fill[head]] = i
+            fill[head] += 1
+
+    k = 0
+    while k < <int> order.size():
+        head = order[k]
+        for child in range(child_offsets[head], child_offsets[head + 1]):
+            order.push_back(children[child])
+        k += 1
+
+    # Extend the edges of the heads, children before their heads. Tokens
+    # that are in a cycle are not reachable from a root and only span
+    # themselves.
+    for k in range(<int> order.size() - 1, -1, -1):
+        child = order[k]
+        head = child + tokens[child].head
+        if head != child:
+            tokens[head].l_edge = min(tokens[head].l_edge, tokens[child].l_edge)
+            tokens[head].r_edge = max(tokens[head].r_edge, tokens[child].r_edge)
+
+
 def sents2lens(docs: List[Doc], *, ops: Ops) -> Ints1d:
     """Get the lengths of sentences."""
-    lens = []
-    for doc in docs:
-        for sent in doc.sents:
-            lens.append(sent.end - sent.start)
-
-    return ops.asarray1i(lens)
+    if not docs:
+        return ops.alloc1i(0)
+    return ops.asarray1i(np.concatenate([doc_sent_lens(doc) for doc in docs]))
+
+
+def doc_sent_lens(Doc doc) -> Ints1d:
+    """Get the lengths of the sentences of a doc, as an int32 array. This
+    gives the same lengths as iterating over `doc.sents`, but reads the
+    sentence starts of the tokens directly."""
+    if "sents" in doc.user_hooks:
+        return np.array([sent.end - sent.start for sent in doc.sents], dtype=np.int32)
+
+    lens = np.empty(doc.length, dtype=np.int32)
+    cdef int [::1] lens_c = lens
+    cdef int i, n_sents = 0, start = 0
+    cdef bint has_sent_starts = doc.length == 1
+    for i in range(1, doc.length):
+        if doc.c[i].sent_start != 0:
+            has_sent_starts = True
+        if doc.c[i].sent_start == 1:
+            lens_c[n_sents] = i - start
+            n_sents += 1
+            start = i
+    if doc.length != 0:
+        if not has_sent_starts:
+            raise ValueError(Errors.E030)
+        lens_c[n_sents] = doc.length - start
+        n_sents += 1
+
+    return lens[:n_sents]
+
+
+def gold_sent_heads(examples: Iterable[Example]) -> Tuple[Ints1d, Ints1d]:
+    """Get the gold heads of the tokens of the predicted docs. Returns the
+    indices of the tokens (in the order of the sentences of the docs) that
+    have a gold head and their heads, relative to the sentence start. We
+    only use tokens for which the correct head lies within the sentence
+    boundaries."""
+    rows = []
+    heads = []
+    offset = 0
+    for eg in examples:
+        # Misaligned tokens have head -1, so they are never in the sentence.
+        aligned_heads, _ = get_aligned_parse(eg)
+        sent_lens = doc_sent_lens(eg.predicted)
+        sent_starts = np.repeat(np.cumsum(sent_lens) - sent_lens, sent_lens)
+        sent_ends = sent_starts + np.repeat(sent_lens, sent_lens)
+        in_sent = (aligned_heads >= sent_starts) & (aligned_heads < sent_ends)
+        rows.append(offset + np.flatnonzero(in_sent))
+        heads.append(aligned_heads[in_sent] - sent_starts[in_sent])
+        offset += aligned_heads.shape[0]
+
+    if not rows:
+        return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32)
+    return np.concatenate(rows).astype(np.int32), np.concatenate(heads).astype(np.int32)
+
+
+def length_buckets(lens: Ints1d, int max_sents, max_score_cells: Optional[int] = None) -> List[Ints1d]:
+    """Split sentences into buckets of sentences with similar lengths. A
+    bucket has at most `max_sents` sentences. If `max_score_cells` is set,
+    the padded score matrices of a bucket (number of sentences times the
+    squared length of the longest sentence) have at most that many cells,
+    except for sentences that exceed the budget by themselves. These are
+    put in a bucket of their own. Returns the indices of the sentences in
+    each bucket."""
+    buckets = []
+    bucket = []
+    for sent_idx in np.argsort(lens, kind="stable"):
+        # Sentences are sorted by length, so the current sentence is the
+        # longest sentence of the bucket.
+        n_cells = (len(bucket) + 1) * int(lens[sent_idx]) ** 2
+        if bucket and (len(bucket) == max_sents or (max_score_cells is not None and n_cells > max_score_cells)):
+            buckets.append(np.array(bucket))
+            bucket = []
+        bucket.append(sent_idx)
+    if bucket:
+        buckets.append(np.array(bucket))
+    return buckets
+
+
+def window_starts(int seq_len, int window_size) -> List[int]:
+    """Get the start positions of windows of `window_size` tokens that
+    cover a sentence of `seq_len` tokens. Consecutive windows overlap by at
+    least a quarter of the window size and by at least one token, so that
+    tokens near the window boundaries also get a head in a window where
+    they have more context and the window trees can be stitched. The
+    window size should be at least 2."""
+    if seq_len <= window_size:
+        return [0]
+    stride = window_size - max(1, window_size // 4)
+    n_windows = -(-(seq_len - window_size) // stride) + 1
+    return np.rint(np.linspace(0, seq_len - window_size, n_windows)).astype(int).tolist()
+
+
+def stitch_windows(int seq_len, starts: List[int], window_heads: List[Ints1d], window_scores: List[Floats1d]) -> Ints1d:
+    """Combine the trees of the overlapping windows of a sentence into a
+    tree for the whole sentence. Heads are relative to the start of the
+    window (`window_heads`) and `window_scores` contains the score of each
+    head. The result is the maximum spanning tree over the edges of the
+    window trees, so the heads of tokens that are in two windows are
+    chosen such that they do not form a cycle."""
+    n_windows = np.zeros(seq_len, dtype=np.int32)
+    for start, heads in zip(starts, window_heads):
+        n_windows[start:start + len(heads)] += 1
+
+    # The candidates of a token are its heads in the windows that contain
+    # it. A window root is a root candidate, since its head is itself.
+    candidates = np.full((seq_len, n_windows.max()), -1, dtype=np.int32)
+    candidate_scores = np.zeros(candidates.shape, dtype=np.float32)
+    n_filled = np.zeros(seq_len, dtype=np.int32)
+    for start, heads, scores in zip(starts, window_heads, window_scores):
+        tokens = np.arange(start, start + len(heads))
+        candidates[tokens, n_filled[tokens]] = heads + start
+        candidate_scores[tokens, n_filled[tokens]] = scores
+        n_filled[tokens] += 1
+
+    # If every window is decoded to a tree, the candidates contain a
+    # spanning tree. Otherwise (greedy decoding), pick the best head of
+    # each token, like the greedy decoder does.
+    heads, has_tree = mst_decode_sparse_batch(candidates, candidate_scores, [seq_len])
+    if not has_tree[0]:
+        candidate_scores[candidates == -1] = -np.inf
+        heads = candidates[np.arange(seq_len), candidate_scores.argmax(-1)]
+    return heads
+
+
+def prune_heads(ops: Ops, scores: Floats2d, lens: Ints1d, n_candidates: int) -> Tuple[Ints2d, Floats2d]:
+    """Keep the `n_candidates` highest-scoring heads of each token, plus the
+    token itself as the root candidate. Returns the candidate heads and
+    their scores in the format of `mst_decode_sparse_batch`, as arrays of
+    `ops`. Unused candidate slots, because a sentence has fewer tokens than
+    `n_candidates`, are set to -1. Ragged scores are padded on the device
+    of `ops`."""
+    xp = ops.xp
+    if scores.ndim == 1:
+        scores = pad_ragged_scores(scores, lens)
+    n_tokens, max_len = scores.shape
+    lens = ops.asarray1i(lens)
+    ends = xp.cumsum(lens)
+    sent_idx = xp.searchsorted(ends, xp.arange(n_tokens), side="right")
+    positions = xp.arange(n_tokens) - (ends - lens)[sent_idx]
+
+    heads = xp.arange(max_len)
+    is_candidate = (heads < lens[sent_idx][:, None]) & (heads != positions[:, None])
+    n_candidates = min(n_candidates, max_len)
+    if n_candidates < max_len:
+        masked = xp.where(is_candidate, scores, -xp.inf)
+        top = xp.argpartition(-masked, n_candidates - 1, axis=1)[:, :n_candidates]
+    else:
+        top = xp.broadcast_to(heads, (n_tokens, max_len))
+
+    candidates = xp.where(xp.take_along_axis(is_candidate, top, axis=1), top, -1)
+    candidates = xp.concatenate([candidates, positions[:, None]], axis=1)
+    candidate_scores = xp.concatenate(
+        [xp.take_along_axis(scores, top, axis=1), scores[xp.arange(n_tokens), positions][:, None]],
+        axis=1,
+    )
+
+    return ops.asarray2i(candidates), candidate_scores
+
+
+def greedy_decode_batch(scores, lengths, *, n_threads: int = 1):
+    """Pick the highest-scoring head for each token. In contrast to the
+    other decoders, this does not guarantee that the heads form a tree.
+    The scores and lengths are as in `mst_decode_batch`, `n_threads` is
+    unused."""
+    if scores.shape[0] == 0:
+        return np.empty(0, dtype=np.int32)
+    lengths = np.asarray(lengths)
+    if scores.ndim == 1:
+        return pad_ragged_scores(scores, lengths, fill=-np.inf).argmax(-1).astype(np.int32)
+    token_lens = np.repeat(lengths, lengths)
+    in_sent = np.arange(scores.shape[1]) < token_lens[:, None]
+    return np.where(in_sent, scores, -np.inf).argmax(-1).astype(np.int32)
+
+
+# Decoders that can be selected through the `decoder` setting. Each
+# decoder returns the sentence-relative head of each token, with sentence
+# roots attaching to themselves.
+DECODERS = {
+    "mst": mst_decode_batch,
+    "eisner": eisner_decode_batch,
+    "greedy": greedy_decode_batch,
+}
@@ -0,0 +1,108 @@
+from typing import List, Optional, Tuple, cast
+
+from spacy import registry
+from spacy.tokens.doc import Doc
+from thinc.api import Model, chain, list2array
+from thinc.shims.pytorch_grad_scaler import PyTorchGradScaler
+from thinc.types import Floats2d, Ints1d
+
+from .bilinear import build_bilinear_layer
+from .pairwise_bilinear import build_pairwise_bilinear_layer
+
+
+@registry.architectures("BiaffineParser.v1")
+def build_biaffine_parser(
+    tok2vec: Model[List[Doc], List[Floats2d]],
+    nO: Optional[int] = None,
+    *,
+    dropout: float = 0.1,
+    arc_hidden_width: int = 128,
+    label_hidden_width: int = 128,
+    mixed_precision: bool = False,
+    grad_scaler: Optional[PyTorchGradScaler] = None,
+    inference_precision: str = "fp32",
+    inference_buckets: Optional[List[int]] = None,
+    length_buckets: Optional[List[int]] = None,
+    ragged_scores: bool = False
+) -> Model[Tuple[List[Doc], Ints1d, Ints1d], Tuple[Floats2d, Floats2d]]:
+    """Build a model that scores both arcs and labels from one shared token
+    representation. The model takes the docs, the sentence lengths and the
+    head of every token (as an index into the concatenated docs) and
+    returns the pairwise arc scores and the label scores. `nO` is the
+    number of labels. `inference_buckets` are the bucket lengths of the
+    traced arc scorer, `length_buckets` the lengths at which sentences
+    are split for arc scoring and `ragged_scores` returns the arc scores
+    in the ragged format (see `PairwiseBilinear.v1`)."""
+    nI = None
+    if tok2vec.has_dim("nO") is True:
+        nI = tok2vec.get_dim("nO")
+
+    pairwise_bilinear = build_pairwise_bilinear_layer(
+        nI,
+        1,
+        dropout=dropout,
+        hidden_width=arc_hidden_width,
+        mixed_precision=mixed_precision,
+        grad_scaler=grad_scaler,
+        inference_precision=inference_precision,
+        inference_buckets=inference_buckets,
+        length_buckets=length_buckets,
+        ragged_scores=ragged_scores,
+    )
+    bilinear = build_bilinear_layer(
+        nI,
+        nO,
+        dropout=dropout,
+        hidden_width=label_hidden_width,
+        mixed_precision=mixed_precision,
+        grad_scaler=grad_scaler,
+        inference_precision=inference_precision,
+    )
+
+    model: Model[Tuple[List[Doc], Ints1d, Ints1d], Tuple[Floats2d, Floats2d]] = Model(
+        "biaffine_parser",
+        forward=biaffine_parser_forward,
+        init=biaffine_parser_init,
+        layers=[
+            chain(tok2vec, cast(Model[List[Floats2d], Floats2d], list2array())),
+            pairwise_bilinear,
+            bilinear,
+        ],
+    )
+    model.set_ref("tok2vec", tok2vec)
+    model.set_ref("pairwise_bilinear", pairwise_bilinear)
+    model.set_ref("bilinear", bilinear)
+
+    return model
+
+
+def biaffine_parser_init(model: Model, X=None, Y=None):
+    tok2vec, pairwise_bilinear, bilinear = model.layers
+    if X is None:
+        tok2vec.initialize()
+        pairwise_bilinear.initialize()
+        bilinear.initialize()
+        return
+
+    docs, lens, heads = X
+    tok2vec.initialize(X=docs)
+    X_flat = tok2vec.predict(docs)
+    pairwise_bilinear.initialize(X=(X_flat, lens))
+    bilinear.initialize(X=(X_flat, heads))
+
+
+def biaffine_parser_forward(model: Model, X, is_train: bool):
+    tok2vec, pairwise_bilinear, bilinear = model.layers
+    docs, lens, heads = X
+
+    X_flat, backprop_tok2vec = tok2vec(docs, is_train)
+    arc_scores, backprop_arcs = pairwise_bilinear((X_flat, lens), is_train)
+    label_scores, backprop_labels = bilinear((X_flat, heads), is_train)
+
+    def backprop(dY: Tuple[Floats2d, Floats2d]):
+        d_arc_scores, d_label_scores = dY
+        dX_arcs, _ = backprop_arcs(d_arc_scores)
+        dX_labels, _ = backprop_labels(d_label_scores)
+        return backprop_tok2vec(dX_arcs + dX_labels), lens, heads
+
+    return (arc_scores, label_scores), backprop
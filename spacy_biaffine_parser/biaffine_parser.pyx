@@ -0,0 +1,303 @@
+# cython: infer_types=True, profile=True, binding=True
+
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+import numpy as np
+from typing import Callable, Dict, Iterable, List, Optional
+from spacy import Language, Vocab
+from spacy.errors import Errors
+from spacy.tokens.doc cimport Doc
+from spacy.typedefs cimport attr_t
+from spacy.training import Example, validate_get_examples, validate_examples
+from thinc.api import Config, Model, Optimizer
+from thinc.types import Floats2d, Ints1d, Tuple
+
+from .arc_labeler import best_labels, gold_labels, heads_gold
+from .arc_predicter cimport set_children
+from .arc_predicter import ArcPredicter, sents2lens
+from .biaffine import build_biaffine_parser
+from .eval import parser_score
+
+
+default_model_config = """
+[model]
+@architectures = "BiaffineParser.v1"
+arc_hidden_width = 64
+label_hidden_width = 64
+
+[model.tok2vec]
+@architectures = "spacy.HashEmbedCNN.v2"
+pretrained_vectors = null
+width = 96
+depth = 4
+embed_size = 300
+window_size = 1
+maxout_pieces = 3
+subword_features = true
+"""
+DEFAULT_BIAFFINE_PARSER_MODEL = Config().from_str(default_model_config)["model"]
+
+@Language.factory(
+    "biaffine_parser",
+    assigns=["token.head", "token.dep"],
+    default_config={
+        "model": DEFAULT_BIAFFINE_PARSER_MODEL,
+        "scorer": {"@scorers": "biaffine.parser_scorer.v1"},
+        "decoder": "mst",
+        "decoder_threads": 1,
+        "head_candidates": None,
+        "decode_workers": 0,
+        "decode_queue_depth": 2,
+        "max_score_cells": None,
+        "max_sentence_length": None,
+        "exported_scorers": None,
+    },
+)
+def make_biaffine_parser(
+    nlp: Language,
+    name: str,
+    model: Model,
+    scorer: Optional[Callable],
+    decoder: str,
+    decoder_threads: int,
+    head_candidates: Optional[int],
+    decode_workers: int,
+    decode_queue_depth: int,
+    max_score_cells: Optional[int],
+    max_sentence_length: Optional[int],
+    exported_scorers: Optional[str],
+):
+    return BiaffineParser(
+        nlp.vocab,
+        model,
+        name,
+        scorer=scorer,
+        decoder=decoder,
+        decoder_threads=decoder_threads,
+        head_candidates=head_candidates,
+        decode_workers=decode_workers,
+        decode_queue_depth=decode_queue_depth,
+        max_score_cells=max_score_cells,
+        max_sentence_length=max_sentence_length,
+        exported_scorers=exported_scorers,
+    )
+
+
+class BiaffineParser(ArcPredicter):
+    """Parser that predicts both heads and labels. The arc and label scores
+    are computed from the same token representations, and labels are
+    predicted from the decoded heads directly. This replaces a pipeline
+    with separate arc_predicter and arc_labeler components. The decoding
+    settings are the same as those of ArcPredicter."""
+
+    def __init__(
+        self,
+        vocab: Vocab,
+        model: Model,
+        name: str = "biaffine_parser",
+        **kwargs
+    ):
+        super().__init__(vocab, model, name, **kwargs)
+        self._label_to_i = None
+        if self.exported_scorers is not None:
+            self.exported_scorers.get_layer("bilinear")
+
+    @property
+    def labels(self):
+        return tuple(self.cfg["labels"])
+
+    def add_label(self, label):
+        """Add a new label to the pipe.
+
+        label (str): The label to add.
+        RETURNS (int): 0 if label is already present, otherwise 1.
+        """
+        if not isinstance(label, str):
+            raise ValueError(Errors.E187)
+        if label in self.labels:
+            return 0
+        self.cfg["labels"].append(label)
+        self.vocab.strings.add(label)
+        return 1
+
+    def get_loss(self, examples: Iterable[Example], scores) -> Tuple[float, Tuple[Floats2d, Floats2d]]:
+        validate_examples(examples, "BiaffineParser.get_loss")
+
+        def loss_func(guesses, rows, targets):
+            # Squared error against one-hot targets, computed from the
+            # indices of the targets, so that no dense target is needed.
+            d_scores = self.model.ops.alloc2f(*guesses.shape)
+            d_scores[rows] = guesses[rows]
+            d_scores[rows, targets] -= 1.0
+            loss = (d_scores ** 2).sum()
+            return d_scores, loss
+
+        arc_scores, label_scores = scores
+        assert sum(len(eg.predicted) for eg in examples) == label_scores.shape[0]
+
+        ops = self.model.ops
+        d_arc_scores, arc_loss = self._arc_loss(examples, arc_scores)
+        rows, labels = gold_labels(examples, self._label_to_i)
+        d_label_scores, label_loss = loss_func(label_scores, ops.asarray1i(rows), ops.asarray1i(labels))
+
+        return float(arc_loss + label_loss), (d_arc_scores, d_label_scores)
+
+    def initialize(
+        self, get_examples: Callable[[], Iterable[Example]], *, nlp: Language = None
+    ):
+        validate_get_examples(get_examples, "BiaffineParser.initialize")
+
+        labels = set()
+        for example in get_examples():
+            for token in example.reference:
+                if token.dep != 0:
+                    labels.add(token.dep_)
+        for label in sorted(labels):
+            self.add_label(label)
+        self._label_to_i = {label: i for i, label in enumerate(self.labels)}
+
+        examples = list(islice(get_examples(), 10))
+        doc_sample = [example.predicted for example in examples]
+        # For initialization, we don't need correct sentence boundaries.
+        lengths_sample = self.model.ops.asarray1i([len(doc) for doc in doc_sample])
+        heads_sample = heads_gold(examples, self.model.ops)
+
+        bilinear = self.model.get_ref("bilinear")
+        if bilinear.has_dim("nO") is None:
+            bilinear.set_dim("nO", len(self.labels))
+        self.model.initialize(X=(doc_sample, lengths_sample, heads_sample))
+
+        # Store the input dimensionality. nI and nO are not stored explicitly
+        # for PyTorch models. This makes it tricky to reconstruct the model
+        # during deserialization. So, besides storing the labels, we also
+        # store the number of inputs.
+        pairwise_bilinear = self.model.get_ref("pairwise_bilinear")
+        self.cfg["nI"] = pairwise_bilinear.get_dim("nI")
+
+    def _pipe_batch(self, docs: List[Doc], int bucket_size, executor: Optional[ThreadPoolExecutor]):
+        self.set_annotations(docs, self._predict(docs, bucket_size, executor))
+
+    def predict(self, docs: Iterable[Doc]):
+        docs = list(docs)
+        return self._predict(docs, None, None)
+
+    def _predict(self, docs: List[Doc], bucket_size: Optional[int], executor: Optional[ThreadPoolExecutor]):
+        if not any(len(doc) for doc in docs):
+            return [[] for _ in docs], np.empty(0, dtype=np.int32)
+
+        # Heads and labels are predicted from the same token
+        # representations.
+        ops = self.model.ops
+        X = ops.flatten(self.model.get_ref("tok2vec").predict(docs))
+        heads = self._predict_heads(docs, bucket_size, executor, X)
+
+        # Gather the head of each token as an index into the concatenated
+        # docs, so that the labeler can look up the head representations.
+        flat_heads = []
+        offset = 0
+        for doc, doc_heads in zip(docs, heads):
+            if doc_heads:
+                sent_lens = np.array([len(sent_heads) for sent_heads in doc_heads], dtype=np.int32)
+                sent_starts = np.cumsum(sent_lens) - sent_lens
+                flat_heads.append(offset + np.concatenate(doc_heads) + np.repeat(sent_starts, sent_lens))
+            offset += len(doc)
+        flat_heads = ops.asarray1i(np.concatenate(flat_heads).astype(np.int32))
+
+        if self.exported_scorers is not None:
+            self.exported_scorers.check_labels(self.labels)
+        label_scores = self._get_scorer("bilinear").predict((X, flat_heads))
+        labels = best_labels(ops, label_scores, flat_heads, self.labels)
+
+        return heads, labels
+
+    def set_annotations(self, docs: Iterable[Doc], predictions):
+        cdef Doc doc
+        cdef const int [::1] heads_c
+        cdef int i, head, offset
+        heads, labels = predictions
+        cdef attr_t root = self.vocab.strings.add('ROOT')
+        cdef const attr_t [::1] label_ids_c = np.array(
+            [self.vocab.strings.add(label) for label in self.labels] or [0], dtype=np.uint64)
+        cdef const int [::1] labels_c = np.ascontiguousarray(labels, dtype=np.int32)
+
+        # Labels are ordered by sentence, which is the same as the order
+        # of the tokens in the doc.
+        offset = 0
+        for (doc, doc_heads) in zip(docs, heads):
+            if doc.length == 0:
+                continue
+
+            # Convert sentence-relative heads to heads within the doc.
+            sent_lens = np.array([len(sent_heads) for sent_heads in doc_heads], dtype=np.int32)
+            if sent_lens.sum() != doc.length:
+                raise ValueError(f"Got {sent_lens.sum()} heads for a doc of {doc.length} tokens")
+            if offset + doc.length > labels_c.shape[0]:
+                raise ValueError(f"Got {labels_c.shape[0]} labels, but the docs have more tokens")
+            sent_starts = np.cumsum(sent_lens) - sent_lens
+            heads_c = (np.concatenate(doc_heads) + np.repeat(sent_starts, sent_lens)).astype(np.int32)
+
+            for i in range(doc.length):
+                head = heads_c[i]
+                doc.c[i].head = head - i
+                if head == i:
+                    doc.c[i].dep = root
+                else:
+                    doc.c[i].dep = label_ids_c[labels_c[offset + i]]
+            offset += doc.length
+
+            with nogil:
+                set_children(doc.c, doc.length)
+
+        assert offset == labels_c.shape[0]
+
+    def update(
+        self,
+        examples: Iterable[Example],
+        *,
+        drop: float = 0.0,
+        sgd: Optional[Optimizer] = None,
+        losses: Optional[Dict[str, float]] = None
+    ) -> Dict[str, float]:
+        if losses is None:
+            losses = {}
+        losses.setdefault(self.name, 0.0)
+        validate_examples(examples, "BiaffineParser.update")
+
+        if not any(len(eg.predicted) if eg.predicted else 0 for eg in examples):
+            # Handle cases where there are no tokens in any docs.
+            return losses
+
+        docs = [eg.predicted for eg in examples]
+
+        lens = sents2lens(docs, ops=self.model.ops)
+        if lens.sum() == 0:
+            return losses
+
+        # Labels are learned from the representations of the gold heads.
+        gold_heads = heads_gold(examples, self.model.ops)
+
+        scores, backprop_scores = self.model.begin_update((docs, lens, gold_heads))
+        loss, d_scores = self.get_loss(examples, scores)
+        backprop_scores(d_scores)
+
+        if sgd is not None:
+            self.finish_update(sgd)
+        losses[self.name] += loss
+
+        return losses
+
+    def _initialize_from_disk(self):
+        self._label_to_i = {label: i for i, label in enumerate(self.labels)}
+
+        # The PyTorch models are constructed lazily, so we need to
+        # explicitly initialize the model before deserialization.
+        pairwise_bilinear = self.model.get_ref("pairwise_bilinear")
+        if pairwise_bilinear.has_dim("nI") is None:
+            pairwise_bilinear.set_dim("nI", self.cfg["nI"])
+        bilinear = self.model.get_ref("bilinear")
+        if bilinear.has_dim("nI") is None:
+            bilinear.set_dim("nI", self.cfg["nI"])
+        if bilinear.has_dim("nO") is None:
+            bilinear.set_dim("nO", len(self.labels))
+
+        self.model.initialize()
@@ -19,25 +19,52 @@ def build_bilinear(
     dropout: float = 0.1,
     hidden_width: int = 128,
     mixed_precision: bool = False,
-    grad_scaler: Optional[PyTorchGradScaler] = None
+    grad_scaler: Optional[PyTorchGradScaler] = None,
+    inference_precision: str = "fp32"
 ) -> Model[Tuple[List[Doc], Ints1d], Floats2d]:
+    return build_bilinear_v2(
+        tok2vec,
+        nO,
+        dropout=dropout,
+        hidden_width=hidden_width,
+        mixed_precision=mixed_precision,
+        grad_scaler=grad_scaler,
+        inference_precision=inference_precision,
+        rank=None,
+    )
+
+
+@registry.architectures("Bilinear.v2")
+def build_bilinear_v2(
+    tok2vec: Model[List[Doc], List[Floats2d]],
+    nO: Optional[int] = None,
+    *,
+    dropout: float = 0.1,
+    hidden_width: int = 128,
+    mixed_precision: bool = False,
+    grad_scaler: Optional[PyTorchGradScaler] = None,
+    inference_precision: str = "fp32",
+    rank: Optional[int] = 32,
+    diagonal: bool = False
+) -> Model[Tuple[List[Doc], Ints1d], Floats2d]:
+    """Build a labeler model like `Bilinear.v1`, with a low-rank bilinear
+    form of the given rank. With `diagonal`, a diagonal is added to the
+    low-rank weights of each label. If `rank` is null, the full bilinear
+    form of `Bilinear.v1` is used."""
     nI = None
     if tok2vec.has_dim("nO") is True:
         nI = tok2vec.get_dim("nO")
 
-    bilinear: Model[Tuple[Floats2d, Ints1d], Floats2d] = Model(
-        "bilinear",
-        forward=bilinear_forward,
-        init=bilinear_init,
-        dims={"nI": nI, "nO": nO},
-        attrs={
-            # We currently do not update dropout when dropout_rate is
-            # changed, since we cannot access the underlying model.
-            "dropout_rate": dropout,
-            "hidden_width": hidden_width,
-            "mixed_precision": mixed_precision,
-            "grad_scaler": grad_scaler,
-        },
+    bilinear = build_bilinear_layer(
+        nI,
+        nO,
+        dropout=dropout,
+        hidden_width=hidden_width,
+        mixed_precision=mixed_precision,
+        grad_scaler=grad_scaler,
+        inference_precision=inference_precision,
+        rank=rank,
+        diagonal=diagonal,
     )
 
     model = chain(
@@ -49,11 +76,51 @@ def build_bilinear(
         ),
         bilinear,
     )
+    model.set_ref("tok2vec", tok2vec)
     model.set_ref("bilinear", bilinear)
 
     return model
 
 
+def build_bilinear_layer(
+    nI: Optional[int] = None,
+    nO: Optional[int] = None,
+    *,
+    dropout: float = 0.1,
+    hidden_width: int = 128,
+    mixed_precision: bool = False,
+    grad_scaler: Optional[PyTorchGradScaler] = None,
+    inference_precision: str = "fp32",
+    rank: Optional[int] = None,
+    diagonal: bool = False
+) -> Model[Tuple[Floats2d, Ints1d], Floats2d]:
+    """Build the bilinear layer, which takes the flattened token
+    representations and the index of the head of each token as its
+    input. If `rank` is set, the bilinear form is factorized with that
+    rank, optionally plus a diagonal."""
+    if rank is not None and rank < 1:
+        raise ValueError(f"The rank of the bilinear form should be at least 1, got {rank}")
+    if rank is None and diagonal:
+        raise ValueError("A diagonal can only be added to a low-rank bilinear form")
+    return Model(
+        "bilinear",
+        forward=bilinear_forward,
+        init=bilinear_init,
+        dims={"nI": nI, "nO": nO},
+        attrs={
+            # We currently do not update dropout when dropout_rate is
+            # changed, since we cannot access the underlying model.
+            "dropout_rate": dropout,
+            "hidden_width": hidden_width,
+            "mixed_precision": mixed_precision,
+            "grad_scaler": grad_scaler,
+            "inference_precision": inference_precision,
+            "rank": rank,
+            "diagonal": diagonal,
+        },
+    )
+
+
 def bilinear_init(model: Model, X=None, Y=None):
     if model.layers:
         return
@@ -74,6 +141,9 @@ def bilinear_init(model: Model, X=None, Y=None):
                 model.get_dim("nO"),
                 dropout=model.attrs["dropout_rate"],
                 hidden_width=hidden_width,
+                inference_precision=model.attrs["inference_precision"],
+                rank=model.attrs["rank"],
+                diagonal=model.attrs["diagonal"],
             ),
             convert_inputs=convert_inputs,
             convert_outputs=convert_outputs,
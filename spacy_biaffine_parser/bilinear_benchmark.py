@@ -0,0 +1,150 @@
+"""Benchmark of the full and low-rank bilinear forms of the labeler.
+
+Run the benchmark with:
+
+    python -m spacy_biaffine_parser.bilinear_benchmark
+
+For each form, the benchmark reports the multiply-adds and parameters of
+the bilinear form and the latency of scoring a batch with the whole
+`BilinearModel` (projections and bilinear form) in evaluation mode. The
+defaults correspond to a Universal Dependencies label set with the
+default hidden width of `Bilinear.v1`.
+"""
+
+import argparse
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import torch
+
+from .pytorch_bilinear import BilinearModel
+
+
+def bilinear_macs(hidden_width: int, nO: int, rank: Optional[int] = None, diagonal: bool = False) -> int:
+    """Number of multiply-adds of the bilinear form per token."""
+    if rank is None:
+        return nO * hidden_width * (hidden_width + 1)
+    macs = 2 * hidden_width * rank + rank + rank * nO
+    if diagonal:
+        macs += hidden_width + hidden_width * nO
+    return macs
+
+
+def form_name(rank: Optional[int], diagonal: bool) -> str:
+    if rank is None:
+        return "full"
+    return f"rank{rank}" + ("+diag" if diagonal else "")
+
+
+def benchmark(
+    model: BilinearModel, n_tokens: int, nI: int, *, repeats: int = 20, seed: int = 42
+) -> Dict[str, float]:
+    """Score a batch of random tokens `repeats` times and return the
+    latency percentiles in milliseconds."""
+    generator = torch.Generator().manual_seed(seed)
+    x = torch.randn(n_tokens, nI, generator=generator)
+    heads = torch.randint(0, n_tokens, (n_tokens,), generator=generator)
+
+    model.eval()
+    latencies = []
+    with torch.no_grad():
+        # Warm up, so that one-time allocations are not measured.
+        model(x, heads)
+        for _ in range(repeats):
+            start = time.perf_counter_ns()
+            model(x, heads)
+            latencies.append(time.perf_counter_ns() - start)
+
+    latencies = np.array(latencies) / 1e6
+    return {
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p90_ms": float(np.percentile(latencies, 90)),
+    }
+
+
+def run_benchmarks(
+    ranks: Optional[List[int]] = None,
+    *,
+    nI: int = 96,
+    hidden_width: int = 128,
+    n_labels: int = 50,
+    n_tokens: int = 4096,
+    repeats: int = 20,
+    diagonal: bool = True,
+    seed: int = 42,
+) -> Dict[str, Dict[str, float]]:
+    """Benchmark the full bilinear form and the low-rank forms of the given
+    ranks (with and without a diagonal if `diagonal` is set). Returns the
+    results keyed by the name of the form. `speedup` and `macs_ratio` are
+    relative to the full form."""
+    if ranks is None:
+        ranks = [16, 32, 64]
+    forms: List[Tuple[Optional[int], bool]] = [(None, False)]
+    for rank in ranks:
+        forms.append((rank, False))
+        if diagonal:
+            forms.append((rank, True))
+
+    results = {}
+    for rank, form_diagonal in forms:
+        torch.manual_seed(seed)
+        model = BilinearModel(nI, n_labels, hidden_width=hidden_width, rank=rank, diagonal=form_diagonal)
+        result: Dict[str, float] = {
+            "macs_per_token": bilinear_macs(hidden_width, n_labels, rank, form_diagonal),
+            "parameters": sum(param.numel() for param in model.bilinear.parameters()),
+        }
+        result.update(benchmark(model, n_tokens, nI, repeats=repeats, seed=seed))
+        results[form_name(rank, form_diagonal)] = result
+
+    full = results["full"]
+    for result in results.values():
+        result["macs_ratio"] = result["macs_per_token"] / full["macs_per_token"]
+        result["speedup"] = full["p50_ms"] / result["p50_ms"]
+    return results
+
+
+def format_results(results: Dict[str, Dict[str, float]]) -> str:
+    columns = ["macs_per_token", "macs_ratio", "parameters", "p50_ms", "p90_ms", "speedup"]
+    name_width = max(len("form"), *(len(name) for name in results))
+    lines = ["  ".join(["form".ljust(name_width)] + [column.rjust(14) for column in columns])]
+    for name, result in results.items():
+        values = [f"{result[column]:14.3f}" if isinstance(result[column], float) else f"{result[column]:14d}" for column in columns]
+        lines.append("  ".join([name.ljust(name_width)] + values))
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the full and low-rank bilinear forms of the labeler.")
+    parser.add_argument("--ranks", nargs="+", type=int, default=[16, 32, 64], help="ranks of the low-rank forms")
+    parser.add_argument("--no-diagonal", action="store_true", help="do not benchmark the forms with a diagonal")
+    parser.add_argument("--input-width", type=int, default=96, help="width of the token representations")
+    parser.add_argument("--hidden-width", type=int, default=128)
+    parser.add_argument("--labels", type=int, default=50, help="number of labels")
+    parser.add_argument("--tokens", type=int, default=4096, help="number of tokens per batch")
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--threads", type=int, help="number of PyTorch threads")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+
+    results = run_benchmarks(
+        args.ranks,
+        nI=args.input_width,
+        hidden_width=args.hidden_width,
+        n_labels=args.labels,
+        n_tokens=args.tokens,
+        repeats=args.repeats,
+        diagonal=not args.no_diagonal,
+        seed=args.seed,
+    )
+    print(format_results(results))
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
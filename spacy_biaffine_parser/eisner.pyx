@@ -0,0 +1,255 @@
+# cython: infer_types=True, profile=True, binding=True
+
+# Copyright 2021 ExplosionAI GmbH
+#
+# Licensed under the Apache License, Version 2.0 or the MIT license, at your
+# option.
+#
+# First-order projective decoding, following:
+#
+# Eisner, 1996, Three new probabilistic models for dependency parsing: An
+#   exploration, COLING
+#
+# Sentences of the same length are decoded together, the dynamic
+# programming tables store the entries of all sentences of a group
+# consecutively, so that the innermost loops run over the sentences.
+
+from libc.math cimport INFINITY
+from libcpp.vector cimport vector
+import numpy as np
+
+from .mst cimport parallel_for
+from .mst import check_score_shape, get_score_offsets
+
+
+cdef struct EisnerBatch:
+    # Padded score matrix, the rows of each sentence are stored
+    # consecutively. Or ragged scores, where the square score matrices of
+    # the sentences are stored consecutively.
+    const float *scores
+    int n_cols
+    bint ragged
+    # Offset of the scores of each sentence in elements.
+    const Py_ssize_t *score_offsets
+    const int *lengths
+    const int *offsets
+    # Sentence indices, ordered by length.
+    const int *order
+    # Start of each group of equal-length sentences in `order`.
+    const int *group_offsets
+    int *heads
+
+
+cdef enum Span:
+    COMPLETE_LEFT
+    COMPLETE_RIGHT
+    INCOMPLETE_LEFT
+    INCOMPLETE_RIGHT
+
+
+def eisner_decode_batch(scores, lengths, *, int n_threads=1):
+    """Find the highest-scoring projective tree for each sentence in a
+    batch. `scores` is a padded matrix of shape [sum(lengths),
+    max(lengths)] that stores the rows of each sentence consecutively, or
+    a ragged vector of shape [sum(lengths ** 2)] that stores the square
+    score matrix of each sentence consecutively.
+    Returns an array with for each token the head of the projective tree
+    of its sentence, relative to the start of the sentence.
+
+    Decoding is done without holding the GIL. If `n_threads` is larger
+    than one, groups of sentences with the same length are distributed over
+    that many native threads."""
+    lengths = np.ascontiguousarray(lengths, dtype=np.int32)
+    if lengths.ndim != 1:
+        raise ValueError(f"Sentence lengths should be a vector, got shape {lengths.shape}")
+    n_tokens = check_score_shape(scores, lengths)
+    if n_tokens == 0:
+        return np.empty(0, dtype=np.int32)
+
+    ragged = scores.ndim == 1
+    scores = np.ascontiguousarray(scores, dtype=np.float32)
+    if not np.isfinite(scores).all():
+        raise ValueError("Edge weight matrix contains non-finite scores")
+
+    cdef const float [::1] scores_c = scores.reshape(-1)
+    cdef const int [::1] lengths_c = lengths
+    offsets = np.zeros_like(lengths)
+    np.cumsum(lengths[:-1], out=offsets[1:])
+    cdef const int [::1] offsets_c = offsets
+    n_cols = 0 if ragged else scores.shape[1]
+    score_offsets = get_score_offsets(lengths, n_cols, ragged)
+    cdef const Py_ssize_t [::1] score_offsets_c = score_offsets
+
+    order = np.argsort(lengths, kind="stable").astype(np.int32)
+    cdef const int [::1] order_c = order
+    sorted_lengths = lengths[order]
+    group_offsets = np.flatnonzero(np.diff(sorted_lengths, prepend=-1, append=-1)).astype(np.int32)
+    cdef const int [::1] group_offsets_c = group_offsets
+
+    heads = np.empty(n_tokens, dtype=np.int32)
+    cdef int [::1] heads_c = heads
+
+    cdef EisnerBatch batch
+    batch.scores = &scores_c[0]
+    batch.n_cols = n_cols
+    batch.ragged = ragged
+    batch.score_offsets = &score_offsets_c[0]
+    batch.lengths = &lengths_c[0]
+    batch.offsets = &offsets_c[0]
+    batch.order = &order_c[0]
+    batch.group_offsets = &group_offsets_c[0]
+    batch.heads = &heads_c[0]
+
+    with nogil:
+        parallel_for(group_offsets_c.shape[0] - 1, n_threads, decode_groups, &batch)
+
+    return heads
+
+
+cdef void decode_groups(void *ctx, int worker, int begin, int end) nogil:
+    cdef EisnerBatch *batch = <EisnerBatch *> ctx
+    cdef int group
+    for group in range(begin, end):
+        decode_group(batch, batch.group_offsets[group], batch.group_offsets[group + 1])
+
+
+cdef void decode_group(EisnerBatch *batch, int group_begin, int group_end) nogil:
+    cdef int n_sents = group_end - group_begin
+    cdef int seq_len = batch.lengths[batch.order[group_begin]]
+    if seq_len == 0:
+        return
+    cdef size_t n_cols = seq_len if batch.ragged else batch.n_cols
+
+    # Vertex 0 is the root, vertex i + 1 is the i-th token.
+    cdef int n_vertices = seq_len + 1
+    cdef size_t table_size = <size_t> n_vertices * n_vertices * n_sents
+
+    # All tables are indexed by ((i * n_vertices) + j) * n_sents + sent.
+    # arcs stores the weight of the edge from head i to dependent j.
+    cdef vector[float] arcs = vector[float](table_size, -INFINITY)
+    cdef vector[float] complete_left = vector[float](table_size, -INFINITY)
+    cdef vector[float] complete_right = vector[float](table_size, -INFINITY)
+    cdef vector[float] incomplete_left = vector[float](table_size, -INFINITY)
+    cdef vector[float] incomplete_right = vector[float](table_size, -INFINITY)
+    cdef vector[int] complete_left_split = vector[int](table_size, 0)
+    cdef vector[int] complete_right_split = vector[int](table_size, 0)
+    cdef vector[int] incomplete_split = vector[int](table_size, 0)
+
+    cdef const float *sent_scores
+    cdef int sent, dep, head, i, j, k, width
+    cdef size_t ij, ik, kj, k1j
+    cdef float score
+
+    for sent in range(n_sents):
+        sent_scores = batch.scores + batch.score_offsets[batch.order[group_begin + sent]]
+        for dep in range(seq_len):
+            arcs[<size_t> (dep + 1) * n_sents + sent] = sent_scores[dep * n_cols + dep]
+            for head in range(seq_len):
+                if head != dep:
+                    arcs[(<size_t> (head + 1) * n_vertices + dep + 1) * n_sents + sent] = \
+                        sent_scores[dep * n_cols + head]
+
+    for i in range(n_vertices):
+        for sent in range(n_sents):
+            complete_left[(<size_t> i * n_vertices + i) * n_sents + sent] = 0.
+            complete_right[(<size_t> i * n_vertices + i) * n_sents + sent] = 0.
+
+    for width in range(1, n_vertices):
+        for i in range(n_vertices - width):
+            j = i + width
+            ij = (<size_t> i * n_vertices + j) * n_sents
+
+            # Incomplete spans: an arc between i and j, combining a right
+            # complete span headed by i and a left complete span headed by j.
+            for k in range(i, j):
+                ik = (<size_t> i * n_vertices + k) * n_sents
+                k1j = (<size_t> (k + 1) * n_vertices + j) * n_sents
+                for sent in range(n_sents):
+                    score = complete_right[ik + sent] + complete_left[k1j + sent]
+                    if score > incomplete_right[ij + sent]:
+                        incomplete_right[ij + sent] = score
+                        incomplete_split[ij + sent] = k
+
+            for sent in range(n_sents):
+                score = incomplete_right[ij + sent]
+                incomplete_right[ij + sent] = score + arcs[ij + sent]
+                # The root cannot be a dependent.
+                if i != 0:
+                    incomplete_left[ij + sent] = score + arcs[(<size_t> j * n_vertices + i) * n_sents + sent]
+
+            # Complete spans.
+            for k in range(i, j):
+                ik = (<size_t> i * n_vertices + k) * n_sents
+                kj = (<size_t> k * n_vertices + j) * n_sents
+                for sent in range(n_sents):
+                    score = complete_left[ik + sent] + incomplete_left[kj + sent]
+                    if score > complete_left[ij + sent]:
+                        complete_left[ij + sent] = score
+                        complete_left_split[ij + sent] = k
+
+            for k in range(i + 1, j + 1):
+                ik = (<size_t> i * n_vertices + k) * n_sents
+                kj = (<size_t> k * n_vertices + j) * n_sents
+                for sent in range(n_sents):
+                    score = incomplete_right[ik + sent] + complete_right[kj + sent]
+                    if score > complete_right[ij + sent]:
+                        complete_right[ij + sent] = score
+                        complete_right_split[ij + sent] = k
+
+    cdef vector[int] heads = vector[int](n_vertices, 0)
+    cdef int *sent_heads
+    for sent in range(n_sents):
+        backtrack(complete_left_split, complete_right_split, incomplete_split,
+                  n_vertices, n_sents, sent, heads)
+        sent_heads = batch.heads + batch.offsets[batch.order[group_begin + sent]]
+        for dep in range(seq_len):
+            head = heads[dep + 1]
+            sent_heads[dep] = dep if head == 0 else head - 1
+
+
+cdef void backtrack(const vector[int] &complete_left_split, const vector[int] &complete_right_split,
+                    const vector[int] &incomplete_split, int n_vertices, int n_sents, int sent,
+                    vector[int] &heads) nogil:
+    """Extract the heads of a sentence from the split points of its spans."""
+    # Stack of (span type, i, j) triples.
+    cdef vector[int] stack
+    stack.push_back(COMPLETE_RIGHT)
+    stack.push_back(0)
+    stack.push_back(n_vertices - 1)
+
+    cdef int span, i, j, k
+    cdef size_t ij
+    while not stack.empty():
+        j = stack.back()
+        stack.pop_back()
+        i = stack.back()
+        stack.pop_back()
+        span = stack.back()
+        stack.pop_back()
+
+        if i == j:
+            continue
+
+        ij = (<size_t> i * n_vertices + j) * n_sents + sent
+        if span == COMPLETE_LEFT:
+            k = complete_left_split[ij]
+            push_span(stack, COMPLETE_LEFT, i, k)
+            push_span(stack, INCOMPLETE_LEFT, k, j)
+        elif span == COMPLETE_RIGHT:
+            k = complete_right_split[ij]
+            push_span(stack, INCOMPLETE_RIGHT, i, k)
+            push_span(stack, COMPLETE_RIGHT, k, j)
+        else:
+            if span == INCOMPLETE_LEFT:
+                heads[i] = j
+            else:
+                heads[j] = i
+            k = incomplete_split[ij]
+            push_span(stack, COMPLETE_RIGHT, i, k)
+            push_span(stack, COMPLETE_LEFT, k + 1, j)
+
+
+cdef inline void push_span(vector[int] &stack, int span, int i, int j) nogil:
+    stack.push_back(span)
+    stack.push_back(i)
+    stack.push_back(j)
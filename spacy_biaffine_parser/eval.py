@@ -4,6 +4,8 @@ from spacy.scorer import PRFScore, Scorer
 from spacy.training import Example
 from spacy.util import registry
 
+from .alignment import get_aligned_parse
+
 
 def parser_score(examples, **kwargs):
     return score_deps(examples)
@@ -25,14 +27,16 @@ def score_deps(examples: Iterable[Example]):
     for example in examples:
         gold_deps = set()
         pred_deps = set()
-        aligned_heads, aligned_labels = example.get_aligned_parse(projectivize=False)
+        aligned_heads, aligned_labels = get_aligned_parse(example)
+        strings = example.reference.vocab.strings
 
         for sent in example.predicted.sents:
             for token in sent:
                 gold_head = aligned_heads[token.i]
-                gold_label = aligned_labels[token.i]
-                if gold_head is None:
+                if gold_head == -1:
                     continue
+                gold_head = int(gold_head)
+                gold_label = strings[int(aligned_labels[token.i])]
                 if gold_head < sent.start or gold_head >= sent.end:
                     # We can never correctly predict heads when the sentence
                     # boundary predictor placed the gold head out of the sentence.
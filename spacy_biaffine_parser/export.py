@@ -0,0 +1,188 @@
+"""Export the scorers of the parser components as TorchScript or ONNX
+graphs, so that they can be run without the thinc PyTorch wrapper.
+
+Run the export with:
+
+    python -m spacy_biaffine_parser.export model_path output_path --format onnx
+
+For every arc_predicter, arc_labeler and biaffine_parser component, a
+directory with the name of the component is written. It contains the arc
+scorer (arc_scorer.pt or arc_scorer.onnx), the label scorer
+(label_scorer.pt or label_scorer.onnx) and the label table (labels.json),
+as far as the component has them. The batch and sequence axes of the
+graphs are dynamic.
+
+The arc scorer takes the padded token representations [batch, seq_len,
+width] and the sentence lengths [batch] and returns the arc scores [batch,
+seq_len, seq_len]. The label scorer takes the token representations
+[n_tokens, width] and the head of every token [n_tokens] and returns the
+label scores [n_tokens, n_labels].
+
+The components use the exported scorers through their `exported_scorers`
+setting. The token representations are still computed by the pipeline.
+"""
+
+import argparse
+import copy
+import inspect
+import sys
+import warnings
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Union, cast
+
+import spacy
+import srsly
+import torch
+from spacy.language import Language
+from spacy.util import ensure_path
+from thinc.api import Model
+from torch import nn
+
+from .pytorch_bilinear import BilinearModel, LowRankBilinear
+from .pytorch_pairwise_bilinear import PairwiseBilinearModel
+
+EXPORT_FORMATS = ("torchscript", "onnx")
+EXPORT_SUFFIXES = {"torchscript": ".pt", "onnx": ".onnx"}
+# Names of the exported scorers of the pairwise bilinear and bilinear
+# layers.
+SCORER_NAMES = {"pairwise_bilinear": "arc_scorer", "bilinear": "label_scorer"}
+ONNX_OPSET = 17
+
+
+class ArcScorer(nn.Module):
+    """Arc scorer of a PairwiseBilinearModel in evaluation mode."""
+
+    def __init__(self, model: PairwiseBilinearModel):
+        super(ArcScorer, self).__init__()
+        self.model = model
+
+    def forward(self, x: torch.Tensor, seq_lens: torch.Tensor):
+        return self.model.score(x, seq_lens)
+
+
+class LabelScorer(nn.Module):
+    """Label scorer of a BilinearModel in evaluation mode. The full
+    bilinear product is written as an einsum, since ONNX has no bilinear
+    operator. The low-rank form only uses matrix products."""
+
+    def __init__(self, model: BilinearModel):
+        super(LabelScorer, self).__init__()
+        self.model = model
+
+    def forward(self, x: torch.Tensor, heads: torch.Tensor):
+        model = self.model
+        head = model.activation(model.head(x[heads.long()]))
+        dependent = model.activation(model.dependent(x))
+        bilinear = model.bilinear
+        if isinstance(bilinear, LowRankBilinear):
+            return bilinear(head, dependent)
+        return torch.einsum("ni,oij,nj->no", head, bilinear.weight, dependent) + cast(torch.Tensor, bilinear.bias)
+
+
+def export_scorers(
+    nlp: Language, path: Union[str, Path], *, format: str = "torchscript"
+) -> List[str]:
+    """Export the scorers of all parser components in the pipeline to the
+    given directory. Returns the names of the exported components."""
+    if format not in EXPORT_FORMATS:
+        raise ValueError(
+            f"Unknown export format '{format}', expected one of: {', '.join(EXPORT_FORMATS)}"
+        )
+    path = ensure_path(path)
+
+    exported = []
+    for name, component in nlp.pipeline:
+        model = getattr(component, "model", None)
+        if not isinstance(model, Model):
+            continue
+        layers = [
+            layer
+            for layer in model.walk()
+            if layer.name in SCORER_NAMES and layer.layers
+        ]
+        if not layers:
+            continue
+
+        component_path = path / name
+        component_path.mkdir(parents=True, exist_ok=True)
+        for layer in layers:
+            export_scorer(layer, component_path / SCORER_NAMES[layer.name], format=format)
+        labels = getattr(component, "labels", ())
+        if labels:
+            srsly.write_json(component_path / "labels.json", list(labels))
+        exported.append(name)
+
+    return exported
+
+
+def export_scorer(layer: Model, path: Path, *, format: str = "torchscript"):
+    """Export the scorer of a (pairwise) bilinear layer. The suffix of the
+    format is added to the path."""
+    # Export a copy in fp32, since the inference precision of the
+    # projections only applies to the PyTorch models.
+    pytorch_model = copy.deepcopy(layer.layers[0].shims[0]._model).cpu()
+    pytorch_model.inference_precision = "fp32"
+    pytorch_model.eval()
+
+    nI = pytorch_model.head.in_features
+    if layer.name == "pairwise_bilinear":
+        scorer: nn.Module = ArcScorer(pytorch_model)
+        inputs = (torch.zeros((2, 3, nI)), torch.tensor([3, 2], dtype=torch.int32))
+        input_names = ["x", "seq_lens"]
+        dynamic_axes = {
+            "x": {0: "batch", 1: "seq_len"},
+            "seq_lens": {0: "batch"},
+            "scores": {0: "batch", 1: "seq_len", 2: "seq_len"},
+        }
+    else:
+        scorer = LabelScorer(pytorch_model)
+        inputs = (torch.zeros((3, nI)), torch.tensor([1, 1, 1], dtype=torch.int32))
+        input_names = ["x", "heads"]
+        dynamic_axes = {"x": {0: "n_tokens"}, "heads": {0: "n_tokens"}, "scores": {0: "n_tokens"}}
+
+    path = path.with_suffix(EXPORT_SUFFIXES[format])
+    with torch.no_grad(), warnings.catch_warnings():
+        warnings.simplefilter("ignore", torch.jit.TracerWarning)
+        if format == "torchscript":
+            torch.jit.trace(scorer, inputs, check_trace=False).save(str(path))
+        else:
+            kwargs: Dict[str, Any] = {}
+            if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+                # Use the TorchScript-based exporter, which is available in
+                # all supported versions of PyTorch.
+                kwargs["dynamo"] = False
+            torch.onnx.export(
+                scorer,
+                inputs,
+                str(path),
+                input_names=input_names,
+                output_names=["scores"],
+                dynamic_axes=dynamic_axes,
+                opset_version=ONNX_OPSET,
+                **kwargs,
+            )
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Export the scorers of the parser components as TorchScript or ONNX graphs."
+    )
+    parser.add_argument("model", type=Path, help="path of the pipeline")
+    parser.add_argument("output", type=Path, help="output directory")
+    parser.add_argument(
+        "--format",
+        choices=EXPORT_FORMATS,
+        default="torchscript",
+        help="export format (default: torchscript)",
+    )
+    args = parser.parse_args(argv)
+
+    nlp = spacy.load(args.model)
+    for name in export_scorers(nlp, args.output, format=args.format):
+        print(f"Exported the scorers of '{name}' to {args.output / name}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,120 @@
+from pathlib import Path
+from typing import Dict, Sequence, Tuple, Union, cast
+
+import numpy as np
+import srsly
+import torch
+from spacy.util import ensure_path
+from thinc.api import Model, to_numpy
+from thinc.types import Floats2d, Floats3d, Ints1d
+
+from .export import EXPORT_SUFFIXES, SCORER_NAMES
+
+
+class ExportedScorers:
+    """Scorers that were exported with `export_scorers`. The scorers are
+    available as thinc layers for prediction, with the same inputs and
+    outputs as the pairwise bilinear and bilinear layers of the models."""
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = ensure_path(path)
+        self.layers: Dict[str, Model] = {}
+        for layer_name, scorer_name in SCORER_NAMES.items():
+            for format, suffix in EXPORT_SUFFIXES.items():
+                scorer_path = self.path / (scorer_name + suffix)
+                if not scorer_path.exists():
+                    continue
+                if format == "torchscript":
+                    run = TorchScriptScorer(scorer_path)
+                else:
+                    run = OnnxScorer(scorer_path)
+                if layer_name == "pairwise_bilinear":
+                    self.layers[layer_name] = build_exported_pairwise_bilinear(run)
+                else:
+                    self.layers[layer_name] = build_exported_bilinear(run)
+                break
+
+        labels_path = self.path / "labels.json"
+        self.labels: Tuple[str, ...] = ()
+        if labels_path.exists():
+            self.labels = tuple(srsly.read_json(labels_path))
+
+    def get_layer(self, name: str) -> Model:
+        if name not in self.layers:
+            raise ValueError(f"No exported {SCORER_NAMES[name]} in '{self.path}'")
+        return self.layers[name]
+
+    def check_labels(self, labels: Sequence[str]):
+        if tuple(labels) != self.labels:
+            raise ValueError(
+                f"The labels of the exported scorers in '{self.path}' do not match the labels of the component"
+            )
+
+
+class TorchScriptScorer:
+    def __init__(self, path: Path):
+        self.module = torch.jit.load(str(path), map_location="cpu")
+        self.module.eval()
+
+    def __call__(self, *inputs: np.ndarray) -> np.ndarray:
+        with torch.no_grad():
+            return self.module(*[torch.from_numpy(input) for input in inputs]).numpy()
+
+
+class OnnxScorer:
+    def __init__(self, path: Path):
+        try:
+            import onnxruntime
+        except ImportError:
+            raise ImportError(
+                "Running ONNX scorers requires onnxruntime: pip install onnxruntime"
+            ) from None
+        self.session = onnxruntime.InferenceSession(
+            str(path), providers=["CPUExecutionProvider"]
+        )
+        self.input_names = [input.name for input in self.session.get_inputs()]
+
+    def __call__(self, *inputs: np.ndarray) -> np.ndarray:
+        return self.session.run(None, dict(zip(self.input_names, inputs)))[0]
+
+
+def build_exported_pairwise_bilinear(run) -> Model[Tuple[Floats2d, Ints1d], Floats2d]:
+    return Model(
+        "exported_pairwise_bilinear",
+        forward=exported_pairwise_bilinear_forward,
+        attrs={"run": run},
+    )
+
+
+def exported_pairwise_bilinear_forward(model: Model, X_lengths: Tuple[Floats2d, Ints1d], is_train: bool):
+    if is_train:
+        raise ValueError("Exported scorers can only be used for prediction")
+    ops = model.ops
+    X, L = X_lengths
+
+    Xp = np.ascontiguousarray(to_numpy(ops.pad(ops.unflatten(X, L))), dtype=np.float32)
+    Y = model.attrs["run"](Xp, np.ascontiguousarray(to_numpy(L), dtype=np.int32))
+    Y = ops.flatten(ops.unpad(cast(Floats3d, ops.asarray3f(Y)), list(L)))
+
+    return Y, lambda dY: dY
+
+
+def build_exported_bilinear(run) -> Model[Tuple[Floats2d, Ints1d], Floats2d]:
+    return Model(
+        "exported_bilinear",
+        forward=exported_bilinear_forward,
+        attrs={"run": run},
+    )
+
+
+def exported_bilinear_forward(model: Model, X_heads: Tuple[Floats2d, Ints1d], is_train: bool):
+    if is_train:
+        raise ValueError("Exported scorers can only be used for prediction")
+    X, H = X_heads
+
+    Y = model.attrs["run"](
+        np.ascontiguousarray(to_numpy(X), dtype=np.float32),
+        np.ascontiguousarray(to_numpy(H), dtype=np.int32),
+    )
+
+    return model.ops.asarray(Y), lambda dY: dY
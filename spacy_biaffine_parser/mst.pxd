@@ -12,4 +12,10 @@ cdef extern from "util.hh" nogil:
 
         iterator begin()
         int& operator[](const pair[int, int] &)
-        iterator end()
\ No newline at end of file
+        iterator end()
+
+ctypedef void (*range_fn)(void *ctx, int worker, int begin, int end) nogil
+
+cdef extern from "util.hh" nogil:
+    void parallel_for(int n_items, int n_threads, range_fn fn, void *ctx)
+    float half_to_float(unsigned short half)
@@ -25,6 +25,14 @@
 #   when computing the edges of the contraction. This does not change
 #   the main algorithm, since the next recursion of Chu-Lui-Edmonds
 #   would discard the lower-scoring edges anyway.
+#
+# Besides this recursive implementation, there is an iterative O(n^2)
+# implementation for dense graphs (`chu_liu_edmonds_tarjan`), which
+# follows:
+#
+# Tarjan, 1977, Finding optimum branchings, Networks 7(1)
+# Camerini et al., 1979, A note on finding optimum branchings,
+#   Networks 9(4)
 
 from cython.operator cimport dereference as deref, preincrement as inc
 from libc.math cimport INFINITY, isfinite
@@ -33,46 +41,592 @@ from libcpp.unordered_set cimport unordered_set
 from libcpp.utility cimport pair
 from libcpp.vector cimport vector
 import numpy as np
+import threading
 
 cdef int NO_PARENT = -1
 
-def mst_decode(scores):
+# Weight of edges that should never be part of the tree, such as
+# self-loops and edges pointing to the root vertex.
+cdef float NO_EDGE = -10000
+
+cdef enum Algorithm:
+    CHU_LIU_EDMONDS
+    TARJAN
+
+ALGORITHMS = {
+    "chu_liu_edmonds": CHU_LIU_EDMONDS,
+    "tarjan": TARJAN,
+}
+
+# How a sentence was decoded.
+cdef enum Outcome:
+    NON_FINITE
+    # The sentence needed the full MST algorithm.
+    FULL
+    # The best head of each token already gave a tree.
+    FAST_PATH
+    # The candidate heads do not contain a spanning tree.
+    NO_TREE
+
+# Counters of how often the fast path was taken, see `get_decode_stats`.
+# Decoding can happen in multiple Python threads, so updates are locked.
+_decode_stats = {"sentences": 0, "fast_path": 0}
+_decode_stats_lock = threading.Lock()
+
+
+# Score matrices are read in their original data type. float16 scores are
+# read as their bit patterns and converted with half_to_float.
+ctypedef fused score_t:
+    unsigned short
+    float
+    double
+
+cdef enum ScoreType:
+    FLOAT16
+    FLOAT32
+    FLOAT64
+
+cdef struct ScoreMatrix:
+    const void *data
+    ScoreType dtype
+    # Distance between two rows in elements. Ragged scores have no fixed
+    # row stride, the rows of a sentence are as long as the sentence.
+    size_t row_stride
+
+
+cdef enum NodeState:
+    UNVISITED
+    ON_PATH
+    DONE
+    CONTRACTED
+
+
+cdef cppclass Workspace:
+    # Scratch space for decoding a sentence. Vectors are only resized, so
+    # once a workspace has seen the longest sentence, decoding does not
+    # allocate anymore.
+    vector[int] walk
+    vector[float] incoming
+    vector[int] edges
+    vector[int] slot_node
+    vector[int] node_slot
+    vector[bool] in_cycle
+    vector[NodeState] state
+    vector[int] enter
+    vector[float] enter_weight
+    vector[int] forest_parent
+    vector[int] first_child
+    vector[int] next_sibling
+    vector[int] path
+    vector[int] cycle_slots
+    vector[int] roots
+
+    # Sparse decoding, see sparse_chu_liu_edmonds.
+    vector[int] edge_source
+    vector[int] edge_target
+    vector[float] edge_weight
+    vector[int] edge_origin
+    vector[int] level_nodes
+    vector[int] level_edges
+    vector[int] best_edge
+    vector[int] component
+    vector[bool] contracted
+    vector[int] selected
+
+
+cdef class WorkspaceHolder:
+    cdef Workspace workspace
+
+    cdef size_t reserved_bytes(self):
+        cdef Workspace *ws = &self.workspace
+        cdef size_t n_ints = (ws.walk.capacity() + ws.edges.capacity() + ws.slot_node.capacity()
+                              + ws.node_slot.capacity() + ws.enter.capacity() + ws.forest_parent.capacity()
+                              + ws.first_child.capacity() + ws.next_sibling.capacity() + ws.path.capacity()
+                              + ws.cycle_slots.capacity() + ws.roots.capacity() + ws.edge_source.capacity()
+                              + ws.edge_target.capacity() + ws.edge_origin.capacity() + ws.level_nodes.capacity()
+                              + ws.level_edges.capacity() + ws.best_edge.capacity() + ws.component.capacity()
+                              + ws.selected.capacity())
+        cdef size_t n_floats = ws.incoming.capacity() + ws.enter_weight.capacity() + ws.edge_weight.capacity()
+        # vector[bool] is a bit vector.
+        cdef size_t n_bits = ws.in_cycle.capacity() + ws.contracted.capacity()
+        return (n_ints * sizeof(int) + n_floats * sizeof(float) + ws.state.capacity() * sizeof(NodeState)
+                + n_bits // 8)
+
+
+# Workspaces that are not in use. A decoding thread takes a workspace from
+# the pool and returns it when it is done.
+_workspace_pool = []
+
+
+cdef WorkspaceHolder acquire_workspace():
+    try:
+        return _workspace_pool.pop()
+    except IndexError:
+        return WorkspaceHolder()
+
+
+cdef struct SentenceBatch:
+    # Padded score matrix, the rows of each sentence are stored
+    # consecutively. Or ragged scores, where the square score matrices of
+    # the sentences are stored consecutively.
+    ScoreMatrix scores
+    bint ragged
+    # Offset of the scores of each sentence in elements.
+    const Py_ssize_t *score_offsets
+    const int *lengths
+    const int *offsets
+    int *heads
+    # Outcome of each sentence.
+    int *outcomes
+    Algorithm algorithm
+    # Workspace for each thread.
+    Workspace **workspaces
+
+
+cdef struct SparseBatch:
+    # Scores of the candidate heads, the rows of each sentence are stored
+    # consecutively.
+    ScoreMatrix scores
+    const int *candidates
+    int n_candidates
+    const int *lengths
+    const int *offsets
+    int *heads
+    int *outcomes
+    Workspace **workspaces
+
+
+def mst_decode(scores, *, algorithm="tarjan"):
     """Apply MST decoding to the pairwise attachment scores. Returns
-    for each vertex the head in the maximum spanning tree"""
+    for each vertex the head in the maximum spanning tree, as an
+    int32 array. The root attaches to itself.
 
-    # Within spacy, a root is encoded as a token that attaches to itself
-    # (relative offset 0). However, the decoder uses a specific vertex,
-    # typically 0. So, we stub an additional root vertex to accomodate
-    # this.
+    `algorithm` is either "tarjan" for the iterative O(n^2) implementation
+    or "chu_liu_edmonds" for the recursive implementation. The scores
+    are read without copying if they are float16, float32, or float64."""
+    cdef Algorithm algorithm_id = get_algorithm(algorithm)
 
     # We expect a biaffine attention matrix.
     if scores.shape[0] != scores.shape[1]:
         raise ValueError(f"Edge weight matrix with shape ({scores.shape[0]}, {scores.shape[1]}) is not a square matrix")
 
-    seq_len = scores.shape[0]
+    cdef int seq_len = scores.shape[0]
+    if seq_len == 0:
+        return np.empty(0, dtype=np.int32)
+
+    cdef ScoreMatrix matrix
+    scores = as_score_matrix(scores, &matrix)
+
+    heads = np.empty(seq_len, dtype=np.int32)
+    cdef int [::1] heads_c = heads
+    cdef WorkspaceHolder holder = acquire_workspace()
+    cdef Outcome outcome
+    with nogil:
+        outcome = decode_sentence(&matrix, 0, matrix.row_stride, seq_len, &heads_c[0], algorithm_id,
+                                  &holder.workspace)
+    _workspace_pool.append(holder)
+
+    if outcome == NON_FINITE:
+        raise ValueError("Edge weight matrix contains non-finite scores")
+
+    update_decode_stats(1, outcome == FAST_PATH)
+
+    return heads
+
+
+def mst_decode_batch(scores, lengths, *, algorithm="tarjan", int n_threads=1):
+    """Apply MST decoding to the pairwise attachment scores of a batch of
+    sentences. `scores` is a padded matrix of shape [sum(lengths),
+    max(lengths)] that stores the rows of each sentence consecutively, or
+    a ragged vector of shape [sum(lengths ** 2)] that stores the square
+    score matrix of each sentence consecutively. Returns an array with for
+    each token the head in the maximum spanning tree of its sentence,
+    relative to the start of the sentence.
+
+    Decoding is done without holding the GIL. If `n_threads` is larger
+    than one, the sentences are distributed over that many native threads.
+    See `mst_decode` for the supported algorithms and data types."""
+    cdef Algorithm algorithm_id = get_algorithm(algorithm)
+
+    lengths = np.ascontiguousarray(lengths, dtype=np.int32)
+    if lengths.ndim != 1:
+        raise ValueError(f"Sentence lengths should be a vector, got shape {lengths.shape}")
+    n_tokens = check_score_shape(scores, lengths)
+    if n_tokens == 0:
+        return np.empty(0, dtype=np.int32)
+
+    cdef SentenceBatch batch
+    batch.ragged = scores.ndim == 1
+    scores = as_score_matrix(scores, &batch.scores)
+
+    cdef const int [::1] lengths_c = lengths
+    offsets = np.zeros_like(lengths)
+    np.cumsum(lengths[:-1], out=offsets[1:])
+    cdef const int [::1] offsets_c = offsets
+    score_offsets = get_score_offsets(lengths, batch.scores.row_stride, batch.ragged)
+    cdef const Py_ssize_t [::1] score_offsets_c = score_offsets
+
+    heads = np.empty(n_tokens, dtype=np.int32)
+    cdef int [::1] heads_c = heads
+    outcomes = np.empty(lengths.shape[0], dtype=np.intc)
+    cdef int [::1] outcomes_c = outcomes
+
+    n_threads = max(1, min(n_threads, lengths.shape[0]))
+    holders = [acquire_workspace() for _ in range(n_threads)]
+    cdef vector[Workspace *] workspaces
+    cdef WorkspaceHolder holder
+    for holder in holders:
+        workspaces.push_back(&holder.workspace)
+
+    batch.score_offsets = &score_offsets_c[0]
+    batch.lengths = &lengths_c[0]
+    batch.offsets = &offsets_c[0]
+    batch.heads = &heads_c[0]
+    batch.outcomes = &outcomes_c[0]
+    batch.algorithm = algorithm_id
+    batch.workspaces = workspaces.data()
+
+    with nogil:
+        parallel_for(lengths_c.shape[0], n_threads, decode_sentences, &batch)
+    _workspace_pool.extend(holders)
+
+    non_finite = np.flatnonzero(outcomes == NON_FINITE)
+    if non_finite.size:
+        raise ValueError(f"Edge weight matrix of sentence {non_finite[0]} contains non-finite scores")
+
+    update_decode_stats(lengths.shape[0], int((outcomes == FAST_PATH).sum()))
+
+    return heads
+
 
-    # The MST decoder expects float32, but the input could e.g. be float16.
-    scores = scores.astype(np.float32)
+def mst_decode_sparse_batch(candidates, candidate_scores, lengths, *, int n_threads=1):
+    """Apply MST decoding to a batch of sentences, where each token only
+    has a small number of candidate heads. `candidates` is a matrix of
+    shape [sum(lengths), n_candidates] that stores the sentence-relative
+    candidate heads of each token, the rows of each sentence are stored
+    consecutively. A token that is its own candidate head can be the root.
+    Unused candidate slots are set to -1. `candidate_scores` has the same
+    shape and contains the score of each candidate.
+
+    Returns the heads as in `mst_decode_batch` and a boolean array that
+    indicates for each sentence whether its candidates contain a spanning
+    tree. The heads of sentences without a spanning tree are set to -1.
+    Decoding takes time linear in the number of candidates for most
+    sentences, rather than quadratic in the sentence length."""
+    lengths = np.ascontiguousarray(lengths, dtype=np.int32)
+    if lengths.ndim != 1:
+        raise ValueError(f"Sentence lengths should be a vector, got shape {lengths.shape}")
+    candidates = np.ascontiguousarray(candidates, dtype=np.int32)
+    candidate_scores = np.asarray(candidate_scores)
+    if candidates.ndim != 2 or candidates.shape != candidate_scores.shape:
+        raise ValueError(f"Candidate heads with shape {candidates.shape} and scores with shape {candidate_scores.shape} should be matrices of the same shape")
+
+    n_tokens = int(lengths.sum())
+    if n_tokens != candidates.shape[0]:
+        raise ValueError(f"Candidate heads with {candidates.shape[0]} rows do not match total sentence length {n_tokens}")
+    if n_tokens == 0:
+        return np.empty(0, dtype=np.int32), np.ones(lengths.shape[0], dtype=np.bool_)
+    if lengths.min() < 0:
+        raise ValueError("Sentence lengths should not be negative")
+    if candidates.shape[1] == 0:
+        raise ValueError("Tokens should have at least one candidate head")
+    token_lens = np.repeat(lengths, lengths)
+    if ((candidates < -1) | (candidates >= token_lens[:, None])).any():
+        raise ValueError("Candidate heads should be -1 or a token of the sentence")
+
+    cdef SparseBatch batch
+    candidate_scores = as_score_matrix(candidate_scores, &batch.scores)
+
+    cdef const int [:, ::1] candidates_c = candidates
+    cdef const int [::1] lengths_c = lengths
+    offsets = np.zeros_like(lengths)
+    np.cumsum(lengths[:-1], out=offsets[1:])
+    cdef const int [::1] offsets_c = offsets
+
+    heads = np.empty(n_tokens, dtype=np.int32)
+    cdef int [::1] heads_c = heads
+    outcomes = np.empty(lengths.shape[0], dtype=np.intc)
+    cdef int [::1] outcomes_c = outcomes
+
+    n_threads = max(1, min(n_threads, lengths.shape[0]))
+    holders = [acquire_workspace() for _ in range(n_threads)]
+    cdef vector[Workspace *] workspaces
+    cdef WorkspaceHolder holder
+    for holder in holders:
+        workspaces.push_back(&holder.workspace)
+
+    batch.candidates = &candidates_c[0, 0]
+    batch.n_candidates = candidates_c.shape[1]
+    batch.lengths = &lengths_c[0]
+    batch.offsets = &offsets_c[0]
+    batch.heads = &heads_c[0]
+    batch.outcomes = &outcomes_c[0]
+    batch.workspaces = workspaces.data()
+
+    with nogil:
+        parallel_for(lengths_c.shape[0], n_threads, decode_sparse_sentences, &batch)
+    _workspace_pool.extend(holders)
+
+    non_finite = np.flatnonzero(outcomes == NON_FINITE)
+    if non_finite.size:
+        raise ValueError(f"Candidate scores of sentence {non_finite[0]} contain non-finite scores")
+
+    has_tree = outcomes != NO_TREE
+    update_decode_stats(int(has_tree.sum()), int((outcomes == FAST_PATH).sum()))
+
+    return heads, has_tree
+
+
+def get_decode_stats():
+    """Get the number of sentences decoded by `mst_decode` and
+    `mst_decode_batch` and how many of them were decoded with the fast
+    path, because the best head of each token already formed a tree."""
+    with _decode_stats_lock:
+        return dict(_decode_stats)
+
+
+def reset_decode_stats():
+    """Reset the counters returned by `get_decode_stats`."""
+    with _decode_stats_lock:
+        for key in _decode_stats:
+            _decode_stats[key] = 0
+
+
+cdef update_decode_stats(int n_sentences, int n_fast_path):
+    with _decode_stats_lock:
+        _decode_stats["sentences"] += n_sentences
+        _decode_stats["fast_path"] += n_fast_path
+
+
+def get_workspace_bytes():
+    """Get the number of bytes reserved by the scratch space of idle
+    decoding workspaces. The scratch space only grows when decoding needs
+    to allocate memory, so this can be used to check that decoding did not
+    allocate."""
+    cdef WorkspaceHolder holder
+    cdef size_t n_bytes = 0
+    for holder in _workspace_pool:
+        n_bytes += holder.reserved_bytes()
+    return n_bytes
+
+
+def check_score_shape(scores, lengths) -> int:
+    """Check that padded or ragged scores match the sentence lengths.
+    Returns the number of tokens."""
+    if scores.ndim not in (1, 2):
+        raise ValueError(f"Edge weight matrix should have one (ragged) or two dimensions, got shape {scores.shape}")
+    if lengths.ndim == 1 and lengths.size and lengths.min() < 0:
+        raise ValueError("Sentence lengths should not be negative")
+
+    n_tokens = int(lengths.sum())
+    if scores.ndim == 1:
+        n_scores = int((lengths.astype(np.int64) ** 2).sum())
+        if n_scores != scores.shape[0]:
+            raise ValueError(f"Ragged edge weights with {scores.shape[0]} scores do not match the {n_scores} scores of the sentences")
+        return n_tokens
+
+    if n_tokens != scores.shape[0]:
+        raise ValueError(f"Edge weight matrix with {scores.shape[0]} rows does not match total sentence length {n_tokens}")
+    if n_tokens != 0 and lengths.max() > scores.shape[1]:
+        raise ValueError(f"Sentence lengths should be between 0 and {scores.shape[1]}")
+    return n_tokens
+
+
+def get_score_offsets(lengths, row_stride, ragged):
+    """Get the offset of the scores of each sentence in elements, for
+    padded scores with the given row stride or for ragged scores."""
+    lengths = lengths.astype(np.intp)
+    sizes = lengths ** 2 if ragged else lengths * row_stride
+    offsets = np.zeros_like(sizes)
+    np.cumsum(sizes[:-1], out=offsets[1:])
+    return offsets
+
+
+cdef object as_score_matrix(scores, ScoreMatrix *matrix):
+    """Point `matrix` to the rows of `scores`. The scores are only copied
+    if their data type is not supported or if the rows are not contiguous.
+    Ragged scores (a vector) are copied if they are not contiguous. Returns
+    the array that `matrix` points to, which must be kept alive while
+    `matrix` is used."""
+    scores = np.asarray(scores)
+    if scores.dtype not in (np.float16, np.float32, np.float64):
+        scores = scores.astype(np.float32)
+    if scores.ndim == 1:
+        scores = np.ascontiguousarray(scores)
+        # View the vector as a single row.
+        scores = scores.reshape(1, scores.shape[0])
+    if scores.strides[1] != scores.itemsize or scores.strides[0] < 0 or scores.strides[0] % scores.itemsize:
+        scores = np.ascontiguousarray(scores)
+
+    cdef const unsigned short [:, :] scores_f16
+    cdef const float [:, :] scores_f32
+    cdef const double [:, :] scores_f64
+    if scores.dtype == np.float16:
+        scores_f16 = scores.view(np.uint16)
+        matrix.data = &scores_f16[0, 0]
+        matrix.dtype = FLOAT16
+    elif scores.dtype == np.float32:
+        scores_f32 = scores
+        matrix.data = &scores_f32[0, 0]
+        matrix.dtype = FLOAT32
+    else:
+        scores_f64 = scores
+        matrix.data = &scores_f64[0, 0]
+        matrix.dtype = FLOAT64
+    matrix.row_stride = scores.strides[0] // scores.itemsize
+
+    return scores
+
+
+cdef void decode_sentences(void *ctx, int worker, int begin, int end) nogil:
+    cdef SentenceBatch *batch = <SentenceBatch *> ctx
+    cdef int i
+
+    cdef size_t row_stride
+
+    for i in range(begin, end):
+        row_stride = batch.lengths[i] if batch.ragged else batch.scores.row_stride
+        batch.outcomes[i] = decode_sentence(&batch.scores, batch.score_offsets[i], row_stride, batch.lengths[i],
+                                            batch.heads + batch.offsets[i], batch.algorithm,
+                                            batch.workspaces[worker])
+
+
+cdef Algorithm get_algorithm(name) except *:
+    if name not in ALGORITHMS:
+        raise ValueError(f"Unknown MST algorithm '{name}', expected one of: {', '.join(ALGORITHMS)}")
+    return ALGORITHMS[name]
+
+
+cdef Outcome decode_sentence(const ScoreMatrix *matrix, size_t offset, size_t row_stride, int seq_len, int *heads,
+                             Algorithm algorithm, Workspace *workspace) nogil:
+    """Decode the sentence whose scores start at element `offset`, with
+    rows that are `row_stride` elements apart. Each row contains the head
+    scores of a dependent. Writes the sentence-relative head of each
+    dependent to `heads`."""
+    if matrix.dtype == FLOAT16:
+        return _decode_sentence(<const unsigned short *> matrix.data + offset, row_stride,
+                                seq_len, heads, algorithm, workspace)
+    elif matrix.dtype == FLOAT32:
+        return _decode_sentence(<const float *> matrix.data + offset, row_stride,
+                                seq_len, heads, algorithm, workspace)
+    else:
+        return _decode_sentence(<const double *> matrix.data + offset, row_stride,
+                                seq_len, heads, algorithm, workspace)
+
+
+cdef Outcome _decode_sentence(const score_t *scores, size_t n_cols, int seq_len, int *heads,
+                              Algorithm algorithm, Workspace *workspace) nogil:
+    cdef Outcome outcome = decode_greedy(scores, n_cols, seq_len, heads, workspace)
+    if outcome != FULL:
+        return outcome
+
+    cdef vector[float] *incoming = &workspace.incoming
+    cdef int dep, head
+    if algorithm == TARJAN:
+        # Tarjan's algorithm uses the sentence matrix with the root edge
+        # weights on the diagonal, which is exactly what we get.
+        incoming.resize(<size_t> seq_len * seq_len)
+        for dep in range(seq_len):
+            for head in range(seq_len):
+                deref(incoming)[dep * seq_len + head] = to_float(scores[dep * n_cols + head])
+        _chu_liu_edmonds_tarjan(workspace, seq_len, heads)
+        return FULL
 
-    # Create score matrix with root row/column.
-    with_root = np.full((seq_len + 1, seq_len + 1), -10000, dtype=scores.dtype)
-    with_root[1:, 1:] = scores
+    # Within spacy, a root is encoded as a token that attaches to itself
+    # (relative offset 0). However, the decoder uses a specific vertex,
+    # typically 0. So, we stub an additional root vertex to accomodate
+    # this.
+    cdef int n_vertices = seq_len + 1
 
-    with_root[1:, 0] = scores.diagonal()
-    with_root[np.diag_indices(with_root.shape[0])] = -10000
+    # Create the score matrix with the root vertex. In contrast to the
+    # input, the rows of this matrix are parents and the columns children.
+    cdef vector[float] with_root = vector[float](n_vertices * n_vertices, NO_EDGE)
+    for dep in range(seq_len):
+        with_root[dep + 1] = to_float(scores[dep * n_cols + dep])
+        for head in range(seq_len):
+            if head != dep:
+                with_root[(head + 1) * n_vertices + dep + 1] = to_float(scores[dep * n_cols + head])
 
-    heads = chu_liu_edmonds(with_root.T, 0)
+    cdef vector[bool] active_vertices = vector[bool](n_vertices, True)
+    cdef vector[int] mst = _chu_liu_edmonds(with_root.data(), n_vertices, 0, active_vertices)
 
     # Remove root vertex
-    heads = heads[1:]
+    for dep in range(seq_len):
+        head = mst[dep + 1]
+        heads[dep] = dep if head == 0 else head - 1
+
+    return FULL
+
+
+cdef inline float to_float(score_t score) nogil:
+    if score_t is float:
+        return score
+    elif score_t is double:
+        return <float> score
+    else:
+        return half_to_float(score)
+
+
+cdef Outcome decode_greedy(const score_t *scores, size_t n_cols, int seq_len, int *heads,
+                           Workspace *workspace) nogil:
+    """Attach every token to its best head. This is the maximum spanning
+    tree if the heads do not form a cycle, which is the case for most
+    sentences. Returns FULL if there is a cycle, in which case the full
+    MST algorithm is needed. Heads are written to `heads` as in
+    `decode_sentence`. Also verifies that all scores are finite.
+
+    The best heads are picked as in the first step of Chu-Liu-Edmonds
+    (preferring the root in case of ties), so the result is the same as
+    full decoding. Multiple roots do not require full decoding, since
+    the MST decoder does not restrict the number of roots either."""
+    cdef int dep, head, vertex
+    cdef float score, best_score
+    for dep in range(seq_len):
+        heads[dep] = dep
+        best_score = to_float(scores[dep * n_cols + dep])
+        if not isfinite(best_score):
+            return NON_FINITE
+        for head in range(seq_len):
+            score = to_float(scores[dep * n_cols + head])
+            if not isfinite(score):
+                return NON_FINITE
+            if head != dep and score > best_score:
+                heads[dep] = head
+                best_score = score
+
+    if seq_len < 2:
+        return FAST_PATH
 
-    for idx, head in enumerate(heads):
-        if head == 0:
-            heads[idx] = idx
+    if seq_len == 2:
+        if heads[0] == 0 or heads[1] == 1:
+            return FAST_PATH
+
+        # Both tokens attach to each other, the best tree has one of
+        # them as the root. Ties are broken as in Chu-Liu-Edmonds.
+        if to_float(scores[0]) + to_float(scores[n_cols]) > to_float(scores[n_cols + 1]) + to_float(scores[1]):
+            heads[0] = 0
+        else:
+            heads[1] = 1
+        return FAST_PATH
+
+    # Follow the heads from each token. A token that is visited twice
+    # during the same walk is part of a cycle. Every token is visited in
+    # at most one walk, so this is linear in the sentence length.
+    cdef vector[int] *walk = &workspace.walk
+    walk.assign(seq_len, -1)
+    for dep in range(seq_len):
+        vertex = dep
+        while deref(walk)[vertex] == -1:
+            deref(walk)[vertex] = dep
+            if heads[vertex] == vertex:
+                break
+            vertex = heads[vertex]
         else:
-            heads[idx] = head - 1
+            if deref(walk)[vertex] == dep:
+                return FULL
+
+    return FAST_PATH
 
-    return heads
 
 cpdef chu_liu_edmonds(const float [:, :] scores, int root_vertex):
     """Chu-Liu-Edmonds maximum spanning tree for dense graphs
@@ -87,13 +641,7 @@ cpdef chu_liu_edmonds(const float [:, :] scores, int root_vertex):
     Returns vertex parents. The length of the returned array equals
     the number of rows/columns of the scores matrix.
     """
-    if scores.shape[0] != scores.shape[1]:
-        raise ValueError(f"Edge weight matrix with shape ({scores.shape[0]}, {scores.shape[1]}) is not a square matrix")
-
-    if root_vertex < 0 or root_vertex >= scores.shape[0]:
-        raise IndexError(f"Root vertex {root_vertex} is out of bounds for edge weight matrix with shape ({scores.shape[0]}, {scores.shape[1]})")
-
-    check_all_finite(scores)
+    check_edge_weights(scores, root_vertex)
 
     # We use this `Vec` to keep track of which vertices are 'active'. Vertices
     # that are part of a contracted cycle become inactive.
@@ -101,16 +649,28 @@ cpdef chu_liu_edmonds(const float [:, :] scores, int root_vertex):
 
     # The chu_liu_edmonds implementation mutates the scoring matrix, so
     # copy it to avoid modifying the caller's matrix.
-    mst = _chu_liu_edmonds(scores.copy(), root_vertex, active_vertices)
+    cdef int n_vertices = scores.shape[0]
+    cdef vector[float] scores_copy = vector[float](n_vertices * n_vertices)
+    cdef int i, j
+    for i in range(n_vertices):
+        for j in range(n_vertices):
+            scores_copy[i * n_vertices + j] = scores[i, j]
+
+    mst = _chu_liu_edmonds(scores_copy.data(), n_vertices, root_vertex, active_vertices)
 
     # Vertices with no parent (normally only the root vertex) are encoded
     # using the vertex -1, replace by None to make the result more Pythonic.
     return [None if vertex == -1 else vertex for vertex in mst]
 
 
-cdef vector[int] _chu_liu_edmonds(float [:, :] scores, int root_vertex, vector[bool] &active_vertices) nogil:
+cdef vector[int] _chu_liu_edmonds(float *scores, int n_vertices, int root_vertex,
+                                  vector[bool] &active_vertices) nogil:
+    # The scores are stored as a dense row-major matrix of n_vertices x
+    # n_vertices, where scores[parent * n_vertices + child] is the weight
+    # of the edge from parent to child.
+
     # For each vertex, find the parent with the highest incoming edge score.
-    cdef vector[int] max_parents = find_max_parents(scores, root_vertex, active_vertices)
+    cdef vector[int] max_parents = find_max_parents(scores, n_vertices, root_vertex, active_vertices)
 
     # Base case: if the resulting graph does not contain a cycle, we
     # have found the MST of the (possibly contracted) graph.
@@ -121,18 +681,504 @@ cdef vector[int] _chu_liu_edmonds(float [:, :] scores, int root_vertex, vector[b
     # Contract the cycle into a single vertex. We use the first vertex of
     # the cycle to represent the cycle.
     cdef pair[replacement_map, replacement_map] replacements = \
-        contract_cycle(scores, max_parents, active_vertices, cycle)
+        contract_cycle(scores, n_vertices, max_parents, active_vertices, cycle)
 
     cdef replacement_map incoming_replacements = replacements.first
     cdef replacement_map outgoing_replacements = replacements.second
 
     # Recursively apply Chu-Liu-Edmonds to the graph with the contracted
     # cycle, until we hit the base case.
-    cdef vector[int] contracted_mst = _chu_liu_edmonds(scores, root_vertex, active_vertices)
+    cdef vector[int] contracted_mst = _chu_liu_edmonds(scores, n_vertices, root_vertex, active_vertices)
 
     # Expand the contracted cycle in the MST.
     return expand_cycle(max_parents, contracted_mst, cycle, incoming_replacements, outgoing_replacements)
 
+
+cpdef chu_liu_edmonds_tarjan(const float [:, :] scores, int root_vertex):
+    """Chu-Liu-Edmonds maximum spanning tree for dense graphs in O(n^2)
+    time, using Tarjan's iterative formulation.
+
+    Takes the same arguments and returns the same parents as
+    `chu_liu_edmonds`. Does not recurse, so it can be used on
+    large graphs.
+    """
+    check_edge_weights(scores, root_vertex)
+
+    # The implementation does not represent the root as a vertex, but
+    # stores the weights of edges from the root on the diagonal. Each row
+    # contains the weights of the incoming edges of a vertex.
+    cdef int n_vertices = scores.shape[0]
+    cdef int n_tokens = n_vertices - 1
+    cdef vector[int] vertices
+    cdef int i, j
+    for i in range(n_vertices):
+        if i != root_vertex:
+            vertices.push_back(i)
+
+    cdef Workspace workspace
+    workspace.incoming.resize(n_tokens * n_tokens)
+    for i in range(n_tokens):
+        for j in range(n_tokens):
+            if i == j:
+                workspace.incoming[i * n_tokens + j] = scores[root_vertex, vertices[i]]
+            else:
+                workspace.incoming[i * n_tokens + j] = scores[vertices[j], vertices[i]]
+
+    cdef vector[int] parents = vector[int](n_tokens)
+    if n_tokens != 0:
+        with nogil:
+            _chu_liu_edmonds_tarjan(&workspace, n_tokens, parents.data())
+
+    mst = [None] * n_vertices
+    cdef int vertex
+    for i in range(n_tokens):
+        vertex = vertices[i]
+        mst[vertex] = root_vertex if parents[i] == i else vertices[parents[i]]
+
+    return mst
+
+
+cdef void _chu_liu_edmonds_tarjan(Workspace *workspace, int n_vertices, int *parents) nogil:
+    # workspace.incoming stores the scores as a dense row-major matrix,
+    # where incoming[child * n_vertices + parent] is the weight of the
+    # edge from parent to child. Rather than using a root vertex, the
+    # weight of the edge from the root to a vertex is stored on the
+    # diagonal. The matrix is overwritten with the edges of contracted
+    # cycles. In `parents`, the root is encoded as a vertex attaching to
+    # itself.
+    #
+    # Nodes are vertices or contracted cycles. Vertices use their own
+    # number as the node identifier, contractions get n_vertices, ... At
+    # most n_vertices - 1 contractions can happen. Each node occupies a
+    # slot (row and column) in the matrix. A contraction takes over the
+    # slot of one of the nodes in its cycle.
+    cdef int n_nodes = 2 * n_vertices
+    cdef int next_node = n_vertices
+
+    cdef float *incoming = workspace.incoming.data()
+
+    # The original edge (parent * n_vertices + child) that each matrix cell
+    # represents.
+    workspace.edges.resize(n_vertices * n_vertices)
+    cdef int *edges = workspace.edges.data()
+
+    cdef vector[int] *slot_node = &workspace.slot_node
+    cdef vector[int] *node_slot = &workspace.node_slot
+    cdef vector[bool] *in_cycle = &workspace.in_cycle
+    cdef vector[NodeState] *state = &workspace.state
+    slot_node.resize(n_vertices)
+    node_slot.assign(n_nodes, -1)
+    in_cycle.assign(n_vertices, False)
+    state.assign(n_nodes, UNVISITED)
+
+    # The original edge entering each node and its weight in the matrix at
+    # the time that the edge was selected.
+    cdef vector[int] *enter = &workspace.enter
+    cdef vector[float] *enter_weight = &workspace.enter_weight
+    enter.assign(n_nodes, -1)
+    enter_weight.assign(n_nodes, 0.)
+
+    # Contraction forest, used to expand the cycles.
+    cdef vector[int] *forest_parent = &workspace.forest_parent
+    cdef vector[int] *first_child = &workspace.first_child
+    cdef vector[int] *next_sibling = &workspace.next_sibling
+    forest_parent.assign(n_nodes, -1)
+    first_child.assign(n_nodes, -1)
+    next_sibling.assign(n_nodes, -1)
+
+    cdef vector[int] *path = &workspace.path
+    cdef vector[int] *cycle_slots = &workspace.cycle_slots
+    path.clear()
+
+    cdef int start, node, slot, other_slot, best_slot, parent_node, cycle_node, member_slot
+    cdef int contraction, contraction_slot
+    cdef size_t i
+    cdef float best_weight, weight
+
+    for slot in range(n_vertices):
+        deref(slot_node)[slot] = slot
+        deref(node_slot)[slot] = slot
+        for other_slot in range(n_vertices):
+            edges[slot * n_vertices + other_slot] = other_slot * n_vertices + slot
+
+    for start in range(n_vertices):
+        if deref(state)[start] != UNVISITED:
+            continue
+
+        # Grow a path of nodes by following the best incoming edges,
+        # until we reach a node that is connected to the root.
+        node = start
+        deref(state)[node] = ON_PATH
+        path.push_back(node)
+        while True:
+            slot = deref(node_slot)[node]
+
+            # Find the best incoming edge of the node, the diagonal holds
+            # the edge from the root.
+            best_slot = slot
+            best_weight = incoming[slot * n_vertices + slot]
+            for other_slot in range(n_vertices):
+                if other_slot == slot or deref(slot_node)[other_slot] == -1:
+                    continue
+                weight = incoming[slot * n_vertices + other_slot]
+                if weight > best_weight:
+                    best_slot = other_slot
+                    best_weight = weight
+
+            deref(enter)[node] = edges[slot * n_vertices + best_slot]
+            deref(enter_weight)[node] = best_weight
+
+            if best_slot == slot or deref(state)[deref(slot_node)[best_slot]] == DONE:
+                # The path is connected to the root.
+                for i in range(path.size()):
+                    deref(state)[deref(path)[i]] = DONE
+                path.clear()
+                break
+
+            parent_node = deref(slot_node)[best_slot]
+            if deref(state)[parent_node] == UNVISITED:
+                deref(state)[parent_node] = ON_PATH
+                path.push_back(parent_node)
+                node = parent_node
+                continue
+
+            # The best incoming edge closes a cycle, which consists of the
+            # nodes on the path from the parent to the current node.
+            contraction = next_node
+            next_node += 1
+            cycle_slots.clear()
+            while True:
+                cycle_node = path.back()
+                path.pop_back()
+                deref(state)[cycle_node] = CONTRACTED
+                member_slot = deref(node_slot)[cycle_node]
+                cycle_slots.push_back(member_slot)
+                deref(in_cycle)[member_slot] = True
+
+                deref(forest_parent)[cycle_node] = contraction
+                deref(next_sibling)[cycle_node] = deref(first_child)[contraction]
+                deref(first_child)[contraction] = cycle_node
+
+                if cycle_node == parent_node:
+                    break
+
+            contract_cycle_tarjan(incoming, edges, n_vertices, deref(cycle_slots), deref(in_cycle),
+                                  deref(slot_node), deref(enter_weight))
+
+            for i in range(cycle_slots.size()):
+                deref(in_cycle)[deref(cycle_slots)[i]] = False
+                deref(slot_node)[deref(cycle_slots)[i]] = -1
+
+            contraction_slot = deref(cycle_slots)[0]
+            deref(slot_node)[contraction_slot] = contraction
+            deref(node_slot)[contraction] = contraction_slot
+
+            deref(state)[contraction] = ON_PATH
+            path.push_back(contraction)
+            node = contraction
+
+    expand_contractions(workspace, n_vertices, next_node, parents)
+
+
+cdef void contract_cycle_tarjan(float *incoming, int *edges, int n_vertices,
+                                const vector[int] &cycle_slots, const vector[bool] &in_cycle,
+                                const vector[int] &slot_node, const vector[float] &enter_weight) nogil:
+    """Compute the edges of a contracted cycle and store them in the first
+    slot of the cycle."""
+    cdef int contraction_slot = cycle_slots[0]
+    cdef int other_slot, member_slot, best_in_slot, best_out_slot
+    cdef float best_in, best_out, weight
+    cdef size_t i
+
+    for other_slot in range(n_vertices):
+        if slot_node[other_slot] == -1 or in_cycle[other_slot]:
+            continue
+
+        best_in = -INFINITY
+        best_out = -INFINITY
+        best_in_slot = -1
+        best_out_slot = -1
+        for i in range(cycle_slots.size()):
+            member_slot = cycle_slots[i]
+
+            # Incoming edge (u, v) is replaced by (u, v_cycle), its weight is
+            # reduced by the weight of the cycle edge that it would replace.
+            # See Kübler et al., 2009, pp. 47.
+            weight = incoming[member_slot * n_vertices + other_slot] - enter_weight[slot_node[member_slot]]
+            if weight > best_in:
+                best_in = weight
+                best_in_slot = member_slot
+
+            # Outgoing edge (v, w) is replaced by (v_cycle, w).
+            weight = incoming[other_slot * n_vertices + member_slot]
+            if weight > best_out:
+                best_out = weight
+                best_out_slot = member_slot
+
+        incoming[contraction_slot * n_vertices + other_slot] = best_in
+        edges[contraction_slot * n_vertices + other_slot] = edges[best_in_slot * n_vertices + other_slot]
+        incoming[other_slot * n_vertices + contraction_slot] = best_out
+        edges[other_slot * n_vertices + contraction_slot] = edges[other_slot * n_vertices + best_out_slot]
+
+    # Edges from the root, which are stored on the diagonal.
+    best_in = -INFINITY
+    best_in_slot = -1
+    for i in range(cycle_slots.size()):
+        member_slot = cycle_slots[i]
+        weight = incoming[member_slot * n_vertices + member_slot] - enter_weight[slot_node[member_slot]]
+        if weight > best_in:
+            best_in = weight
+            best_in_slot = member_slot
+    incoming[contraction_slot * n_vertices + contraction_slot] = best_in
+    edges[contraction_slot * n_vertices + contraction_slot] = edges[best_in_slot * n_vertices + best_in_slot]
+
+
+cdef void expand_contractions(Workspace *workspace, int n_vertices, int n_nodes, int *parents) nogil:
+    """Expand contracted cycles using the contraction forest (Camerini et
+    al., 1979). Each node that is not removed contributes its entering edge
+    to the tree. Taking the entering edge (u, v) of a node removes all the
+    nodes on the path from v to the node, since v's other edges would
+    introduce a cycle."""
+    cdef vector[int] *roots = &workspace.roots
+    cdef int node, edge, vertex, prev, child
+
+    roots.clear()
+    for node in range(n_nodes):
+        if workspace.forest_parent[node] == -1:
+            roots.push_back(node)
+
+    while not roots.empty():
+        node = roots.back()
+        roots.pop_back()
+
+        # Edges from the root are encoded as self-loops, which is also how
+        # spaCy encodes roots.
+        edge = workspace.enter[node]
+        vertex = edge % n_vertices
+        parents[vertex] = edge // n_vertices
+
+        # Remove the path from the vertex to the node. The other children
+        # of the nodes on the path now become roots.
+        prev = -1
+        while True:
+            child = workspace.first_child[vertex]
+            while child != -1:
+                if child != prev:
+                    roots.push_back(child)
+                child = workspace.next_sibling[child]
+            if vertex == node:
+                break
+            prev = vertex
+            vertex = workspace.forest_parent[vertex]
+
+
+cdef void decode_sparse_sentences(void *ctx, int worker, int begin, int end) nogil:
+    cdef SparseBatch *batch = <SparseBatch *> ctx
+    cdef int i, token
+    cdef size_t first_row
+    cdef Workspace *workspace = batch.workspaces[worker]
+    cdef bool finite
+
+    for i in range(begin, end):
+        first_row = batch.offsets[i]
+        if batch.scores.dtype == FLOAT16:
+            finite = read_candidate_edges(<const unsigned short *> batch.scores.data + first_row * batch.scores.row_stride,
+                                          batch.scores.row_stride, batch.candidates + first_row * batch.n_candidates,
+                                          batch.n_candidates, batch.lengths[i], workspace)
+        elif batch.scores.dtype == FLOAT32:
+            finite = read_candidate_edges(<const float *> batch.scores.data + first_row * batch.scores.row_stride,
+                                          batch.scores.row_stride, batch.candidates + first_row * batch.n_candidates,
+                                          batch.n_candidates, batch.lengths[i], workspace)
+        else:
+            finite = read_candidate_edges(<const double *> batch.scores.data + first_row * batch.scores.row_stride,
+                                          batch.scores.row_stride, batch.candidates + first_row * batch.n_candidates,
+                                          batch.n_candidates, batch.lengths[i], workspace)
+
+        if not finite:
+            batch.outcomes[i] = NON_FINITE
+            continue
+
+        batch.outcomes[i] = sparse_chu_liu_edmonds(workspace, batch.lengths[i], batch.heads + first_row)
+        if batch.outcomes[i] == NO_TREE:
+            for token in range(batch.lengths[i]):
+                batch.heads[first_row + token] = -1
+
+
+cdef bool read_candidate_edges(const score_t *scores, size_t n_cols, const int *candidates, int n_candidates,
+                               int seq_len, Workspace *workspace) nogil:
+    """Store the candidate edges of a sentence as the first level of the
+    sparse graph. Vertex 0 is the root, vertex i + 1 is the i-th token.
+    Returns False if a candidate score is not finite."""
+    workspace.edge_source.clear()
+    workspace.edge_target.clear()
+    workspace.edge_weight.clear()
+    workspace.edge_origin.clear()
+
+    cdef int dep, i, head
+    cdef float score
+    for dep in range(seq_len):
+        for i in range(n_candidates):
+            head = candidates[dep * n_candidates + i]
+            if head == -1:
+                continue
+            score = to_float(scores[dep * n_cols + i])
+            if not isfinite(score):
+                return False
+            workspace.edge_source.push_back(0 if head == dep else head + 1)
+            workspace.edge_target.push_back(dep + 1)
+            workspace.edge_weight.push_back(score)
+            workspace.edge_origin.push_back(-1)
+
+    return True
+
+
+cdef Outcome sparse_chu_liu_edmonds(Workspace *workspace, int seq_len, int *heads) nogil:
+    """Chu-Liu-Edmonds for sparse graphs, using the edges read by
+    `read_candidate_edges`. Every round picks the best incoming edge of each
+    node and contracts all cycles at once, giving a new level of the graph
+    with its own nodes and edges. Every round takes time linear in the
+    number of edges and typically, only one or two rounds are needed.
+
+    Returns NO_TREE if some node does not have an incoming edge, since the
+    graph then does not have a spanning tree."""
+    # The nodes of level l are stored at level_nodes[l] ...
+    # level_nodes[l + 1] - 1 of the per-node vectors, the edges at
+    # level_edges[l] ... level_edges[l + 1] - 1 of the per-edge vectors.
+    # Within a level, node 0 is the root. Edges use the level's node
+    # numbers and edge_origin refers to the edge of the previous level.
+    cdef vector[int] *level_nodes = &workspace.level_nodes
+    cdef vector[int] *level_edges = &workspace.level_edges
+    cdef vector[int] *source = &workspace.edge_source
+    cdef vector[int] *target = &workspace.edge_target
+    cdef vector[float] *weight = &workspace.edge_weight
+    cdef vector[int] *origin = &workspace.edge_origin
+    cdef vector[int] *best_edge = &workspace.best_edge
+    cdef vector[int] *component = &workspace.component
+    cdef vector[bool] *contracted = &workspace.contracted
+    cdef vector[int] *selected = &workspace.selected
+    cdef vector[int] *walk = &workspace.walk
+
+    level_nodes.clear()
+    level_nodes.push_back(0)
+    level_nodes.push_back(seq_len + 1)
+    level_edges.clear()
+    level_edges.push_back(0)
+    level_edges.push_back(source.size())
+    best_edge.clear()
+    component.clear()
+    contracted.assign(seq_len + 1, False)
+
+    cdef int level = 0
+    cdef int node_base, next_base, n_nodes, n_next, node, start, member, edge, source_node, target_node
+    cdef int first_edge, last_edge
+    cdef bool has_cycle
+    cdef float edge_weight
+    while True:
+        node_base = deref(level_nodes)[level]
+        next_base = deref(level_nodes)[level + 1]
+        n_nodes = next_base - node_base
+        first_edge = deref(level_edges)[level]
+        last_edge = deref(level_edges)[level + 1]
+
+        # Find the best incoming edge of each node.
+        best_edge.resize(next_base, -1)
+        for edge in range(first_edge, last_edge):
+            node = node_base + deref(target)[edge]
+            if deref(best_edge)[node] == -1 or deref(weight)[edge] > deref(weight)[deref(best_edge)[node]]:
+                deref(best_edge)[node] = edge
+        for node in range(1, n_nodes):
+            if deref(best_edge)[node_base + node] == -1:
+                return NO_TREE
+
+        # Follow the best edges from each node to find cycles. Nodes in a
+        # cycle become a single node in the next level.
+        component.resize(next_base, -1)
+        deref(component)[node_base] = 0
+        contracted.push_back(False)
+        n_next = 1
+        has_cycle = False
+        walk.assign(n_nodes, -1)
+        for start in range(1, n_nodes):
+            node = start
+            while node != 0 and deref(walk)[node] == -1:
+                deref(walk)[node] = start
+                node = deref(source)[deref(best_edge)[node_base + node]]
+            if node == 0 or deref(walk)[node] != start:
+                continue
+
+            has_cycle = True
+            member = node
+            while True:
+                deref(component)[node_base + member] = n_next
+                member = deref(source)[deref(best_edge)[node_base + member]]
+                if member == node:
+                    break
+            contracted.push_back(True)
+            n_next += 1
+
+        if not has_cycle:
+            break
+
+        for node in range(1, n_nodes):
+            if deref(component)[node_base + node] == -1:
+                deref(component)[node_base + node] = n_next
+                contracted.push_back(False)
+                n_next += 1
+
+        # Edges of the next level. The weight of an edge entering a cycle
+        # is reduced by the weight of the cycle edge that it would replace.
+        # See Kübler et al., 2009, pp. 47.
+        for edge in range(first_edge, last_edge):
+            source_node = deref(component)[node_base + deref(source)[edge]]
+            target_node = deref(component)[node_base + deref(target)[edge]]
+            if source_node == target_node:
+                continue
+            edge_weight = deref(weight)[edge]
+            if deref(contracted)[next_base + target_node]:
+                edge_weight -= deref(weight)[deref(best_edge)[node_base + deref(target)[edge]]]
+            source.push_back(source_node)
+            target.push_back(target_node)
+            weight.push_back(edge_weight)
+            origin.push_back(edge)
+
+        level_nodes.push_back(next_base + n_next)
+        level_edges.push_back(source.size())
+        level += 1
+
+    # The best edges of the last level form a tree. Expand the contracted
+    # cycles level by level: the node that the edge entering a cycle points
+    # to takes that edge, the other nodes of the cycle keep their best edge.
+    selected.resize(next_base)
+    for node in range(1, n_nodes):
+        deref(selected)[node_base + node] = deref(best_edge)[node_base + node]
+
+    while level > 0:
+        level -= 1
+        node_base = deref(level_nodes)[level]
+        next_base = deref(level_nodes)[level + 1]
+        for node in range(1, next_base - node_base):
+            member = next_base + deref(component)[node_base + node]
+            edge = deref(origin)[deref(selected)[member]]
+            if deref(contracted)[member] and deref(target)[edge] != node:
+                edge = deref(best_edge)[node_base + node]
+            deref(selected)[node_base + node] = edge
+
+    for node in range(seq_len):
+        source_node = deref(source)[deref(selected)[node + 1]]
+        heads[node] = node if source_node == 0 else source_node - 1
+
+    return FAST_PATH if deref(level_nodes).size() == 2 else FULL
+
+
+cdef check_edge_weights(const float [:, :] scores, int root_vertex):
+    if scores.shape[0] != scores.shape[1]:
+        raise ValueError(f"Edge weight matrix with shape ({scores.shape[0]}, {scores.shape[1]}) is not a square matrix")
+
+    if root_vertex < 0 or root_vertex >= scores.shape[0]:
+        raise IndexError(f"Root vertex {root_vertex} is out of bounds for edge weight matrix with shape ({scores.shape[0]}, {scores.shape[1]})")
+
+    check_all_finite(scores)
+
 cdef check_all_finite(const float [:, :] scores):
     cdef int i, j
 
@@ -142,8 +1188,8 @@ cdef check_all_finite(const float [:, :] scores):
                 raise ValueError(f"Edge weight matrix contains non-finite score: {scores[i, j]}",)
 
 cdef pair[replacement_map, replacement_map] contract_cycle(
-        float [:, :] scores, const vector[int] &max_parents, vector[bool] &active_vertices,
-        const vector[int] &cycle) nogil:
+        float *scores, int n_vertices, const vector[int] &max_parents,
+        vector[bool] &active_vertices, const vector[int] &cycle) nogil:
     """Contract the given cycle. Updates the score matrix and active vertices.
        Returns a mapping of replaced edges."""
     # The first vertex of the cycle is used to represent the contraction.
@@ -158,7 +1204,7 @@ cdef pair[replacement_map, replacement_map] contract_cycle(
     while vertex_iter != cycle.end():
         vertex = deref(vertex_iter)
         parent = max_parents[vertex]
-        cycle_sum += scores[parent, vertex]
+        cycle_sum += scores[parent * n_vertices + vertex]
         inc(vertex_iter)
 
     # Mark the cycle vertices as inactive.
@@ -183,7 +1229,7 @@ cdef pair[replacement_map, replacement_map] contract_cycle(
     cdef int best_parent
     cdef float best_weight
     cdef float incoming_score
-    for vertex in range(scores.shape[0]):
+    for vertex in range(n_vertices):
         if not active_vertices[vertex] or cycle_vertices.find(vertex) != cycle_vertices.end():
             continue
 
@@ -197,13 +1243,13 @@ cdef pair[replacement_map, replacement_map] contract_cycle(
             cycle_vertex = deref(vertex_iter)
 
             # Replace (v, w) by (v_cycle, w)
-            if scores[cycle_vertex, vertex] > best_outgoing:
-                best_outgoing = scores[cycle_vertex, vertex]
+            if scores[cycle_vertex * n_vertices + vertex] > best_outgoing:
+                best_outgoing = scores[cycle_vertex * n_vertices + vertex]
                 best_outgoing_vertex = cycle_vertex
 
             best_parent = max_parents[cycle_vertex]
-            best_weight = scores[best_parent, cycle_vertex]
-            incoming_score = cycle_sum + scores[vertex, cycle_vertex] - best_weight
+            best_weight = scores[best_parent * n_vertices + cycle_vertex]
+            incoming_score = cycle_sum + scores[vertex * n_vertices + cycle_vertex] - best_weight
 
             # Replace (u, v) by (u, v_cycle)
             if incoming_score > best_incoming:
@@ -213,8 +1259,8 @@ cdef pair[replacement_map, replacement_map] contract_cycle(
             inc(vertex_iter)
 
         # Save max incoming edge(u, v_cyle) and max outgoing edge (v_cycle, w).
-        scores[vertex, first_in_cycle] = best_incoming;
-        scores[first_in_cycle, vertex] = best_outgoing;
+        scores[vertex * n_vertices + first_in_cycle] = best_incoming
+        scores[first_in_cycle * n_vertices + vertex] = best_outgoing
 
         incoming_replacements[pair[int, int](vertex, first_in_cycle)] = best_incoming_vertex
         outgoing_replacements[pair[int, int](first_in_cycle, vertex)] = best_outgoing_vertex
@@ -291,22 +1337,20 @@ cdef vector[int] _find_cycle(const vector[int] &parents, vector[bool] &visited,
 
     on_stack[vertex] = False
 
-cdef vector[int] find_max_parents(const float [:, :] scores, int root_vertex,
+cdef vector[int] find_max_parents(const float *scores, int n_vertices, int root_vertex,
                                   const vector[bool] &active_vertices) nogil:
     cdef vector[int] max_parents = vector[int](active_vertices.size(), NO_PARENT)
-    cdef const float [:] child_incoming
     cdef int child, parent, best_parent
     cdef float score, best_score
 
-    for child in range(scores.shape[1]):
+    for child in range(n_vertices):
         if child == root_vertex or not active_vertices[child]:
             continue
 
-        child_incoming = scores[:, child]
         best_parent = root_vertex
-        best_score = child_incoming[root_vertex]
-        for parent in range(child_incoming.shape[0]):
-            score = child_incoming[parent]
+        best_score = scores[root_vertex * n_vertices + child]
+        for parent in range(n_vertices):
+            score = scores[parent * n_vertices + child]
             if parent != child and score > best_score and active_vertices[parent]:
                 best_parent = parent
                 best_score = score
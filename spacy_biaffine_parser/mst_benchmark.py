@@ -0,0 +1,221 @@
+"""Benchmark of the MST decoders.
+
+Run the benchmark with:
+
+    python -m spacy_biaffine_parser.mst_benchmark
+
+Store the results as a baseline with `--save-baseline baseline.json` and
+compare against it later with `--baseline baseline.json`, which exits with
+an error when a decoder got slower than the baseline by more than the
+threshold. The same check is available as a pytest test, which runs with
+`pytest -m benchmark` when MST_BENCHMARK_BASELINE is set to the path of
+the baseline (see `tests/test_mst_benchmark.py`).
+"""
+
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from .mst import get_decode_stats, get_workspace_bytes, mst_decode, reset_decode_stats
+
+
+def treebank_lengths(rng: np.random.Generator, n_sents: int) -> List[int]:
+    """Sentence lengths with a distribution similar to that of treebanks:
+    most sentences have 10-30 tokens, with a long tail."""
+    lengths = 1 + rng.gamma(shape=2.5, scale=8.0, size=n_sents)
+    return np.minimum(lengths, 150).astype(int).tolist()
+
+
+def random_scores(rng: np.random.Generator, seq_len: int) -> np.ndarray:
+    """Scores of a model that is fairly certain about the heads of a random
+    tree, so that most sentences are decoded through the fast path."""
+    scores = rng.normal(size=(seq_len, seq_len)).astype(np.float32)
+    # Attach each token to a token that comes earlier in a random order.
+    order = rng.permutation(seq_len)
+    heads = np.empty(seq_len, dtype=int)
+    heads[order[0]] = order[0]
+    heads[order[1:]] = order[(rng.random(seq_len - 1) * np.arange(1, seq_len)).astype(int)]
+    scores[np.arange(seq_len), heads] += 5.0
+    return scores
+
+
+def ring_scores(rng: np.random.Generator, seq_len: int) -> np.ndarray:
+    """Scores where the best head of each token is the next token, so that
+    the best heads form a single cycle through the whole sentence."""
+    scores = rng.uniform(0.0, 1.0, size=(seq_len, seq_len)).astype(np.float32)
+    scores[np.arange(seq_len), (np.arange(seq_len) + 1) % seq_len] += 10.0
+    return scores
+
+
+def nested_cycle_scores(rng: np.random.Generator, seq_len: int) -> np.ndarray:
+    """Scores that force deep cycle contraction. The best heads form cycles
+    of two tokens, after contracting these, the best edges form cycles of
+    two contracted cycles, and so on. The weight of an edge only depends
+    on the highest bit in which the positions of the tokens differ."""
+    positions = np.arange(seq_len)
+    differing = positions[:, None] ^ positions[None, :]
+    level = np.floor(np.log2(np.maximum(differing, 1))).astype(np.float32)
+    scores = 10.0 * (level.max() + 1 - level)
+    scores += rng.uniform(0.0, 1.0, size=(seq_len, seq_len))
+    # Attaching to the root is the worst option.
+    scores[positions, positions] = 0.0
+    return scores.astype(np.float32)
+
+
+# Workloads: name -> function that generates the score matrices.
+WORKLOADS: Dict[str, Callable[[np.random.Generator], List[np.ndarray]]] = {
+    "treebank": lambda rng: [random_scores(rng, n) for n in treebank_lengths(rng, 500)],
+    "len100": lambda rng: [random_scores(rng, 100) for _ in range(50)],
+    "len500": lambda rng: [random_scores(rng, 500) for _ in range(10)],
+    "len2000": lambda rng: [random_scores(rng, 2000) for _ in range(3)],
+    "ring500": lambda rng: [ring_scores(rng, 500) for _ in range(5)],
+    "nested512": lambda rng: [nested_cycle_scores(rng, 512) for _ in range(5)],
+}
+
+ALGORITHMS = ["tarjan", "chu_liu_edmonds"]
+
+
+def benchmark(sents: List[np.ndarray], algorithm: str) -> Dict[str, float]:
+    """Decode each sentence and return the latency percentiles (in
+    microseconds), the fraction of sentences decoded through the fast
+    path and allocation statistics.
+
+    `workspace_growths` counts the sentences for which the decoder had to
+    grow its reusable scratch space, `peak_kib` is the highest amount of
+    Python/NumPy heap memory in KiB that decoding a sentence used."""
+    # Warm up, so that the scratch space of the longest sentence is
+    # allocated and sentences of other lengths do not allocate.
+    mst_decode(max(sents, key=len), algorithm=algorithm)
+
+    reset_decode_stats()
+    latencies = []
+    for scores in sents:
+        start = time.perf_counter_ns()
+        mst_decode(scores, algorithm=algorithm)
+        latencies.append(time.perf_counter_ns() - start)
+    stats = get_decode_stats()
+
+    # Measure allocations in a separate pass, since tracing slows down
+    # decoding.
+    workspace_growths = 0
+    peak = 0
+    for scores in sents:
+        workspace_bytes = get_workspace_bytes()
+        tracemalloc.start()
+        try:
+            mst_decode(scores, algorithm=algorithm)
+            _, sent_peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        peak = max(peak, sent_peak)
+        workspace_growths += get_workspace_bytes() > workspace_bytes
+
+    latencies = np.array(latencies) / 1000
+    return {
+        "sentences": len(sents),
+        "tokens": sum(len(scores) for scores in sents),
+        "fast_path": stats["fast_path"] / max(stats["sentences"], 1),
+        "p50_us": float(np.percentile(latencies, 50)),
+        "p90_us": float(np.percentile(latencies, 90)),
+        "p99_us": float(np.percentile(latencies, 99)),
+        "max_us": float(latencies.max()),
+        "workspace_growths": workspace_growths,
+        "peak_kib": peak / 1024,
+    }
+
+
+def run_benchmarks(
+    workloads: Optional[List[str]] = None,
+    algorithms: Optional[List[str]] = None,
+    *,
+    seed: int = 42,
+) -> Dict[str, Dict[str, float]]:
+    """Run the benchmarks for the given workloads and algorithms (all by
+    default). Returns the results of `benchmark`, keyed by
+    "<workload>/<algorithm>"."""
+    if workloads is None:
+        workloads = list(WORKLOADS)
+    if algorithms is None:
+        algorithms = ALGORITHMS
+
+    results = {}
+    for workload in workloads:
+        sents = WORKLOADS[workload](np.random.default_rng(seed))
+        for algorithm in algorithms:
+            results[f"{workload}/{algorithm}"] = benchmark(sents, algorithm)
+    return results
+
+
+def find_regressions(
+    results: Dict[str, Dict[str, float]],
+    baseline: Dict[str, Dict[str, float]],
+    *,
+    threshold: float = 0.25,
+) -> List[str]:
+    """Compare benchmark results to a baseline. A benchmark regresses when
+    its median or 90th percentile latency is more than `threshold` (as a
+    fraction) higher than in the baseline, or when its scratch space grows
+    more often. Returns a description of every regression."""
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        reference = baseline[name]
+        for key in ["p50_us", "p90_us"]:
+            if result[key] > reference[key] * (1 + threshold):
+                regressions.append(
+                    f"{name}: {key} regressed from {reference[key]:.1f} to {result[key]:.1f}"
+                )
+        if result["workspace_growths"] > reference["workspace_growths"]:
+            regressions.append(
+                f"{name}: workspace_growths regressed from "
+                f"{reference['workspace_growths']} to {result['workspace_growths']}"
+            )
+    return regressions
+
+
+def format_results(results: Dict[str, Dict[str, float]]) -> str:
+    columns = ["sentences", "fast_path", "p50_us", "p90_us", "p99_us", "max_us", "workspace_growths", "peak_kib"]
+    name_width = max(len("benchmark"), *(len(name) for name in results))
+    lines = ["  ".join(["benchmark".ljust(name_width)] + [column.rjust(12) for column in columns])]
+    for name, result in results.items():
+        values = [f"{result[column]:12.2f}" if isinstance(result[column], float) else f"{result[column]:12d}" for column in columns]
+        lines.append("  ".join([name.ljust(name_width)] + values))
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the MST decoders.")
+    parser.add_argument("--workloads", nargs="+", choices=list(WORKLOADS), help="workloads to run (default: all)")
+    parser.add_argument("--algorithms", nargs="+", choices=ALGORITHMS, help="algorithms to run (default: all)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--save-baseline", type=Path, help="store the results as a baseline")
+    parser.add_argument("--baseline", type=Path, help="compare the results against a baseline")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown, as a fraction of the baseline")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.workloads, args.algorithms, seed=args.seed)
+    print(format_results(results))
+
+    if args.save_baseline is not None:
+        args.save_baseline.write_text(json.dumps(results, indent=2))
+
+    if args.baseline is not None:
+        baseline = json.loads(args.baseline.read_text())
+        regressions = find_regressions(results, baseline, threshold=args.threshold)
+        for regression in regressions:
+            print(regression, file=sys.stderr)
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,12 +1,13 @@
-from typing import List, Optional, Tuple, cast
+from typing import List, Optional, Tuple, Union, cast
 
+import numpy as np
 from spacy import registry
 from spacy.tokens.doc import Doc
 from thinc.api import Model, PyTorchWrapper_v2
-from thinc.api import chain, get_width, list2array, torch2xp
+from thinc.api import chain, get_array_module, get_width, list2array, to_numpy, torch2xp
 from thinc.api import with_getitem, xp2torch
 from thinc.shims.pytorch_grad_scaler import PyTorchGradScaler
-from thinc.types import ArgsKwargs, Floats2d, Floats3d, Floats4d, Ints1d
+from thinc.types import ArgsKwargs, Floats1d, Floats2d, Floats3d, Floats4d, Ints1d
 
 from .pytorch_pairwise_bilinear import (
     PairwiseBilinearModel as PyTorchPairwiseBilinearModel,
@@ -21,25 +22,27 @@ def build_pairwise_bilinear(
     dropout: float = 0.1,
     hidden_width: int = 128,
     mixed_precision: bool = False,
-    grad_scaler: Optional[PyTorchGradScaler] = None
-) -> Model[Tuple[List[Doc], Ints1d], Floats2d]:
+    grad_scaler: Optional[PyTorchGradScaler] = None,
+    inference_precision: str = "fp32",
+    inference_buckets: Optional[List[int]] = None,
+    length_buckets: Optional[List[int]] = None,
+    ragged_scores: bool = False
+) -> Model[Tuple[List[Doc], Ints1d], Union[Floats1d, Floats2d]]:
     nI = None
     if tok2vec.has_dim("nO") is True:
         nI = tok2vec.get_dim("nO")
 
-    pairwise_bilinear: Model[Tuple[Floats2d, Ints1d], Floats2d] = Model(
-        "pairwise_bilinear",
-        forward=pairswise_bilinear_forward,
-        init=pairwise_bilinear_init,
-        dims={"nI": nI, "nO": nO},
-        attrs={
-            # We currently do not update dropout when dropout_rate is
-            # changed, since we cannot access the underlying model.
-            "dropout_rate": dropout,
-            "hidden_width": hidden_width,
-            "mixed_precision": mixed_precision,
-            "grad_scaler": grad_scaler,
-        },
+    pairwise_bilinear = build_pairwise_bilinear_layer(
+        nI,
+        nO,
+        dropout=dropout,
+        hidden_width=hidden_width,
+        mixed_precision=mixed_precision,
+        grad_scaler=grad_scaler,
+        inference_precision=inference_precision,
+        inference_buckets=inference_buckets,
+        length_buckets=length_buckets,
+        ragged_scores=ragged_scores,
     )
 
     model = chain(
@@ -51,11 +54,68 @@ def build_pairwise_bilinear(
         ),
         pairwise_bilinear,
     )
+    model.set_ref("tok2vec", tok2vec)
     model.set_ref("pairwise_bilinear", pairwise_bilinear)
 
     return model
 
 
+def build_pairwise_bilinear_layer(
+    nI: Optional[int] = None,
+    nO: Optional[int] = None,
+    *,
+    dropout: float = 0.1,
+    hidden_width: int = 128,
+    mixed_precision: bool = False,
+    grad_scaler: Optional[PyTorchGradScaler] = None,
+    inference_precision: str = "fp32",
+    inference_buckets: Optional[List[int]] = None,
+    length_buckets: Optional[List[int]] = None,
+    ragged_scores: bool = False
+) -> Model[Tuple[Floats2d, Ints1d], Union[Floats1d, Floats2d]]:
+    """Build the pairwise bilinear layer, which takes the flattened token
+    representations and sentence lengths as its input.
+
+    When `inference_buckets` is set, prediction pads the sentences to the
+    smallest bucket length that fits them and uses a scorer that is traced
+    with TorchScript for each bucket length.
+
+    When `length_buckets` is set, the sentences are split into buckets at
+    the given lengths, both in training and in prediction. Each bucket is
+    padded to its longest sentence rather than to the longest sentence of
+    the batch. The scores of the buckets are reassembled in the original
+    order. Score columns past the longest sentence of a bucket are 0 in
+    training and -10000 in prediction, like the scores of padding.
+
+    When `ragged_scores` is set, the scores are returned as a ragged vector
+    of shape [sum(lengths ** 2)] that stores the square score matrix of
+    each sentence consecutively, rather than as a matrix of shape
+    [sum(lengths), max(lengths)] that is padded to the longest sentence.
+    The decoders and the losses of the components accept both formats."""
+    if length_buckets is not None:
+        length_buckets = sorted(set(length_buckets))
+        if length_buckets and length_buckets[0] < 1:
+            raise ValueError(f"Length buckets must be positive, was: {length_buckets[0]}")
+    return Model(
+        "pairwise_bilinear",
+        forward=pairswise_bilinear_forward,
+        init=pairwise_bilinear_init,
+        dims={"nI": nI, "nO": nO},
+        attrs={
+            # We currently do not update dropout when dropout_rate is
+            # changed, since we cannot access the underlying model.
+            "dropout_rate": dropout,
+            "hidden_width": hidden_width,
+            "mixed_precision": mixed_precision,
+            "grad_scaler": grad_scaler,
+            "inference_precision": inference_precision,
+            "inference_buckets": inference_buckets,
+            "length_buckets": length_buckets,
+            "ragged_scores": ragged_scores,
+        },
+    )
+
+
 def pairwise_bilinear_init(model: Model, X=None, Y=None):
     if model.layers:
         return
@@ -76,6 +136,8 @@ def pairwise_bilinear_init(model: Model, X=None, Y=None):
                 model.get_dim("nO"),
                 dropout=model.attrs["dropout_rate"],
                 hidden_width=hidden_width,
+                inference_precision=model.attrs["inference_precision"],
+                inference_buckets=model.attrs["inference_buckets"],
             ),
             convert_inputs=convert_inputs,
             convert_outputs=convert_outputs,
@@ -85,8 +147,121 @@ def pairwise_bilinear_init(model: Model, X=None, Y=None):
     ]
 
 
+def warm_up(model: Model, batch_size: int = 1):
+    """Trace the scorers of all pairwise bilinear layers in a model that
+    have inference buckets."""
+    for node in model.walk():
+        if node.name == "pairwise_bilinear" and node.layers:
+            node.layers[0].shims[0]._model.warm_up(batch_size)
+
+
 def pairswise_bilinear_forward(model: Model, X, is_train: bool):
-    return model.layers[0](X, is_train)
+    Y, backprop = padded_forward(model, X, is_train)
+    if not model.attrs["ragged_scores"]:
+        return Y, backprop
+
+    ops = model.ops
+    _, L = X
+    mask = ragged_score_mask(L, Y.shape[1])
+    Y_ragged = Y[mask]
+
+    def backprop_ragged(dY: Floats1d) -> Tuple[Floats2d, Ints1d]:
+        dY_padded = ops.alloc2f(*Y.shape)
+        dY_padded[mask] = dY
+        return backprop(dY_padded)
+
+    return Y_ragged, backprop_ragged
+
+
+def padded_forward(model: Model, X, is_train: bool):
+    pytorch_layer = model.layers[0]
+    length_buckets = model.attrs["length_buckets"]
+    if not length_buckets:
+        return pytorch_layer(X, is_train)
+
+    ops = model.ops
+    X_flat, L = X
+    lens = to_numpy(L)
+    bucket_ids = np.searchsorted(length_buckets, lens)
+    buckets = [np.flatnonzero(bucket_ids == bucket_id) for bucket_id in np.unique(bucket_ids)]
+    if len(buckets) <= 1:
+        return pytorch_layer(X, is_train)
+
+    # The rows of the tokens of the sentences of each bucket.
+    starts = np.cumsum(lens) - lens
+    bucket_rows = []
+    for bucket in buckets:
+        bucket_lens = lens[bucket]
+        bucket_starts = np.cumsum(bucket_lens) - bucket_lens
+        rows = np.repeat(starts[bucket] - bucket_starts, bucket_lens) + np.arange(bucket_lens.sum())
+        bucket_rows.append(ops.asarray1i(cast(Ints1d, rows)))
+
+    Y = ops.alloc2f(X_flat.shape[0], int(lens.max()))
+    if not is_train:
+        Y.fill(-10000.0)
+    backprops = []
+    for bucket, rows in zip(buckets, bucket_rows):
+        Y_bucket, backprop_bucket = pytorch_layer((X_flat[rows], ops.asarray1i(lens[bucket])), is_train)
+        Y[rows, : Y_bucket.shape[1]] = Y_bucket
+        backprops.append((rows, Y_bucket.shape[1], backprop_bucket))
+
+    def backprop(dY: Floats2d) -> Tuple[Floats2d, Ints1d]:
+        dX = ops.alloc2f(*X_flat.shape)
+        for rows, width, backprop_bucket in backprops:
+            dX_bucket, _ = backprop_bucket(ops.as_contig(dY[rows, :width]))
+            dX[rows] = dX_bucket
+        return dX, L
+
+    return Y, backprop
+
+
+def ragged_score_mask(lens: Ints1d, width: int):
+    """Get the mask of the scores of a padded score matrix of shape
+    [sum(lens), width] that are within the sentences. Selecting the masked
+    scores gives the ragged scores. The mask is created on the device of
+    `lens`."""
+    xp = get_array_module(lens)
+    ends = xp.cumsum(lens)
+    n_tokens = int(ends[-1]) if ends.shape[0] else 0
+    # The length of the sentence of every token.
+    token_lens = lens[xp.searchsorted(ends, xp.arange(n_tokens), side="right")]
+    return xp.arange(width) < token_lens[:, None]
+
+
+def ragged_score_offsets(lens: np.ndarray) -> np.ndarray:
+    """Get the offset of the square score matrix of each sentence in
+    ragged scores."""
+    sizes = lens.astype(np.int64) ** 2
+    return np.cumsum(sizes) - sizes
+
+
+def ragged_row_offsets(lens: np.ndarray) -> np.ndarray:
+    """Get the offset of the scores of every token in ragged scores. The
+    score of the arc from head i to a token is at the offset of the token
+    plus i."""
+    lens = lens.astype(np.int64)
+    starts = np.cumsum(lens) - lens
+    positions = np.arange(lens.sum()) - np.repeat(starts, lens)
+    return np.repeat(ragged_score_offsets(lens), lens) + positions * np.repeat(lens, lens)
+
+
+def segment_indices(starts: np.ndarray, sizes: np.ndarray) -> np.ndarray:
+    """Get the indices of the elements of consecutive segments with the
+    given starts and sizes."""
+    sizes = sizes.astype(np.int64)
+    return np.repeat(starts - (np.cumsum(sizes) - sizes), sizes) + np.arange(sizes.sum())
+
+
+def pad_ragged_scores(scores: Floats1d, lens, *, fill: float = 0.0) -> Floats2d:
+    """Convert ragged scores to a score matrix of shape [sum(lens),
+    max(lens)], where the scores of padding are set to `fill`."""
+    xp = get_array_module(scores)
+    # Only the sentence lengths are moved to the device of the scores.
+    lens = xp.asarray(lens)
+    mask = ragged_score_mask(lens, int(lens.max()) if lens.shape[0] else 0)
+    padded = xp.full(mask.shape, fill, dtype=scores.dtype)
+    padded[mask] = scores
+    return padded
 
 
 def convert_inputs(
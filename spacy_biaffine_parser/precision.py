@@ -0,0 +1,111 @@
+"""Compare the accuracy of reduced-precision inference to fp32 inference.
+
+Run the comparison with:
+
+    python -m spacy_biaffine_parser.precision model_path corpus.spacy
+
+The reduced-precision modes can also be selected in the model config with
+the `inference_precision` setting of the `PairwiseBilinear.v1`,
+`Bilinear.v1` and `BiaffineParser.v1` architectures.
+"""
+
+import argparse
+import sys
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+import spacy
+from spacy.language import Language
+from spacy.training import Corpus, Example
+from thinc.api import Model
+
+from .pytorch_inference import INFERENCE_PRECISIONS
+
+BILINEAR_LAYERS = ("bilinear", "pairwise_bilinear")
+
+
+def set_inference_precision(model: Model, precision: str):
+    """Set the inference precision of all bilinear layers in a model."""
+    if precision not in INFERENCE_PRECISIONS:
+        raise ValueError(
+            f"Unknown inference precision '{precision}', expected one of: {', '.join(INFERENCE_PRECISIONS)}"
+        )
+    for node in model.walk():
+        if node.name not in BILINEAR_LAYERS:
+            continue
+        node.attrs["inference_precision"] = precision
+        # The PyTorch model is constructed lazily.
+        if node.layers:
+            node.layers[0].shims[0]._model.inference_precision = precision
+
+
+def set_pipeline_inference_precision(nlp: Language, precision: str):
+    """Set the inference precision of all bilinear layers in a pipeline."""
+    for _, component in nlp.pipeline:
+        model = getattr(component, "model", None)
+        if isinstance(model, Model):
+            set_inference_precision(model, precision)
+
+
+def compare_precision(
+    nlp: Language,
+    examples: Iterable[Example],
+    precisions: Optional[List[str]] = None,
+) -> Dict[str, Dict[str, float]]:
+    """Evaluate the pipeline on the examples in fp32 and in each of the given
+    reduced precisions (all by default). Returns the UAS and LAS of each
+    precision and the differences to fp32. The pipeline is set back to
+    fp32 afterwards."""
+    if precisions is None:
+        precisions = [precision for precision in INFERENCE_PRECISIONS if precision != "fp32"]
+    examples = list(examples)
+
+    results = {}
+    try:
+        for precision in ["fp32"] + precisions:
+            set_pipeline_inference_precision(nlp, precision)
+            scores = nlp.evaluate(examples)
+            results[precision] = {"uas": scores["dep_uas"], "las": scores["dep_las"]}
+    finally:
+        set_pipeline_inference_precision(nlp, "fp32")
+
+    for result in results.values():
+        result["uas_delta"] = result["uas"] - results["fp32"]["uas"]
+        result["las_delta"] = result["las"] - results["fp32"]["las"]
+
+    return results
+
+
+def format_results(results: Dict[str, Dict[str, float]]) -> str:
+    columns = ["uas", "las", "uas_delta", "las_delta"]
+    lines = ["  ".join(["precision".ljust(10)] + [column.rjust(10) for column in columns])]
+    for precision, result in results.items():
+        lines.append(
+            "  ".join([precision.ljust(10)] + [f"{result[column]:10.4f}" for column in columns])
+        )
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Compare the accuracy of reduced-precision inference to fp32."
+    )
+    parser.add_argument("model", type=Path, help="path of the pipeline")
+    parser.add_argument("corpus", type=Path, help="evaluation corpus in .spacy format")
+    parser.add_argument(
+        "--precisions",
+        nargs="+",
+        choices=[precision for precision in INFERENCE_PRECISIONS if precision != "fp32"],
+        help="precisions to compare (default: all)",
+    )
+    args = parser.parse_args(argv)
+
+    nlp = spacy.load(args.model)
+    examples = Corpus(args.corpus)(nlp)
+    print(format_results(compare_precision(nlp, examples, args.precisions)))
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,8 +1,41 @@
+from typing import Optional
+
 import torch
 from torch import nn
+from torch.nn import functional as F
+
+from .pytorch_inference import InferencePrecisionMixin
+
+
+class LowRankBilinear(nn.Module):
+    """Bilinear form in which the weight matrix of output o is factorized
+    as U^T diag(w_o) V, where U and V have `rank` rows and are shared by
+    all outputs. With `diagonal`, a diagonal matrix diag(d_o) is added to
+    the weight matrix of each output.
+
+    The full form (nn.Bilinear) takes nO * in_features ** 2 multiply-adds
+    per pair, the factorized form rank * (2 * in_features + nO), plus
+    nO * in_features for the diagonal."""
+
+    def __init__(self, in_features: int, out_features: int, rank: int, *, diagonal: bool = False):
+        super(LowRankBilinear, self).__init__()
 
+        self.head_factor = nn.Linear(in_features, rank, bias=False)
+        self.dependent_factor = nn.Linear(in_features, rank, bias=False)
+        self.weight = nn.Parameter(torch.empty(out_features, rank))
+        self.diagonal = nn.Parameter(torch.zeros(out_features, in_features)) if diagonal else None
+        self.bias = nn.Parameter(torch.zeros(out_features))
 
-class BilinearModel(nn.Module):
+        torch.nn.init.xavier_uniform_(self.weight)
+
+    def forward(self, x1: torch.Tensor, x2: torch.Tensor) -> torch.Tensor:
+        logits = F.linear(self.head_factor(x1) * self.dependent_factor(x2), self.weight, self.bias)
+        if self.diagonal is not None:
+            logits = logits + F.linear(x1 * x2, self.diagonal)
+        return logits
+
+
+class BilinearModel(InferencePrecisionMixin, nn.Module):
     def __init__(
         self,
         nI: int,
@@ -11,18 +44,29 @@ class BilinearModel(nn.Module):
         activation: torch.nn.Module = nn.ReLU(),
         dropout: float = 0.1,
         hidden_width: int = 128,
+        inference_precision: str = "fp32",
+        rank: Optional[int] = None,
+        diagonal: bool = False,
     ):
         super(BilinearModel, self).__init__()
 
         self.head = nn.Linear(nI, hidden_width)
         self.dependent = nn.Linear(nI, hidden_width)
-        self.bilinear = nn.Bilinear(hidden_width, hidden_width, nO)
+        self.bilinear: nn.Module
+        if rank is None:
+            if diagonal:
+                raise ValueError("A diagonal can only be added to a low-rank bilinear form")
+            self.bilinear = nn.Bilinear(hidden_width, hidden_width, nO)
+            # Default BiLinear initialization creates parameters that are
+            # much too large, resulting in large regression.
+            torch.nn.init.xavier_uniform_(self.bilinear.weight)
+        else:
+            if rank < 1:
+                raise ValueError(f"The rank of the bilinear form should be at least 1, got {rank}")
+            self.bilinear = LowRankBilinear(hidden_width, nO, rank, diagonal=diagonal)
         self.activation = activation
         self._dropout = nn.Dropout(dropout)
-
-        # Default BiLinear initialization creates parameters that are
-        # much too large, resulting in large regression.
-        torch.nn.init.xavier_uniform_(self.bilinear.weight)
+        self.inference_precision = inference_precision
 
     @property
     def dropout(self) -> float:
@@ -34,8 +78,9 @@ class BilinearModel(nn.Module):
 
     def forward(self, x: torch.Tensor, heads: torch.Tensor):
         # Create representations of tokens as heads and dependents.
-        head = self._dropout(self.activation(self.head(x[heads.long()])))
-        dependent = self._dropout(self.activation(self.dependent(x)))
+        head, dependent = self.project(x[heads.long()], x)
+        head = self._dropout(self.activation(head))
+        dependent = self._dropout(self.activation(dependent))
 
         logits = self.bilinear(head, dependent)
 
@@ -0,0 +1,78 @@
+import copy
+from typing import Any, Dict, Tuple
+
+import torch
+from torch import nn
+
+INFERENCE_PRECISIONS = ("fp32", "bf16", "int8")
+
+
+class InferencePrecisionMixin:
+    """Reduced-precision inference for the `head` and `dependent`
+    projections of a model. Training always uses fp32.
+
+    - "bf16": the projections run under bf16 autocast.
+    - "int8": the projections use int8 dynamic quantization (CPU only).
+      The quantized copies are made on the first prediction after the
+      parameters were changed, e.g. by loading or training the model.
+
+    The (pairwise) bilinear layer is always computed in fp32, since its
+    outputs are sums over many products and errors accumulate."""
+
+    head: nn.Linear
+    dependent: nn.Linear
+    training: bool
+
+    @property
+    def inference_precision(self) -> str:
+        return self._inference_precision
+
+    @inference_precision.setter
+    def inference_precision(self, precision: str):
+        if precision not in INFERENCE_PRECISIONS:
+            raise ValueError(
+                f"Unknown inference precision '{precision}', expected one of: {', '.join(INFERENCE_PRECISIONS)}"
+            )
+        self._inference_precision = precision
+        self._inference_cache: Dict[Any, Any] = {}
+        self._inference_cache_key: Tuple[Tuple[int, int], ...] = ()
+
+    def inference_cache(self) -> Dict[Any, Any]:
+        """Cache for copies of the model that are made for inference, such
+        as quantized projections. The cache is emptied when the parameters
+        were replaced or modified in-place since the copies were made.
+
+        The cache is a plain dict, so that the copies are not registered as
+        submodules and do not end up in the state dict."""
+        key = tuple((param.data_ptr(), param._version) for param in self.parameters())  # type: ignore
+        if key != self._inference_cache_key:
+            self._inference_cache = {}
+            self._inference_cache_key = key
+        return self._inference_cache
+
+    def project(
+        self, x_head: torch.Tensor, x_dependent: torch.Tensor
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Compute the head and dependent projections, in the inference
+        precision when the model is not training."""
+        if self.training or self._inference_precision == "fp32":
+            return self.head(x_head), self.dependent(x_dependent)
+
+        if self._inference_precision == "bf16":
+            with torch.autocast(x_head.device.type, dtype=torch.bfloat16):
+                head = self.head(x_head)
+                dependent = self.dependent(x_dependent)
+            return head.float(), dependent.float()
+
+        if x_head.device.type != "cpu":
+            raise ValueError("int8 inference is only supported on CPU")
+        cache = self.inference_cache()
+        if "int8" not in cache:
+            cache["int8"] = tuple(
+                torch.ao.quantization.quantize_dynamic(
+                    nn.Sequential(copy.deepcopy(linear)), {nn.Linear}, dtype=torch.qint8
+                )
+                for linear in (self.head, self.dependent)
+            )
+        head, dependent = cache["int8"]
+        return head(x_head), dependent(x_dependent)
@@ -1,7 +1,13 @@
+import bisect
+import warnings
+from typing import Iterable, Optional, Tuple
+
 import torch
 from torch import nn
 from torch.nn import functional as F
 
+from .pytorch_inference import InferencePrecisionMixin
+
 
 class VariationalDropout(nn.Module):
     """Variational dropout (Gal and Ghahramani, 2016)"""
@@ -11,13 +17,15 @@ class VariationalDropout(nn.Module):
         self.p = p
 
     def forward(self, x: torch.Tensor):
-        if not self.training:
+        if not self.training or self.p == 0.0:
             return x
 
+        # The mask is sampled on the device and in the dtype of the input.
         batch_size, _, repr_size = x.shape
-        dropout_mask = F.dropout(
-            torch.ones((batch_size, 1, repr_size)), self.p, self.training
-        )
+        keep = 1.0 - self.p
+        dropout_mask = x.new_empty((batch_size, 1, repr_size)).bernoulli_(keep)
+        if keep > 0.0:
+            dropout_mask.div_(keep)
 
         return x * dropout_mask
 
@@ -45,33 +53,146 @@ class PairwiseBilinear(nn.Module):
     def reset_parameters(self):
         nn.init.xavier_uniform_(self.weight)
 
-    def forward(self, u: torch.Tensor, v: torch.Tensor):
+    def forward(
+        self, u: torch.Tensor, v: torch.Tensor, mask: Optional[torch.Tensor] = None
+    ):
+        """Compute the pairwise scores [batch_size, seq_len (v), seq_len (u),
+        out_features]. The optional mask [batch_size, seq_len] is added to
+        the scores of each time step of u."""
         assert u.shape == v.shape, "Inputs to PairwiseBilinear must have the same shape"
         assert len(u.shape) == 3, "Inputs to PairwiseBilinear must have a 3d shape"
 
-        batch_size, seq_len, _ = u.shape
-
-        ones = torch.ones((batch_size, seq_len, 1), dtype=u.dtype)
-
-        if self.bias_u:
-            u = torch.cat([u, ones], -1)
-
-        if self.bias_v:
-            v = torch.cat([v, ones], -1)
-
         # Ideally we'd want to compute:
         #
         # torch.einsum("blu,ouv,bmv->bmlo", u, self.weight, v)
         #
+        # with a column of ones appended to u and v for the biases.
         # Although this works correctly for prediction, this seems to
-        # lead to extreme gradients. Maybe this is an upstream bug?
-        # So, we will do this in two steps.
-
-        intermediate = torch.einsum("blu,ouv->blov", u, self.weight)
-        return torch.einsum("bmv,blov->bmlo", v, intermediate)
-
-
-class PairwiseBilinearModel(nn.Module):
+        # lead to extreme gradients. Maybe this is an upstream bug? So,
+        # we compute the scores and their gradients ourselves.
+        if not torch.is_grad_enabled():
+            # Avoid the overhead of the autograd function in prediction.
+            return pairwise_bilinear_scores(u, v, self.weight, self.bias_u, self.bias_v, mask)[0]
+        return PairwiseBilinearFunction.apply(u, v, self.weight, self.bias_u, self.bias_v, mask)
+
+
+class PairwiseBilinearFunction(torch.autograd.Function):
+    """Pairwise bilinear scores of the shape [batch_size, seq_len (v),
+    seq_len (u), out_features].
+
+    The scores are computed with batched matrix multiplications. Rather
+    than appending a column of ones to u and v, the bilinear form is split
+    into the core bilinear term, the u and v bias terms and a constant
+    term. So, the only intermediate that is allocated besides the scores
+    is u multiplied by the core weights, [batch_size, out_features,
+    seq_len, in_features], which is reused in the backward pass."""
+
+    @staticmethod
+    def forward(ctx, u: torch.Tensor, v: torch.Tensor, weight: torch.Tensor, bias_u: bool, bias_v: bool, mask: Optional[torch.Tensor]):  # type: ignore
+        ctx.bias_u = bias_u
+        ctx.bias_v = bias_v
+        scores, uW = pairwise_bilinear_scores(u, v, weight, bias_u, bias_v, mask)
+        ctx.save_for_backward(u, v, weight, uW)
+        # The scores are a permuted view and autograd does not allow
+        # in-place changes to views that are returned by custom functions.
+        # Detach them, so that callers outside the model can still modify
+        # the scores in-place. This is safe, since the backward pass does
+        # not use the scores.
+        return scores.detach()
+
+    @staticmethod
+    def backward(ctx, d_scores: torch.Tensor):  # type: ignore
+        u, v, weight, uW = ctx.saved_tensors
+        batch_size, seq_len, hidden_width = u.shape
+        core = weight[:, :hidden_width, :hidden_width]
+
+        # With mixed precision, the inputs can have a lower precision than
+        # the weights.
+        dtype = weight.dtype
+        u_flat = u.to(dtype).reshape(-1, hidden_width)
+        # [batch_size, out_features, seq_len (v), seq_len (u)]
+        d_scores = d_scores.to(dtype).permute(0, 3, 1, 2)
+
+        # d_scores_v[b, o, l, j] = sum_m d_scores[b, o, m, l] v[b, m, j]
+        d_scores_v = torch.matmul(d_scores.transpose(-1, -2), v.to(dtype).unsqueeze(1))
+        # [batch_size * seq_len (u), out_features * in_features]
+        d_scores_v_flat = d_scores_v.transpose(1, 2).reshape(batch_size * seq_len, -1)
+
+        du = dv = d_weight = None
+        if ctx.needs_input_grad[0]:
+            du = torch.matmul(d_scores_v_flat, core.transpose(1, 2).reshape(-1, hidden_width))
+            du = du.view(u.shape)
+            if ctx.bias_v:
+                du += torch.matmul(d_scores.sum(2).transpose(1, 2), weight[:, :hidden_width, hidden_width])
+            du = du.to(u.dtype)
+        if ctx.needs_input_grad[1]:
+            dv = torch.matmul(d_scores, uW.to(dtype)).sum(1)
+            if ctx.bias_u:
+                dv += torch.matmul(d_scores.sum(3).transpose(1, 2), weight[:, hidden_width, :hidden_width])
+            dv = dv.to(v.dtype)
+        if ctx.needs_input_grad[2]:
+            d_weight = torch.zeros_like(weight)
+            n_out = weight.shape[0]
+            d_weight[:, :hidden_width, :hidden_width] = (
+                torch.matmul(u_flat.t(), d_scores_v_flat)
+                .view(hidden_width, n_out, hidden_width)
+                .transpose(0, 1)
+            )
+            if ctx.bias_v:
+                d_scores_sum_v = d_scores.sum(2).transpose(1, 2).reshape(-1, n_out)
+                d_weight[:, :hidden_width, hidden_width] = torch.matmul(u_flat.t(), d_scores_sum_v).t()
+            if ctx.bias_u:
+                d_weight[:, hidden_width, :hidden_width] = d_scores_v.sum((0, 2))
+            if ctx.bias_u and ctx.bias_v:
+                d_weight[:, hidden_width, hidden_width] = d_scores.sum((0, 2, 3))
+
+        return du, dv, d_weight, None, None, None
+
+
+def pairwise_bilinear_scores(
+    u: torch.Tensor,
+    v: torch.Tensor,
+    weight: torch.Tensor,
+    bias_u: bool,
+    bias_v: bool,
+    mask: Optional[torch.Tensor] = None,
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """Compute the scores of PairwiseBilinearFunction. Also returns the
+    intermediate product of u and the core weights."""
+    batch_size, seq_len, hidden_width = u.shape
+    n_out = weight.shape[0]
+    core = weight[:, :hidden_width, :hidden_width]
+
+    # uW[b, o, l, j] = sum_i u[b, l, i] core[o, i, j], computed as one
+    # matrix multiplication over all time steps.
+    uW = torch.matmul(
+        u.reshape(-1, hidden_width), core.transpose(0, 1).reshape(hidden_width, -1)
+    )
+    uW = uW.view(batch_size, seq_len, n_out, hidden_width).transpose(1, 2)
+    # scores[b, o, m, l] = sum_j v[b, m, j] uW[b, o, l, j]
+    scores = torch.matmul(v.unsqueeze(1), uW.transpose(-1, -2))
+
+    if bias_u:
+        # scores[b, o, m, :] += sum_j weight[o, -1, j] v[b, m, j]
+        scores += torch.matmul(v, weight[:, hidden_width, :hidden_width].t()).transpose(1, 2).unsqueeze(-1)
+    # scores[b, o, :, l] += sum_i u[b, l, i] weight[o, i, -1] + mask[b, l]
+    # The mask is added together with the bias of v, so that the scores
+    # are only updated once.
+    u_terms = None
+    if bias_v:
+        u_terms = torch.matmul(u, weight[:, :hidden_width, hidden_width].t()).transpose(1, 2)
+    if mask is not None:
+        mask = mask.to(scores.dtype).unsqueeze(1)
+        u_terms = mask if u_terms is None else u_terms + mask
+    if u_terms is not None:
+        scores += u_terms.unsqueeze(2)
+    if bias_u and bias_v:
+        scores += weight[:, hidden_width, hidden_width].view(1, n_out, 1, 1)
+
+    return scores.permute(0, 2, 3, 1), uW
+
+
+class PairwiseBilinearModel(InferencePrecisionMixin, nn.Module):
     def __init__(
         self,
         nI: int,
@@ -80,6 +201,8 @@ class PairwiseBilinearModel(nn.Module):
         activation: torch.nn.Module = nn.ReLU(),
         dropout: float = 0.1,
         hidden_width: int = 128,
+        inference_precision: str = "fp32",
+        inference_buckets: Optional[Iterable[int]] = None,
     ):
         super(PairwiseBilinearModel, self).__init__()
 
@@ -88,6 +211,8 @@ class PairwiseBilinearModel(nn.Module):
         self.bilinear = PairwiseBilinear(hidden_width, nO)
         self.activation = activation
         self._dropout = VariationalDropout(dropout)
+        self.inference_precision = inference_precision
+        self.inference_buckets = inference_buckets
 
     @property
     def dropout(self) -> float:
@@ -97,26 +222,103 @@ class PairwiseBilinearModel(nn.Module):
     def dropout(self, p: float):
         self._dropout.p = p
 
+    @property
+    def inference_buckets(self) -> Tuple[int, ...]:
+        """Padded lengths for which a traced scorer is used in prediction.
+        Batches are padded to the smallest bucket that fits them, batches
+        that are longer than the largest bucket are scored eagerly. The
+        int8 projections cannot be traced, so int8 inference is always
+        eager."""
+        return self._inference_buckets
+
+    @inference_buckets.setter
+    def inference_buckets(self, buckets: Optional[Iterable[int]]):
+        buckets = tuple(sorted(set(buckets or ())))
+        if buckets and buckets[0] < 1:
+            raise ValueError(f"Inference buckets must be positive, was: {buckets[0]}")
+        self._inference_buckets = buckets
+
+    def warm_up(self, batch_size: int = 1):
+        """Trace the scorer for all inference buckets, so that the first
+        predictions do not pay for tracing."""
+        # The scorer is traced in evaluation mode, so that dropout is not
+        # part of the trace.
+        training = self.training
+        self.eval()
+        try:
+            if not self._use_traced_scorer():
+                return
+            param = self.head.weight
+            for bucket in self._inference_buckets:
+                x = torch.zeros(
+                    (batch_size, bucket, self.head.in_features),
+                    dtype=param.dtype,
+                    device=param.device,
+                )
+                seq_lens = torch.full((batch_size,), bucket, dtype=torch.int32)
+                self._traced_scorer(x, seq_lens)
+        finally:
+            self.train(training)
+
     def forward(self, x: torch.Tensor, seq_lens: torch.Tensor):
+        if not self._use_traced_scorer():
+            return self.score(x, seq_lens)
+
+        seq_len = x.shape[1]
+        idx = bisect.bisect_left(self._inference_buckets, seq_len)
+        if idx == len(self._inference_buckets):
+            return self.score(x, seq_lens)
+
+        # Pad the time steps to the bucket length. The padding is masked
+        # in the scores like any other padding.
+        bucket = self._inference_buckets[idx]
+        x = F.pad(x, (0, 0, 0, bucket - seq_len))
+        logits = self._traced_scorer(x, seq_lens)(x, seq_lens)
+
+        return logits[:, :seq_len, :seq_len]
+
+    def _use_traced_scorer(self) -> bool:
+        return (
+            not self.training
+            and bool(self._inference_buckets)
+            and self._inference_precision != "int8"
+        )
+
+    def _traced_scorer(self, x: torch.Tensor, seq_lens: torch.Tensor):
+        # The traced scorer is specialized for the padded length and the
+        # inference precision, but not for the batch size. It shares the
+        # parameters with the model.
+        cache = self.inference_cache()
+        key = ("traced", self._inference_precision, x.shape[1])
+        traced = cache.get(key)
+        if traced is None:
+            with torch.no_grad(), warnings.catch_warnings():
+                warnings.simplefilter("ignore", torch.jit.TracerWarning)
+                traced = torch.jit.trace_module(
+                    self, {"score": (x, seq_lens)}, check_trace=False
+                ).score
+            cache[key] = traced
+        return traced
+
+    def score(self, x: torch.Tensor, seq_lens: torch.Tensor):
         max_seq_len = x.shape[1]
 
-        token_mask = torch.arange(max_seq_len).unsqueeze(0) < seq_lens.unsqueeze(1)
-        logits_mask = (token_mask.float() - 1.0) * 10000.0
-        logits_mask = logits_mask.unsqueeze(1).unsqueeze(-1)
+        # Mask out head candidates that are padding time steps. The mask is
+        # created on the device of the input and is added to the scores by
+        # the pairwise bilinear layer.
+        positions = torch.arange(max_seq_len, device=x.device)
+        padding = positions.unsqueeze(0) >= seq_lens.to(x.device).unsqueeze(1)
+        logits_mask = x.new_zeros(padding.shape).masked_fill_(padding, -10000.0)
 
         # Create representations of tokens as heads and dependents.
-        head = self._dropout(self.activation(self.head(x)))
-        dependent = self._dropout(self.activation(self.dependent(x)))
+        head, dependent = self.project(x, x)
+        head = self._dropout(self.activation(head))
+        dependent = self._dropout(self.activation(dependent))
 
         # Compute biaffine attention matrix. This computes from the hidden
         # representations of the shape [batch_size, seq_len, hidden_width] the
         # attention matrices [batch_size, seq_len, seq_len, n_O].
-        logits = self.bilinear(head, dependent)
-
-        # Mask out head candidates that are padding time steps. The logits mask
-        # has shape [batch_size, seq_len], we reshape it to [batch_size, 1,
-        # seq_len] to mask out the head predictions.
-        logits += logits_mask
+        logits = self.bilinear(head, dependent, logits_mask)
 
         # If there is only one output feature, remove the last dimension.
         logits = logits.squeeze(-1)
@@ -0,0 +1,56 @@
+import gc
+
+from spacy.lang.en import English
+from spacy.tokens import Doc
+from spacy.training import Example
+
+from spacy_biaffine_parser import alignment
+from spacy_biaffine_parser.alignment import get_aligned_parse
+
+GOLD = {
+    "words": ["Ea", "t", "blue", "ham"],
+    "heads": [0, 0, 3, 0],
+    "deps": ["ROOT", "", "amod", "dobj"],
+}
+
+
+def test_get_aligned_parse():
+    nlp = English()
+    example = Example.from_dict(nlp.make_doc("Eat blue ham"), GOLD)
+    heads, labels = get_aligned_parse(example)
+
+    expected_heads, expected_labels = example.get_aligned_parse(projectivize=False)
+    assert expected_heads == [None, 2, 0]
+    assert heads.tolist() == [-1, 2, 0]
+    assert labels[0] == 0
+    assert [nlp.vocab.strings[int(label)] for label in labels[1:]] == expected_labels[1:]
+
+
+def test_get_aligned_parse_cache():
+    nlp = English()
+    example = Example.from_dict(nlp.make_doc("Eat blue ham"), GOLD)
+    heads, labels = get_aligned_parse(example)
+    assert not heads.flags.writeable
+    cached_heads, cached_labels = get_aligned_parse(example)
+    assert cached_heads is heads
+    assert cached_labels is labels
+
+    # Annotating the predicted doc does not change the alignment.
+    example.predicted[0].head = example.predicted[2]
+    assert get_aligned_parse(example)[0] is heads
+
+    # Changing the tokenization invalidates the cache entry.
+    example.predicted = Doc(nlp.vocab, words=["Ea", "t", "blue", "ham"])
+    heads, _ = get_aligned_parse(example)
+    assert heads.tolist() == [0, 1, 3, 0]
+
+    # Changing the reference parse invalidates the cache entry.
+    example.reference[2].head = example.reference[0]
+    heads, _ = get_aligned_parse(example)
+    assert heads.tolist() == [0, 1, 0, 0]
+
+    # Entries are evicted with the reference doc.
+    n_cached = len(alignment._aligned_parse_cache)
+    del example
+    gc.collect()
+    assert len(alignment._aligned_parse_cache) == n_cached - 1
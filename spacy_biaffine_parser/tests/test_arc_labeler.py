@@ -2,7 +2,9 @@ import pytest
 from spacy import util
 from spacy.lang.en import English
 from spacy.language import Language
+from spacy.tokens import Doc
 from spacy.training import Example
+from thinc.api import NumpyOps
 
 from spacy_biaffine_parser import arc_labeler, arc_predicter
 from spacy_biaffine_parser import bilinear, pairwise_bilinear
@@ -151,3 +153,27 @@ def test_overfitting_IO():
     assert doc3[2].dep_ == "amod"
     assert doc3[3].head == doc3[1]
     assert doc3[3].dep_ == "dobj"
+
+
+def test_root_label_only_for_roots():
+    nlp = English.from_config()
+    nlp.add_pipe("sentencizer")
+    nlp.add_pipe("arc_predicter", config={"max_sentence_length": 4})
+    nlp.add_pipe("arc_labeler")
+    train_examples = []
+    for t in TRAIN_DATA:
+        train_examples.append(Example.from_dict(nlp.make_doc(t[0]), t[1]))
+    nlp.initialize(get_examples=lambda: train_examples)
+
+    # Windowed parsing of the long sentence.
+    doc = nlp("She likes green eggs and blue ham and red eggs")
+    for token in doc:
+        assert (token.dep_ == "ROOT") == (token.head == token)
+
+
+def test_heads_predicted():
+    nlp = English.from_config()
+    doc1 = Doc(nlp.vocab, words=["She", "likes", "eggs"], heads=[1, 1, 1], deps=["nsubj", "ROOT", "dobj"])
+    doc2 = Doc(nlp.vocab, words=["Eat", "ham"], heads=[0, 0], deps=["ROOT", "dobj"])
+    heads = arc_labeler.heads_predicted([doc1, doc2], NumpyOps())
+    assert heads.tolist() == [1, 1, 1, 3, 3]
@@ -1,10 +1,13 @@
+import numpy as np
 import pytest
 from spacy import util
 from spacy.lang.en import English
 from spacy.language import Language
 from spacy.training import Example
+from thinc.api import NumpyOps
 
 from spacy_biaffine_parser import pairwise_bilinear, arc_predicter
+from spacy_biaffine_parser.mst import mst_decode_batch, mst_decode_sparse_batch
 
 TRAIN_DATA = [
     (
@@ -132,3 +135,395 @@ def test_overfitting_IO():
     assert doc3[1].head == doc3[1]
     assert doc3[2].head == doc3[3]
     assert doc3[3].head == doc3[1]
+
+
+@pytest.mark.parametrize("decoder", ["mst", "eisner", "greedy"])
+def test_decoders(decoder):
+    util.fix_random_seed(0)
+    nlp = English.from_config()
+    nlp.add_pipe("sentencizer")
+    nlp.add_pipe("arc_predicter", config={"decoder": decoder})
+    train_examples = []
+    for t in TRAIN_DATA:
+        train_examples.append(Example.from_dict(nlp.make_doc(t[0]), t[1]))
+
+    optimizer = nlp.initialize(get_examples=lambda: train_examples)
+
+    for i in range(150):
+        losses = {}
+        nlp.update(train_examples, sgd=optimizer, losses=losses, annotates=["sentencizer"])
+
+    doc = nlp("She likes blue eggs")
+    assert doc[0].head == doc[1]
+    assert doc[1].head == doc[1]
+    assert doc[2].head == doc[3]
+    assert doc[3].head == doc[1]
+
+
+def test_unknown_decoder():
+    nlp = English.from_config()
+    with pytest.raises(ValueError, match=r"Unknown decoder"):
+        nlp.add_pipe("arc_predicter", config={"decoder": "cky"})
+
+
+def test_head_candidates():
+    util.fix_random_seed(0)
+    nlp = English.from_config()
+    nlp.add_pipe("sentencizer")
+    nlp.add_pipe("arc_predicter", config={"head_candidates": 1})
+    train_examples = []
+    for t in TRAIN_DATA:
+        train_examples.append(Example.from_dict(nlp.make_doc(t[0]), t[1]))
+
+    optimizer = nlp.initialize(get_examples=lambda: train_examples)
+
+    for i in range(150):
+        losses = {}
+        nlp.update(train_examples, sgd=optimizer, losses=losses, annotates=["sentencizer"])
+    assert losses["arc_predicter"] < 0.00001
+
+    doc = nlp("She likes blue eggs")
+    assert doc[0].head == doc[1]
+    assert doc[1].head == doc[1]
+    assert doc[2].head == doc[3]
+    assert doc[3].head == doc[1]
+
+    with pytest.raises(ValueError, match=r"only supported by the 'mst' decoder"):
+        nlp.add_pipe(
+            "arc_predicter",
+            name="eisner",
+            config={"decoder": "eisner", "head_candidates": 4},
+        )
+
+
+def test_prune_heads():
+    scores = np.array(
+        [
+            [0.0, 3.0, 2.0, -1.0],
+            [1.0, 5.0, 4.0, -1.0],
+            [2.0, 1.0, 0.0, -1.0],
+            [7.0, 0.0, 0.0, 0.0],
+        ],
+        dtype=np.float32,
+    )
+    candidates, candidate_scores = arc_predicter.prune_heads(
+        NumpyOps(), scores, np.array([3, 1]), 1
+    )
+    assert candidates.tolist() == [[1, 0], [2, 1], [0, 2], [-1, 0]]
+    assert candidate_scores[:3].tolist() == [[3.0, 0.0], [4.0, 5.0], [2.0, 0.0]]
+
+    # Ragged scores give the same candidates.
+    ragged = scores[pairwise_bilinear.ragged_score_mask(np.array([3, 1]), 4)]
+    ragged_candidates, ragged_candidate_scores = arc_predicter.prune_heads(
+        NumpyOps(), ragged, np.array([3, 1]), 1
+    )
+    assert ragged_candidates.tolist() == candidates.tolist()
+    assert ragged_candidate_scores[:3].tolist() == candidate_scores[:3].tolist()
+
+    # Sentences shorter than the number of candidates.
+    candidates, _ = arc_predicter.prune_heads(NumpyOps(), scores, np.array([3, 1]), 8)
+    assert candidates.tolist() == [
+        [-1, 1, 2, -1, 0],
+        [0, -1, 2, -1, 1],
+        [0, 1, -1, -1, 2],
+        [-1, -1, -1, -1, 0],
+    ]
+
+
+def test_pruned_candidates_contain_tree():
+    # The best heads form a cycle through each sentence, but the root
+    # candidates still give a spanning tree.
+    lens = np.array([5, 1, 8, 2], dtype=np.int32)
+    rng = np.random.default_rng(0)
+    scores = np.full((lens.sum(), lens.max()), -10000.0, dtype=np.float32)
+    offset = 0
+    for length in lens:
+        scores[offset : offset + length, :length] = rng.random((length, length))
+        scores[offset + np.arange(length), (np.arange(length) + 1) % length] += 10.0
+        offset += length
+    candidates, candidate_scores = arc_predicter.prune_heads(NumpyOps(), scores, lens, 1)
+    heads, has_tree = mst_decode_sparse_batch(candidates, candidate_scores, lens)
+    assert has_tree.all()
+    assert heads.tolist() == mst_decode_batch(scores[:, : lens.max()], lens).tolist()
+
+
+@pytest.mark.parametrize("decode_workers", [0, 2])
+@pytest.mark.parametrize("decode_queue_depth", [1, 3])
+def test_pipe_matches_predict(decode_workers, decode_queue_depth):
+    nlp = English.from_config()
+    nlp.add_pipe("sentencizer")
+    arc_predicter = nlp.add_pipe("arc_predicter")
+    train_examples = []
+    for t in TRAIN_DATA:
+        train_examples.append(Example.from_dict(nlp.make_doc(t[0]), t[1]))
+    nlp.initialize(get_examples=lambda: train_examples)
+
+    # Documents that mix short and long sentences.
+    texts = [
+        " ".join(["word"] * (i % 7 + 1))
+        + ". "
+        + " ".join(["other"] * (i % 5 + 2))
+        + (". " + " ".join(["long"] * 40) if i % 9 == 0 else "")
+        for i in range(40)
+    ]
+
+    expected = []
+    for text in texts:
+        doc = nlp.get_pipe("sentencizer")(nlp.make_doc(text))
+        arc_predicter.set_annotations([doc], arc_predicter.predict([doc]))
+        expected.append([token.head.i for token in doc])
+
+    # Empty documents are skipped by pipe.
+    texts.insert(5, "")
+    expected.insert(5, [])
+
+    arc_predicter.decode_workers = decode_workers
+    arc_predicter.decode_queue_depth = decode_queue_depth
+    docs = list(nlp.pipe(texts, batch_size=8))
+    assert [doc.text for doc in docs] == texts
+    assert [[token.head.i for token in doc] for doc in docs] == expected
+
+
+def test_invalid_decode_workers():
+    nlp = English.from_config()
+    with pytest.raises(ValueError, match=r"decode workers should not be negative"):
+        nlp.add_pipe("arc_predicter", config={"decode_workers": -1})
+    with pytest.raises(ValueError, match=r"queue depth should be at least 1"):
+        nlp.add_pipe("arc_predicter", config={"decode_queue_depth": 0})
+
+
+def test_length_buckets():
+    lens = np.array([3, 10, 2, 4, 3, 1])
+    buckets = arc_predicter.length_buckets(lens, 4)
+    assert [bucket.tolist() for bucket in buckets] == [[5, 2, 0, 4], [3, 1]]
+
+    # At most 30 score cells: [1, 2, 3] needs 3 * 3 ** 2 = 27 cells. The
+    # sentence of length 10 exceeds the budget by itself.
+    buckets = arc_predicter.length_buckets(lens, 4, 30)
+    assert [bucket.tolist() for bucket in buckets] == [[5, 2, 0], [4], [3], [1]]
+    for bucket in buckets[:-1]:
+        assert len(bucket) * lens[bucket].max() ** 2 <= 30
+
+
+def test_max_score_cells():
+    nlp = English.from_config()
+    nlp.add_pipe("sentencizer")
+    arc_predicter = nlp.add_pipe("arc_predicter", config={"max_score_cells": 200})
+    train_examples = []
+    for t in TRAIN_DATA:
+        train_examples.append(Example.from_dict(nlp.make_doc(t[0]), t[1]))
+    nlp.initialize(get_examples=lambda: train_examples)
+
+    texts = ["Short one. " + " ".join(["long"] * 30), "Eat blue ham. She likes eggs."]
+    expected = []
+    for text in texts:
+        doc = nlp.get_pipe("sentencizer")(nlp.make_doc(text))
+        arc_predicter.set_annotations([doc], arc_predicter.predict([doc]))
+        expected.append([token.head.i for token in doc])
+
+    docs = list(nlp.pipe(texts))
+    assert [[token.head.i for token in doc] for doc in docs] == expected
+
+    with pytest.raises(ValueError, match=r"score cells should be at least 1"):
+        nlp.add_pipe("arc_predicter", name="invalid", config={"max_score_cells": 0})
+
+
+def is_acyclic(heads):
+    for i in range(len(heads)):
+        visited = set()
+        while heads[i] != i:
+            if i in visited:
+                return False
+            visited.add(i)
+            i = heads[i]
+    return True
+
+
+def test_window_starts():
+    assert arc_predicter.window_starts(5, 8) == [0]
+    assert arc_predicter.window_starts(8, 8) == [0]
+    assert arc_predicter.window_starts(20, 8) == [0, 6, 12]
+    assert arc_predicter.window_starts(21, 8) == [0, 4, 9, 13]
+
+    # Small windows still overlap by at least one token.
+    for window_size in range(2, 9):
+        for seq_len in range(window_size + 1, 40):
+            starts = arc_predicter.window_starts(seq_len, window_size)
+            assert starts[0] == 0
+            assert starts[-1] + window_size == seq_len
+            for i in range(len(starts) - 1):
+                assert starts[i] < starts[i + 1] < starts[i] + window_size
+
+
+def test_stitch_windows():
+    # Two windows [0, 4) and [2, 6) that disagree on the heads of the
+    # overlapping tokens 2 and 3. Taking the best head of each token would
+    # form the cycle 2 -> 3 -> 2.
+    window_heads = [np.array([1, 1, 1, 2]), np.array([1, 1, 1, 2])]
+    window_scores = [np.array([1.0, 1.0, 1.0, 5.0]), np.array([5.0, 0.5, 1.0, 1.0])]
+    heads = arc_predicter.stitch_windows(6, [0, 2], window_heads, window_scores)
+    assert heads.tolist() == [1, 1, 1, 2, 3, 4]
+
+
+@pytest.mark.parametrize("decoder", ["mst", "eisner"])
+def test_max_sentence_length(decoder):
+    nlp = English.from_config()
+    nlp.add_pipe("sentencizer")
+    arc_predicter = nlp.add_pipe(
+        "arc_predicter", config={"decoder": decoder, "max_sentence_length": 8}
+    )
+    train_examples = []
+    for t in TRAIN_DATA:
+        train_examples.append(Example.from_dict(nlp.make_doc(t[0]), t[1]))
+    nlp.initialize(get_examples=lambda: train_examples)
+
+    texts = [
+        "Short one. " + " ".join(["long", "word", "list"] * 10),
+        "Eat blue ham. She likes eggs.",
+    ]
+    expected = []
+    for text in texts:
+        doc = nlp.get_pipe("sentencizer")(nlp.make_doc(text))
+        heads = arc_predicter.predict([doc])
+        for sent, sent_heads in zip(doc.sents, heads[0]):
+            assert len(sent_heads) == len(sent)
+            assert is_acyclic(sent_heads)
+        arc_predicter.set_annotations([doc], heads)
+        expected.append([token.head.i for token in doc])
+
+    docs = list(nlp.pipe(texts))
+    assert [[token.head.i for token in doc] for doc in docs] == expected
+
+    with pytest.raises(ValueError, match=r"sentence length should be at least 2"):
+        nlp.add_pipe("arc_predicter", name="invalid", config={"max_sentence_length": 1})
+
+
+def test_get_loss():
+    nlp = English.from_config()
+    sentencizer = nlp.add_pipe("sentencizer")
+    predicter = nlp.add_pipe("arc_predicter")
+    train_examples = []
+    for t in PARTIAL_DATA:
+        train_examples.append(Example.from_dict(sentencizer(nlp.make_doc(t[0])), t[1]))
+    nlp.initialize(get_examples=lambda: train_examples)
+
+    # A head that crosses the predicted sentence boundary.
+    doc = sentencizer(nlp.make_doc("Eat. Blue ham"))
+    train_examples.append(
+        Example.from_dict(doc, {"heads": [0, 0, 3, 0], "deps": ["ROOT", "punct", "amod", "dobj"]})
+    )
+
+    rows, heads = arc_predicter.gold_sent_heads(train_examples)
+    assert rows.tolist() == [0, 1, 2, 3, 5, 6, 7, 8, 9]
+    assert heads.tolist() == [1, 1, 3, 1, 2, 0, 0, 0, 1]
+
+    scores = np.random.default_rng(0).normal(size=(11, 4)).astype(np.float32)
+    target = np.zeros_like(scores)
+    target[rows, heads] = 1.0
+    mask = np.zeros((11, 1), dtype=np.float32)
+    mask[rows] = 1.0
+    loss, d_scores = predicter.get_loss(train_examples, scores)
+    np.testing.assert_allclose(d_scores, (scores - target) * mask, rtol=1e-6)
+    assert loss == pytest.approx((((scores - target) * mask) ** 2).sum(), rel=1e-5)
+
+
+def test_get_loss_ragged():
+    nlp = English.from_config()
+    sentencizer = nlp.add_pipe("sentencizer")
+    predicter = nlp.add_pipe("arc_predicter")
+    train_examples = []
+    for t in PARTIAL_DATA:
+        train_examples.append(Example.from_dict(sentencizer(nlp.make_doc(t[0])), t[1]))
+    nlp.initialize(get_examples=lambda: train_examples)
+
+    lens = np.concatenate([arc_predicter.doc_sent_lens(eg.predicted) for eg in train_examples])
+    mask = pairwise_bilinear.ragged_score_mask(lens, int(lens.max()))
+    scores = np.random.default_rng(0).normal(size=mask.shape).astype(np.float32)
+    scores[~mask] = 0.0
+    loss, d_scores = predicter.get_loss(train_examples, scores)
+    ragged_loss, d_ragged = predicter.get_loss(train_examples, scores[mask])
+    assert d_ragged.shape == (int((lens ** 2).sum()),)
+    np.testing.assert_allclose(d_ragged, d_scores[mask], rtol=1e-6)
+    assert ragged_loss == pytest.approx(loss, rel=1e-5)
+
+
+@pytest.mark.parametrize(
+    "config",
+    [
+        {"decoder": "mst"},
+        {"decoder": "eisner"},
+        {"decoder": "greedy"},
+        {"head_candidates": 2},
+        {"max_sentence_length": 8},
+    ],
+)
+def test_ragged_scores(config):
+    nlp = English.from_config()
+    sentencizer = nlp.add_pipe("sentencizer")
+    predicter = nlp.add_pipe("arc_predicter", config=config)
+    train_examples = []
+    for t in TRAIN_DATA:
+        train_examples.append(Example.from_dict(nlp.make_doc(t[0]), t[1]))
+    nlp.initialize(get_examples=lambda: train_examples)
+
+    texts = ["She likes green eggs. Eat blue ham.", " ".join(["long", "word", "list"] * 10)]
+    docs = [sentencizer(nlp.make_doc(text)) for text in texts]
+    expected = predicter.predict(docs)
+
+    predicter.model.get_ref("pairwise_bilinear").attrs["ragged_scores"] = True
+    heads = predicter.predict(docs)
+    assert [[sent.tolist() for sent in doc] for doc in heads] == [
+        [sent.tolist() for sent in doc] for doc in expected
+    ]
+
+
+def test_set_annotations():
+    nlp = English.from_config()
+    sentencizer = nlp.add_pipe("sentencizer")
+    predicter = nlp.add_pipe("arc_predicter")
+    doc = sentencizer(nlp.make_doc("Eat blue ham. She likes eggs."))
+    heads = [[np.array([0, 2, 0, 0]), np.array([1, 1, 1, 1])]]
+    predicter.set_annotations([doc], heads)
+    assert [token.head.i for token in doc] == [0, 2, 0, 0, 5, 5, 5, 5]
+    assert [token.dep_ for token in doc] == ["ROOT", "dep", "dep", "dep", "dep", "ROOT", "dep", "dep"]
+
+    with pytest.raises(ValueError, match=r"Got 4 heads for a doc of 8 tokens"):
+        predicter.set_annotations([doc], [heads[0][:1]])
+
+
+def test_set_annotations_children():
+    nlp = English.from_config()
+    sentencizer = nlp.add_pipe("sentencizer")
+    predicter = nlp.add_pipe("arc_predicter")
+    doc = sentencizer(nlp.make_doc("a b c d e . f g h"))
+    # The first sentence is non-projective and the root is not the first
+    # token.
+    heads = [[np.array([2, 3, 2, 2, 0, 2]), np.array([1, 1, 1])]]
+    predicter.set_annotations([doc], heads)
+
+    assert [sent.text for sent in doc.sents] == ["a b c d e .", "f g h"]
+    assert [child.i for child in doc[2].children] == [0, 3, 5]
+    assert [child.i for child in doc[3].children] == [1]
+    assert [child.i for child in doc[7].children] == [6, 8]
+    assert [child.i for child in doc[8].children] == []
+    assert sorted(token.i for token in doc[2].subtree) == [0, 1, 2, 3, 4, 5]
+    assert [token.i for token in doc[3].subtree] == [1, 3]
+    assert (doc[0].left_edge.i, doc[0].right_edge.i) == (0, 4)
+    assert [token.n_lefts for token in doc] == [0, 0, 1, 1, 0, 0, 0, 1, 0]
+    assert [token.n_rights for token in doc] == [1, 0, 2, 0, 0, 0, 0, 1, 0]
+
+
+def test_sents2lens():
+    nlp = English.from_config()
+    sentencizer = nlp.add_pipe("sentencizer")
+    docs = [
+        sentencizer(nlp.make_doc(text))
+        for text in ["Eat blue ham. She likes eggs.", "One", "", "No end"]
+    ]
+    for doc in docs:
+        assert arc_predicter.doc_sent_lens(doc).tolist() == [len(sent) for sent in doc.sents]
+    lens = arc_predicter.sents2lens(docs, ops=NumpyOps())
+    assert lens.tolist() == [4, 4, 1, 2]
+
+    with pytest.raises(ValueError, match=r"E030"):
+        arc_predicter.doc_sent_lens(nlp.make_doc("No sentence boundaries"))
@@ -0,0 +1,126 @@
+import pytest
+from spacy import util
+from spacy.lang.en import English
+from spacy.training import Example
+
+from spacy_biaffine_parser import biaffine_parser
+
+TRAIN_DATA = [
+    (
+        "She likes green eggs",
+        {
+            "heads": [1, 1, 3, 1],
+            "deps": ["nsubj", "ROOT", "amod", "dobj"],
+            "sent_starts": [1, 0, 0, 0],
+        },
+    ),
+    (
+        "Eat blue ham",
+        {
+            "heads": [0, 2, 0],
+            "deps": ["ROOT", "amod", "dobj"],
+            "sent_starts": [1, 0, 0],
+        },
+    ),
+]
+
+
+def check_parse(doc):
+    assert doc[0].head == doc[1]
+    assert doc[0].dep_ == "nsubj"
+    assert doc[1].head == doc[1]
+    assert doc[1].dep_ == "ROOT"
+    assert doc[2].head == doc[3]
+    assert doc[2].dep_ == "amod"
+    assert doc[3].head == doc[1]
+    assert doc[3].dep_ == "dobj"
+
+
+def test_overfitting_IO():
+    util.fix_random_seed(0)
+    nlp = English.from_config()
+    nlp.add_pipe("sentencizer")
+    nlp.add_pipe("biaffine_parser")
+    train_examples = []
+    for t in TRAIN_DATA:
+        train_examples.append(Example.from_dict(nlp.make_doc(t[0]), t[1]))
+
+    optimizer = nlp.initialize(get_examples=lambda: train_examples)
+    assert nlp.get_pipe("biaffine_parser").labels == ("ROOT", "amod", "dobj", "nsubj")
+
+    for i in range(150):
+        losses = {}
+        nlp.update(train_examples, sgd=optimizer, losses=losses, annotates=["sentencizer"])
+    assert losses["biaffine_parser"] < 0.0001
+
+    test_text = "She likes blue eggs"
+    doc = nlp(test_text)
+    check_parse(doc)
+    assert [token.i for token in doc[1].children] == [0, 3]
+
+    # Check model after a {to,from}_disk roundtrip
+    with util.make_tempdir() as tmp_dir:
+        nlp.to_disk(tmp_dir)
+        nlp2 = util.load_model_from_path(tmp_dir)
+        check_parse(nlp2(test_text))
+
+    # Check model after a {to,from}_bytes roundtrip
+    nlp_bytes = nlp.to_bytes()
+    nlp3 = English()
+    nlp3.add_pipe("sentencizer")
+    nlp3.add_pipe("biaffine_parser")
+    nlp3.from_bytes(nlp_bytes)
+    check_parse(nlp3(test_text))
+
+
+@pytest.mark.parametrize("decode_workers", [0, 2])
+def test_pipe_matches_predict(decode_workers):
+    nlp = English.from_config()
+    nlp.add_pipe("sentencizer")
+    parser = nlp.add_pipe(
+        "biaffine_parser", config={"decode_workers": decode_workers, "max_sentence_length": 16}
+    )
+    train_examples = []
+    for t in TRAIN_DATA:
+        train_examples.append(Example.from_dict(nlp.make_doc(t[0]), t[1]))
+    nlp.initialize(get_examples=lambda: train_examples)
+
+    texts = [
+        " ".join(["word"] * (i % 7 + 1))
+        + ". "
+        + " ".join(["other"] * (i % 5 + 2))
+        + (". " + " ".join(["long"] * 40) if i % 9 == 0 else "")
+        for i in range(20)
+    ]
+
+    expected = []
+    for text in texts:
+        doc = nlp.get_pipe("sentencizer")(nlp.make_doc(text))
+        parser.set_annotations([doc], parser.predict([doc]))
+        expected.append([(token.head.i, token.dep_) for token in doc])
+    texts.insert(3, "")
+    expected.insert(3, [])
+
+    docs = list(nlp.pipe(texts, batch_size=8))
+    assert [[(token.head.i, token.dep_) for token in doc] for doc in docs] == expected
+    for doc in docs:
+        for token in doc:
+            assert (token.dep_ == "ROOT") == (token.head == token)
+
+
+def test_ragged_scores():
+    nlp = English.from_config()
+    sentencizer = nlp.add_pipe("sentencizer")
+    parser = nlp.add_pipe("biaffine_parser", config={"model": {"dropout": 0.0}})
+    train_examples = []
+    for t in TRAIN_DATA:
+        train_examples.append(Example.from_dict(sentencizer(nlp.make_doc(t[0])), t[1]))
+    nlp.initialize(get_examples=lambda: train_examples)
+    text = "She likes green eggs. Eat blue ham."
+    expected = [(token.head.i, token.dep_) for token in nlp(text)]
+    losses = parser.update(train_examples)
+
+    parser.model.get_ref("pairwise_bilinear").attrs["ragged_scores"] = True
+    assert [(token.head.i, token.dep_) for token in nlp(text)] == expected
+    ragged_losses = parser.update(train_examples)
+    assert ragged_losses["biaffine_parser"] == pytest.approx(losses["biaffine_parser"], rel=1e-4)
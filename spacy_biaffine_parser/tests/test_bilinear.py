@@ -0,0 +1,128 @@
+import pytest
+import torch
+from spacy import util
+from spacy.lang.en import English
+from spacy.training import Example
+
+from spacy_biaffine_parser import arc_labeler, arc_predicter, bilinear
+from spacy_biaffine_parser.bilinear import build_bilinear_layer
+from spacy_biaffine_parser.bilinear_benchmark import bilinear_macs, run_benchmarks
+from spacy_biaffine_parser.export import LabelScorer
+from spacy_biaffine_parser.pytorch_bilinear import BilinearModel, LowRankBilinear
+
+TRAIN_DATA = [
+    (
+        "She likes green eggs",
+        {
+            "heads": [1, 1, 3, 1],
+            "deps": ["nsubj", "ROOT", "amod", "dobj"],
+            "sent_starts": [1, 0, 0, 0],
+        },
+    ),
+    (
+        "Eat blue ham",
+        {
+            "heads": [0, 2, 0],
+            "deps": ["ROOT", "amod", "dobj"],
+            "sent_starts": [1, 0, 0],
+        },
+    ),
+]
+
+LOW_RANK_MODEL = dict(
+    arc_labeler.DEFAULT_ARC_LABELER_MODEL,
+    **{"@architectures": "Bilinear.v2", "rank": 8, "diagonal": True},
+)
+
+
+@pytest.mark.parametrize("diagonal", [True, False])
+def test_low_rank_bilinear(diagonal):
+    torch.manual_seed(0)
+    layer = LowRankBilinear(6, 3, 4, diagonal=diagonal)
+    if diagonal:
+        with torch.no_grad():
+            layer.diagonal.normal_()
+    x1 = torch.randn(5, 6)
+    x2 = torch.randn(5, 6)
+
+    # The weight matrix of each output is U^T diag(w_o) V (+ diag(d_o)).
+    U = layer.head_factor.weight
+    V = layer.dependent_factor.weight
+    weight = torch.einsum("ri,or,rj->oij", U, layer.weight, V)
+    if diagonal:
+        weight = weight + torch.diag_embed(layer.diagonal)
+    expected = torch.einsum("ni,oij,nj->no", x1, weight, x2) + layer.bias
+    torch.testing.assert_close(layer(x1, x2), expected)
+
+
+def test_invalid_rank():
+    with pytest.raises(ValueError, match=r"rank of the bilinear form should be at least 1"):
+        BilinearModel(16, 4, rank=0)
+    with pytest.raises(ValueError, match=r"rank of the bilinear form should be at least 1"):
+        build_bilinear_layer(16, 4, rank=0)
+    with pytest.raises(ValueError, match=r"diagonal can only be added to a low-rank"):
+        build_bilinear_layer(16, 4, diagonal=True)
+
+
+def test_label_scorer_low_rank():
+    torch.manual_seed(0)
+    model = BilinearModel(16, 5, hidden_width=32, rank=8, diagonal=True)
+    model.eval()
+    x = torch.randn(6, 16)
+    heads = torch.tensor([1, 1, 1, 4, 4, 4])
+    with torch.no_grad():
+        torch.testing.assert_close(LabelScorer(model)(x, heads), model(x, heads))
+
+
+def test_bilinear_v2():
+    util.fix_random_seed(0)
+    nlp = English.from_config()
+    nlp.add_pipe("sentencizer")
+    nlp.add_pipe("arc_predicter")
+    nlp.add_pipe("arc_labeler", config={"model": LOW_RANK_MODEL})
+    train_examples = []
+    for t in TRAIN_DATA:
+        train_examples.append(Example.from_dict(nlp.make_doc(t[0]), t[1]))
+
+    optimizer = nlp.initialize(get_examples=lambda: train_examples)
+    pytorch_model = nlp.get_pipe("arc_labeler").model.get_ref("bilinear").layers[0].shims[0]._model
+    assert isinstance(pytorch_model.bilinear, LowRankBilinear)
+
+    for i in range(150):
+        losses = {}
+        nlp.update(train_examples, sgd=optimizer, losses=losses, annotates=["sentencizer"])
+    assert losses["arc_labeler"] < 0.001
+
+    test_text = "She likes blue eggs"
+    deps = [token.dep_ for token in nlp(test_text)]
+    assert deps == ["nsubj", "ROOT", "amod", "dobj"]
+
+    # Check model after a {to,from}_disk roundtrip
+    with util.make_tempdir() as tmp_dir:
+        nlp.to_disk(tmp_dir)
+        nlp2 = util.load_model_from_path(tmp_dir)
+        assert [token.dep_ for token in nlp2(test_text)] == deps
+
+    # Check model after a {to,from}_bytes roundtrip
+    nlp3 = English()
+    nlp3.add_pipe("sentencizer")
+    nlp3.add_pipe("arc_predicter")
+    nlp3.add_pipe("arc_labeler", config={"model": LOW_RANK_MODEL})
+    nlp3.from_bytes(nlp.to_bytes())
+    assert [token.dep_ for token in nlp3(test_text)] == deps
+
+
+def test_bilinear_benchmark():
+    assert bilinear_macs(128, 50) == 50 * 128 * 129
+    assert bilinear_macs(128, 50, 32) == 2 * 128 * 32 + 32 + 32 * 50
+    assert bilinear_macs(128, 50, 32, True) == 2 * 128 * 32 + 32 + 32 * 50 + 128 + 128 * 50
+
+    results = run_benchmarks([4], nI=16, hidden_width=32, n_labels=10, n_tokens=64, repeats=2)
+    assert list(results) == ["full", "rank4", "rank4+diag"]
+    assert results["full"]["parameters"] == 10 * 32 * 32 + 10
+    assert results["rank4"]["parameters"] == 2 * 32 * 4 + 10 * 4 + 10
+    assert results["full"]["macs_ratio"] == 1.0
+    for result in results.values():
+        assert result["p50_ms"] <= result["p90_ms"]
+        assert result["speedup"] > 0.0
+    assert results["rank4"]["macs_ratio"] < results["rank4+diag"]["macs_ratio"] < 1.0
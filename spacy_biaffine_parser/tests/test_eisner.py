@@ -0,0 +1,92 @@
+import itertools
+
+import numpy as np
+import pytest
+
+from spacy_biaffine_parser.eisner import eisner_decode_batch
+from spacy_biaffine_parser.mst import mst_decode
+
+
+def padded_batch(lengths, seed=42):
+    rng = np.random.default_rng(seed)
+    max_len = max(lengths)
+    sents = [rng.random((length, length), dtype=np.float32) for length in lengths]
+    padded = np.full((sum(lengths), max_len), -10000, dtype=np.float32)
+    offset = 0
+    for sent in sents:
+        padded[offset : offset + sent.shape[0], : sent.shape[1]] = sent
+        offset += sent.shape[0]
+    return sents, padded
+
+
+def is_projective_tree(heads):
+    parents = [None if head == i else head for i, head in enumerate(heads)]
+    for vertex in range(len(heads)):
+        visited = set()
+        while parents[vertex] is not None:
+            if vertex in visited:
+                return False
+            visited.add(vertex)
+            vertex = parents[vertex]
+
+    # Root attachments are arcs from a virtual vertex before the sentence.
+    arcs = [(-1, i) if head == i else tuple(sorted((i, head))) for i, head in enumerate(heads)]
+    return not any(a < c < b < d for a, b in arcs for c, d in arcs)
+
+
+def tree_score(scores, heads):
+    return sum(scores[i, head] for i, head in enumerate(heads))
+
+
+@pytest.mark.parametrize("n_threads", [1, 3])
+def test_eisner_finds_best_projective_tree(n_threads):
+    lengths = [4, 1, 5, 0, 4, 3, 5]
+    sents, padded = padded_batch(lengths)
+    heads = eisner_decode_batch(padded, np.array(lengths), n_threads=n_threads)
+    assert heads.dtype == np.int32
+
+    offset = 0
+    for sent in sents:
+        sent_heads = heads[offset : offset + sent.shape[0]].tolist()
+        offset += sent.shape[0]
+        assert is_projective_tree(sent_heads)
+
+        best = max(
+            tree_score(sent, candidate)
+            for candidate in itertools.product(range(sent.shape[0]), repeat=sent.shape[0])
+            if is_projective_tree(candidate)
+        )
+        assert tree_score(sent, sent_heads) == pytest.approx(best)
+
+
+def test_eisner_ragged():
+    lengths = [4, 1, 5, 0, 4, 3, 5]
+    sents, padded = padded_batch(lengths)
+    ragged = np.concatenate([sent.reshape(-1) for sent in sents])
+    expected = eisner_decode_batch(padded, np.array(lengths))
+    heads = eisner_decode_batch(ragged, np.array(lengths), n_threads=3)
+    assert heads.tolist() == expected.tolist()
+
+    with pytest.raises(ValueError, match=r"92 scores do not match the 83 scores"):
+        eisner_decode_batch(ragged, np.array([4, 1, 5, 0, 4, 3, 4]))
+
+
+def test_eisner_matches_mst_on_projective_scores():
+    # Chain in which every token attaches to its left neighbour.
+    scores = np.zeros((6, 6), dtype=np.float32)
+    scores[0, 0] = 1.0
+    for i in range(1, 6):
+        scores[i, i - 1] = 1.0
+    heads = eisner_decode_batch(scores, np.array([6]))
+    assert heads.tolist() == mst_decode(scores).tolist() == [0, 0, 1, 2, 3, 4]
+
+
+def test_eisner_invalid():
+    lengths = [3, 4]
+    _, padded = padded_batch(lengths)
+    with pytest.raises(ValueError, match=r"does not match total sentence length"):
+        eisner_decode_batch(padded, np.array([3, 3]))
+
+    padded[4, 2] = np.NaN
+    with pytest.raises(ValueError, match=r"non-finite"):
+        eisner_decode_batch(padded, np.array(lengths))
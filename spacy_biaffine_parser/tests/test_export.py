@@ -0,0 +1,95 @@
+import pytest
+from spacy import util
+from spacy.lang.en import English
+from spacy.training import Example
+
+from spacy_biaffine_parser import arc_labeler, arc_predicter, biaffine_parser
+from spacy_biaffine_parser.export import export_scorers
+
+TRAIN_DATA = [
+    (
+        "She likes green eggs",
+        {
+            "heads": [1, 1, 3, 1],
+            "deps": ["nsubj", "ROOT", "amod", "dobj"],
+            "sent_starts": [1, 0, 0, 0],
+        },
+    ),
+    (
+        "Eat blue ham",
+        {
+            "heads": [0, 2, 0],
+            "deps": ["ROOT", "amod", "dobj"],
+            "sent_starts": [1, 0, 0],
+        },
+    ),
+]
+
+TEXTS = [
+    "She likes green eggs. Eat blue ham.",
+    "Eat",
+    " ".join(["word"] * 30),
+]
+
+
+def make_nlp(pipes, exported_path=None):
+    nlp = English()
+    nlp.add_pipe("sentencizer")
+    for pipe in pipes:
+        config = {}
+        if exported_path is not None:
+            config["exported_scorers"] = str(exported_path / pipe)
+        nlp.add_pipe(pipe, config=config)
+    return nlp
+
+
+def parses(nlp):
+    return [[(token.head.i, token.dep_) for token in doc] for doc in nlp.pipe(TEXTS)]
+
+
+@pytest.mark.parametrize("format", ["torchscript", "onnx"])
+@pytest.mark.parametrize("pipes", [["arc_predicter", "arc_labeler"], ["biaffine_parser"]])
+def test_exported_scorers(format, pipes):
+    if format == "onnx":
+        pytest.importorskip("onnx")
+        pytest.importorskip("onnxruntime")
+    util.fix_random_seed(0)
+    nlp = make_nlp(pipes)
+    train_examples = []
+    for t in TRAIN_DATA:
+        train_examples.append(Example.from_dict(nlp.make_doc(t[0]), t[1]))
+    optimizer = nlp.initialize(get_examples=lambda: train_examples)
+    for i in range(10):
+        nlp.update(train_examples, sgd=optimizer, annotates=["sentencizer"])
+    expected = parses(nlp)
+
+    with util.make_tempdir() as tmp_dir:
+        assert export_scorers(nlp, tmp_dir, format=format) == pipes
+        if "arc_predicter" in pipes:
+            assert not (tmp_dir / "arc_predicter" / "labels.json").exists()
+
+        nlp2 = make_nlp(pipes, tmp_dir)
+        nlp2.from_bytes(nlp.to_bytes())
+        assert parses(nlp2) == expected
+
+
+def test_export_errors():
+    nlp = make_nlp(["arc_labeler"])
+    nlp.initialize(
+        get_examples=lambda: [Example.from_dict(nlp.make_doc(t[0]), t[1]) for t in TRAIN_DATA]
+    )
+    with util.make_tempdir() as tmp_dir:
+        with pytest.raises(ValueError, match=r"Unknown export format 'tflite'"):
+            export_scorers(nlp, tmp_dir, format="tflite")
+
+        export_scorers(nlp, tmp_dir)
+        with pytest.raises(ValueError, match=r"No exported arc_scorer"):
+            nlp.add_pipe(
+                "arc_predicter", config={"exported_scorers": str(tmp_dir / "arc_labeler")}
+            )
+
+        # The exported labels must match those of the component.
+        nlp2 = make_nlp(["arc_labeler"], tmp_dir)
+        nlp2.get_pipe("arc_labeler").add_label("dep")
+        with pytest.raises(ValueError, match=r"do not match the labels"):
+            nlp2("Eat blue ham")
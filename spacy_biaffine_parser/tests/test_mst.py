@@ -4,36 +4,44 @@ from hypothesis.strategies import floats, integers
 import numpy as np
 import pytest
 
-from spacy_biaffine_parser.mst import chu_liu_edmonds
+from spacy_biaffine_parser.mst import chu_liu_edmonds, chu_liu_edmonds_tarjan
+from spacy_biaffine_parser.mst import get_decode_stats, reset_decode_stats
+from spacy_biaffine_parser.mst import mst_decode, mst_decode_batch
+from spacy_biaffine_parser.mst import mst_decode_sparse_batch
 
+MST_FUNCTIONS = [chu_liu_edmonds, chu_liu_edmonds_tarjan]
 
-def test_non_square():
+
+@pytest.mark.parametrize("mst", MST_FUNCTIONS)
+def test_non_square(mst):
     scores = np.random.rand(20).astype("f").reshape(5, 4)
     with pytest.raises(ValueError, match=r"Edge weight matrix.*not a square matrix"):
-        chu_liu_edmonds(scores, 0)
+        mst(scores, 0)
 
 
-def test_head_out_of_bounds():
+@pytest.mark.parametrize("mst", MST_FUNCTIONS)
+def test_head_out_of_bounds(mst):
     scores = np.random.rand(25).astype("f").reshape(5, 5)
     with pytest.raises(IndexError, match=r"Root vertex 5 is.*(5, 5)"):
-        chu_liu_edmonds(scores, 5)
+        mst(scores, 5)
 
 
-def test_inf_nan():
+@pytest.mark.parametrize("mst", MST_FUNCTIONS)
+def test_inf_nan(mst):
     scores = np.zeros((5, 5), dtype=np.float32)
-    chu_liu_edmonds(scores, 0)
+    mst(scores, 0)
 
     scores[4, 4] = np.NaN
     with pytest.raises(ValueError, match=r"Edge weight matrix.* nan"):
-        chu_liu_edmonds(scores, 0)
+        mst(scores, 0)
 
     scores[4, 4] = np.PINF
     with pytest.raises(ValueError, match=r"Edge weight matrix.* inf"):
-        chu_liu_edmonds(scores, 0)
+        mst(scores, 0)
 
     scores[4, 4] = np.NINF
     with pytest.raises(ValueError, match=r"Edge weight matrix.* -inf"):
-        chu_liu_edmonds(scores, 0)
+        mst(scores, 0)
 
 
 def square_float_arrays():
@@ -42,12 +50,242 @@ def square_float_arrays():
     return hn.arrays(np.float32, n, elements=elements)
 
 
+@pytest.mark.parametrize("mst", MST_FUNCTIONS)
 @given(square_float_arrays())
-def test_can_decode_random_square_matrices(scores):
-    chu_liu_edmonds(scores, 0)
+def test_can_decode_random_square_matrices(mst, scores):
+    mst(scores, 0)
+
+
+def padded_batch(lengths, seed=42):
+    rng = np.random.default_rng(seed)
+    max_len = max(lengths)
+    sents = [rng.random((length, length), dtype=np.float32) for length in lengths]
+    padded = np.full((sum(lengths), max_len), -10000, dtype=np.float32)
+    offset = 0
+    for sent in sents:
+        padded[offset : offset + sent.shape[0], : sent.shape[1]] = sent
+        offset += sent.shape[0]
+    return sents, padded
+
+
+def mst_decode_reference(scores):
+    """MST decoding without the fast path."""
+    seq_len = scores.shape[0]
+    with_root = np.full((seq_len + 1, seq_len + 1), -10000, dtype=np.float32)
+    with_root[1:, 1:] = scores
+    with_root[1:, 0] = scores.diagonal()
+    with_root[np.diag_indices(with_root.shape[0])] = -10000
+    heads = chu_liu_edmonds(with_root.T, 0)[1:]
+    return [idx if head == 0 else head - 1 for idx, head in enumerate(heads)]
+
+
+def tree_score(scores, heads):
+    return sum(scores[i, head] for i, head in enumerate(heads))
+
+
+@given(square_float_arrays())
+def test_decode_matches_reference(scores):
+    reference = mst_decode_reference(scores)
+    assert mst_decode(scores, algorithm="chu_liu_edmonds").tolist() == reference
+
+    # Tarjan's algorithm can break ties differently.
+    heads = mst_decode(scores)
+    assert heads.dtype == np.int32
+    assert tree_score(scores, heads) == pytest.approx(tree_score(scores, reference))
+
+
+def test_decode_fast_path():
+    reset_decode_stats()
+
+    # The best heads form a tree.
+    scores = np.zeros((4, 4), dtype=np.float32)
+    scores[[0, 1, 2, 3], [1, 1, 3, 1]] = 1.0
+    assert mst_decode(scores).tolist() == [1, 1, 3, 1]
+    assert get_decode_stats() == {"sentences": 1, "fast_path": 1}
+
+    # The best heads of the first two tokens form a cycle.
+    scores[0, 0] = 0.5
+    scores[1, 0] = 2.0
+    assert mst_decode(scores).tolist() == mst_decode_reference(scores) == [0, 0, 3, 1]
+    assert get_decode_stats() == {"sentences": 2, "fast_path": 1}
+
+    # Two tokens attaching to each other are resolved without CLE.
+    scores = np.array([[0.0, 1.0], [1.0, 0.5]], dtype=np.float32)
+    assert mst_decode(scores).tolist() == [1, 1]
+    assert get_decode_stats() == {"sentences": 3, "fast_path": 2}
+
+    reset_decode_stats()
+    assert get_decode_stats() == {"sentences": 0, "fast_path": 0}
+
+
+@pytest.mark.parametrize("algorithm", ["chu_liu_edmonds", "tarjan"])
+@pytest.mark.parametrize("n_threads", [1, 4])
+def test_decode_batch_matches_decode(algorithm, n_threads):
+    lengths = [3, 1, 12, 7, 0, 20, 2]
+    sents, padded = padded_batch(lengths)
+    heads = mst_decode_batch(
+        padded, np.array(lengths), algorithm=algorithm, n_threads=n_threads
+    )
+    assert heads.dtype == np.int32
+    expected = [mst_decode(sent, algorithm=algorithm) for sent in sents]
+    assert heads.tolist() == np.concatenate(expected).tolist()
+
+
+def test_algorithms_agree_on_long_sentences():
+    rng = np.random.default_rng(42)
+    for seq_len in [50, 300]:
+        scores = rng.random((seq_len, seq_len), dtype=np.float32)
+        assert (
+            mst_decode(scores, algorithm="tarjan").tolist()
+            == mst_decode(scores, algorithm="chu_liu_edmonds").tolist()
+        )
+
+    with pytest.raises(ValueError, match=r"Unknown MST algorithm"):
+        mst_decode(scores, algorithm="prim")
+
+
+@pytest.mark.parametrize("algorithm", ["chu_liu_edmonds", "tarjan"])
+def test_decode_score_types(algorithm):
+    lengths = [5, 30, 12]
+    _, padded = padded_batch(lengths)
+    padded = padded.astype(np.float16)
+    expected = mst_decode_batch(padded.astype(np.float32), lengths, algorithm=algorithm)
+    for dtype in [np.float16, np.float32, np.float64]:
+        heads = mst_decode_batch(padded.astype(dtype), lengths, algorithm=algorithm)
+        assert heads.tolist() == expected.tolist()
+
+    # Rows that are not contiguous in memory.
+    scores = padded.astype(np.float32)[5:35, :30]
+    assert (
+        mst_decode(scores, algorithm=algorithm).tolist()
+        == mst_decode(np.ascontiguousarray(scores), algorithm=algorithm).tolist()
+    )
+
+    scores[3, 4] = np.inf
+    with pytest.raises(ValueError, match=r"non-finite"):
+        mst_decode(scores.astype(np.float16), algorithm=algorithm)
+
+
+def test_decode_batch_invalid():
+    lengths = [3, 4]
+    _, padded = padded_batch(lengths)
+    with pytest.raises(ValueError, match=r"does not match total sentence length"):
+        mst_decode_batch(padded, np.array([3, 3]))
+
+    padded[4, 2] = np.NaN
+    with pytest.raises(ValueError, match=r"sentence 1 contains non-finite"):
+        mst_decode_batch(padded, np.array(lengths))
+
+
+@pytest.mark.parametrize("algorithm", ["chu_liu_edmonds", "tarjan"])
+@pytest.mark.parametrize("n_threads", [1, 4])
+def test_decode_batch_ragged(algorithm, n_threads):
+    lengths = [3, 1, 12, 7, 0, 20, 2]
+    sents, padded = padded_batch(lengths)
+    ragged = np.concatenate([sent.reshape(-1) for sent in sents])
+    for dtype in [np.float16, np.float32, np.float64]:
+        heads = mst_decode_batch(
+            ragged.astype(dtype), lengths, algorithm=algorithm, n_threads=n_threads
+        )
+        expected = mst_decode_batch(padded.astype(dtype), lengths, algorithm=algorithm)
+        assert heads.tolist() == expected.tolist()
+
+    with pytest.raises(ValueError, match=r"do not match the 607 scores"):
+        mst_decode_batch(ragged[:-1], lengths)
+
+    ragged[20] = np.NaN
+    with pytest.raises(ValueError, match=r"sentence 2 contains non-finite"):
+        mst_decode_batch(ragged, lengths)
+
+
+def top_k_candidates(padded, lengths, k):
+    """Candidate heads and scores of the k best heads of each token, plus
+    the token itself, as in `mst_decode_sparse_batch`."""
+    candidates = np.full((padded.shape[0], k + 1), -1, dtype=np.int32)
+    candidate_scores = np.zeros((padded.shape[0], k + 1), dtype=np.float32)
+    offset = 0
+    for length in lengths:
+        for dep in range(length):
+            row = padded[offset + dep, :length]
+            heads = [head for head in np.argsort(-row) if head != dep][:k]
+            heads.append(dep)
+            candidates[offset + dep, -len(heads) :] = heads
+            candidate_scores[offset + dep, -len(heads) :] = row[heads]
+        offset += length
+    return candidates, candidate_scores
+
+
+@pytest.mark.parametrize("k", [1, 3, 30])
+@pytest.mark.parametrize("n_threads", [1, 4])
+def test_decode_sparse_matches_dense(k, n_threads):
+    lengths = [3, 1, 12, 7, 0, 20, 2, 30]
+    sents, padded = padded_batch(lengths, seed=k)
+    candidates, candidate_scores = top_k_candidates(padded, lengths, k)
+
+    # Dense decoding of the scores, with edges that are not candidates removed.
+    pruned = np.full_like(padded, -10000)
+    rows = np.repeat(np.arange(padded.shape[0]), k + 1)
+    mask = candidates.ravel() != -1
+    pruned[rows[mask], candidates.ravel()[mask]] = candidate_scores.ravel()[mask]
+    expected = mst_decode_batch(pruned, lengths)
+
+    heads, has_tree = mst_decode_sparse_batch(
+        candidates, candidate_scores, lengths, n_threads=n_threads
+    )
+    assert heads.dtype == np.int32
+    assert has_tree.all()
+    assert tree_score(pruned, heads) == pytest.approx(tree_score(pruned, expected))
+
+    offset = 0
+    for length in lengths:
+        sent_heads = heads[offset : offset + length]
+        assert all(pruned[offset + dep, head] > -10000 for dep, head in enumerate(sent_heads))
+        offset += length
+
+    if k >= max(lengths):
+        assert tree_score(padded, heads) == pytest.approx(
+            tree_score(padded, mst_decode_batch(padded, lengths))
+        )
+
+
+def test_decode_sparse_no_tree():
+    reset_decode_stats()
+
+    # The second sentence has no root candidate, so its tokens can only
+    # attach to each other.
+    candidates = np.array([[0, 1], [0, -1], [1, -1], [0, -1]], dtype=np.int32)
+    candidate_scores = np.array([[1.0, 2.0], [3.0, 0.0], [1.0, 0.0], [1.0, 0.0]])
+    heads, has_tree = mst_decode_sparse_batch(candidates, candidate_scores, [2, 2])
+    assert heads.tolist() == [0, 0, -1, -1]
+    assert has_tree.tolist() == [True, False]
+    assert get_decode_stats() == {"sentences": 1, "fast_path": 0}
+
+    # A cycle that has to be broken through the root candidate.
+    candidates = np.array([[1, 0], [0, 1]], dtype=np.int32)
+    candidate_scores = np.array([[5.0, 1.0], [5.0, 2.0]], dtype=np.float16)
+    heads, has_tree = mst_decode_sparse_batch(candidates, candidate_scores, [2])
+    assert heads.tolist() == [1, 1]
+    assert has_tree.tolist() == [True]
+
+
+def test_decode_sparse_invalid():
+    candidates = np.array([[0], [0], [2]], dtype=np.int32)
+    candidate_scores = np.zeros((3, 1), dtype=np.float32)
+    with pytest.raises(ValueError, match=r"do not match total sentence length"):
+        mst_decode_sparse_batch(candidates, candidate_scores, [2, 2])
+    with pytest.raises(ValueError, match=r"should be -1 or a token"):
+        mst_decode_sparse_batch(candidates, candidate_scores, [2, 1])
+    with pytest.raises(ValueError, match=r"matrices of the same shape"):
+        mst_decode_sparse_batch(candidates, candidate_scores[:2], [1, 2])
+
+    candidates[2, 0] = 0
+    candidate_scores[1, 0] = np.NaN
+    with pytest.raises(ValueError, match=r"sentence 0 contain non-finite"):
+        mst_decode_sparse_batch(candidates, candidate_scores, [2, 1])
 
 
-def test_correctly_decodes_random_large_matrices():
+@pytest.mark.parametrize("mst", MST_FUNCTIONS)
+def test_correctly_decodes_random_large_matrices(mst):
     scores = np.array(
         [
             [
@@ -173,7 +411,7 @@ def test_correctly_decodes_random_large_matrices():
         ],
         dtype="f",
     )
-    assert chu_liu_edmonds(scores, 0) == [None, 4, 1, 2, 9, 0, 3, 8, 5, 7]
+    assert mst(scores, 0) == [None, 4, 1, 2, 9, 0, 3, 8, 5, 7]
 
     scores2 = np.array(
         [
@@ -301,7 +539,7 @@ def test_correctly_decodes_random_large_matrices():
         dtype="f",
     )
 
-    assert chu_liu_edmonds(scores2, 0) == [None, 0, 1, 4, 6, 4, 8, 8, 0, 8]
+    assert mst(scores2, 0) == [None, 0, 1, 4, 6, 4, 8, 8, 0, 8]
 
     scores3 = np.array(
         [
@@ -429,7 +667,7 @@ def test_correctly_decodes_random_large_matrices():
         dtype="f",
     )
 
-    assert chu_liu_edmonds(scores3, 0) == [None, 4, 8, 9, 7, 1, 0, 2, 6, 5]
+    assert mst(scores3, 0) == [None, 4, 8, 9, 7, 1, 0, 2, 6, 5]
 
     scores4 = np.array(
         [
@@ -557,7 +795,7 @@ def test_correctly_decodes_random_large_matrices():
         dtype="f",
     )
 
-    assert chu_liu_edmonds(scores4, 0) == [None, 8, 9, 0, 7, 2, 3, 5, 3, 8]
+    assert mst(scores4, 0) == [None, 8, 9, 0, 7, 2, 3, 5, 3, 8]
 
     scores5 = np.array(
         [
@@ -685,4 +923,4 @@ def test_correctly_decodes_random_large_matrices():
         dtype="f",
     )
 
-    assert chu_liu_edmonds(scores5, 0) == [None, 5, 4, 8, 7, 2, 2, 0, 6, 1]
+    assert mst(scores5, 0) == [None, 5, 4, 8, 7, 2, 2, 0, 6, 1]
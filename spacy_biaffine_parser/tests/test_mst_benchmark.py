@@ -0,0 +1,59 @@
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from spacy_biaffine_parser.mst import get_decode_stats, mst_decode, reset_decode_stats
+from spacy_biaffine_parser.mst_benchmark import find_regressions, nested_cycle_scores
+from spacy_biaffine_parser.mst_benchmark import run_benchmarks
+
+# Baseline for the regression test, created with:
+#
+#   python -m spacy_biaffine_parser.mst_benchmark --save-baseline <path>
+BASELINE_PATH = os.environ.get("MST_BENCHMARK_BASELINE")
+
+
+def tree_score(scores, heads):
+    return sum(scores[i, head] for i, head in enumerate(heads))
+
+
+def test_nested_cycles_need_full_decoding():
+    scores = nested_cycle_scores(np.random.default_rng(42), 64)
+
+    # The best heads form cycles of two tokens.
+    best_heads = np.where(np.eye(64, dtype=bool), -np.inf, scores).argmax(-1)
+    assert best_heads.tolist() == [i ^ 1 for i in range(64)]
+
+    reset_decode_stats()
+    tarjan = mst_decode(scores, algorithm="tarjan")
+    chu_liu_edmonds = mst_decode(scores, algorithm="chu_liu_edmonds")
+    assert get_decode_stats() == {"sentences": 2, "fast_path": 0}
+    assert tree_score(scores, tarjan) == pytest.approx(tree_score(scores, chu_liu_edmonds))
+    assert (tarjan == np.arange(64)).sum() == 1
+
+
+def test_find_regressions():
+    results = run_benchmarks(["treebank"], ["tarjan"])
+    result = results["treebank/tarjan"]
+    assert result["sentences"] == 500
+    assert result["p50_us"] <= result["p90_us"] <= result["p99_us"] <= result["max_us"]
+    assert result["workspace_growths"] == 0
+    assert find_regressions(results, results) == []
+
+    faster = {"treebank/tarjan": dict(result, p50_us=result["p50_us"] / 2)}
+    assert find_regressions(results, faster, threshold=1.5) == []
+    (regression,) = find_regressions(results, faster, threshold=0.25)
+    assert regression.startswith("treebank/tarjan: p50_us regressed")
+
+
+@pytest.mark.benchmark
+@pytest.mark.skipif(BASELINE_PATH is None, reason="MST_BENCHMARK_BASELINE is not set")
+def test_no_regressions():
+    baseline = json.loads(Path(BASELINE_PATH).read_text())
+    workloads = sorted({name.split("/")[0] for name in baseline})
+    algorithms = sorted({name.split("/")[1] for name in baseline})
+    results = run_benchmarks(workloads, algorithms)
+    threshold = float(os.environ.get("MST_BENCHMARK_THRESHOLD", 0.25))
+    assert find_regressions(results, baseline, threshold=threshold) == []
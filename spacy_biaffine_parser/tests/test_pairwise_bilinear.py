@@ -0,0 +1,269 @@
+import numpy as np
+import pytest
+import torch
+from spacy.lang.en import English
+from spacy.training import Example
+
+from spacy_biaffine_parser import arc_predicter, pairwise_bilinear
+from spacy_biaffine_parser.pairwise_bilinear import build_pairwise_bilinear_layer
+from spacy_biaffine_parser.pytorch_pairwise_bilinear import (
+    PairwiseBilinear,
+    PairwiseBilinearFunction,
+    PairwiseBilinearModel,
+    VariationalDropout,
+)
+
+TRAIN_DATA = [
+    (
+        "She likes green eggs",
+        {
+            "heads": [1, 1, 3, 1],
+            "deps": ["nsubj", "ROOT", "amod", "dobj"],
+            "sent_starts": [1, 0, 0, 0],
+        },
+    ),
+    (
+        "Eat blue ham",
+        {
+            "heads": [0, 2, 0],
+            "deps": ["ROOT", "amod", "dobj"],
+            "sent_starts": [1, 0, 0],
+        },
+    ),
+]
+
+
+def pairwise_bilinear_einsum(u, v, weight, bias_u, bias_v):
+    ones = torch.ones(u.shape[:2] + (1,), dtype=u.dtype)
+    if bias_u:
+        u = torch.cat([u, ones], -1)
+    if bias_v:
+        v = torch.cat([v, ones], -1)
+    return torch.einsum("blu,ouv,bmv->bmlo", u, weight, v)
+
+
+def traced_keys(model):
+    return sorted(key[2] for key in model.inference_cache() if key[0] == "traced")
+
+
+@pytest.mark.parametrize("bias_u", [True, False])
+@pytest.mark.parametrize("bias_v", [True, False])
+@pytest.mark.parametrize("nO", [1, 3])
+@pytest.mark.parametrize("with_mask", [True, False])
+def test_pairwise_bilinear(bias_u, bias_v, nO, with_mask):
+    torch.manual_seed(0)
+    u = torch.randn(2, 5, 4, dtype=torch.float64, requires_grad=True)
+    v = torch.randn(2, 5, 4, dtype=torch.float64, requires_grad=True)
+    weight = torch.randn(nO, 4 + bias_u, 4 + bias_v, dtype=torch.float64, requires_grad=True)
+    mask = torch.randn(2, 5, dtype=torch.float64) if with_mask else None
+
+    scores = PairwiseBilinearFunction.apply(u, v, weight, bias_u, bias_v, mask)
+    expected = pairwise_bilinear_einsum(u, v, weight, bias_u, bias_v)
+    if with_mask:
+        expected = expected + mask[:, None, :, None]
+    torch.testing.assert_close(scores, expected)
+
+    # Prediction does not use the autograd function.
+    layer = PairwiseBilinear(4, nO, bias_u=bias_u, bias_v=bias_v).double()
+    with torch.no_grad():
+        layer.weight.copy_(weight)
+        torch.testing.assert_close(layer(u, v, mask), expected)
+
+    assert torch.autograd.gradcheck(
+        lambda u, v, weight: PairwiseBilinearFunction.apply(u, v, weight, bias_u, bias_v, mask),
+        (u, v, weight),
+    )
+
+
+def test_variational_dropout():
+    torch.manual_seed(0)
+    dropout = VariationalDropout(0.5)
+    x = torch.ones(4, 6, 100, dtype=torch.float64)
+    y = dropout(x)
+    assert y.dtype == torch.float64
+    assert set(y.unique().tolist()) <= {0.0, 2.0}
+    # The same units are dropped in every time step.
+    assert torch.equal(y, y[:, :1].expand_as(y))
+
+    dropout.p = 1.0
+    assert not dropout(x).any()
+
+    dropout.eval()
+    assert dropout(x) is x
+
+
+def test_padding_mask():
+    torch.manual_seed(0)
+    model = PairwiseBilinearModel(16, 1, hidden_width=32)
+    model.eval()
+    x = torch.randn(2, 4, 16)
+    logits = model(x, torch.tensor([4, 2], dtype=torch.int32))
+    assert (logits[0] > -5000.0).all()
+    assert (logits[1, :, :2] > -5000.0).all()
+    assert (logits[1, :, 2:] < -5000.0).all()
+
+
+def test_pairwise_bilinear_inplace():
+    # The scores can be masked in-place.
+    layer = PairwiseBilinear(4, 1)
+    u = torch.randn(2, 5, 4, requires_grad=True)
+    scores = layer(u, u)
+    scores += 1.0
+    scores.sum().backward()
+    assert u.grad is not None
+
+
+@pytest.mark.parametrize("precision", ["fp32", "bf16"])
+def test_inference_buckets(precision):
+    torch.manual_seed(0)
+    model = PairwiseBilinearModel(
+        16, 1, hidden_width=32, inference_precision=precision, inference_buckets=[8, 4]
+    )
+    model.eval()
+    assert model.inference_buckets == (4, 8)
+
+    eager = PairwiseBilinearModel(16, 1, hidden_width=32, inference_precision=precision)
+    eager.load_state_dict(model.state_dict())
+    eager.eval()
+
+    model.warm_up()
+    assert traced_keys(model) == [4, 8]
+
+    for batch_size, seq_len in [(1, 3), (3, 4), (5, 7), (2, 11)]:
+        x = torch.randn(batch_size, seq_len, 16)
+        lens = torch.randint(1, seq_len + 1, (batch_size,), dtype=torch.int32)
+        logits = model(x, lens)
+        assert logits.shape == (batch_size, seq_len, seq_len)
+        torch.testing.assert_close(logits, eager(x, lens))
+    # Batches that are longer than the largest bucket are not traced.
+    assert traced_keys(model) == [4, 8]
+
+
+def test_inference_buckets_int8():
+    model = PairwiseBilinearModel(16, 1, inference_precision="int8", inference_buckets=[8])
+    model.eval()
+    model.warm_up()
+    x = torch.randn(2, 6, 16)
+    lens = torch.tensor([6, 3], dtype=torch.int32)
+    torch.testing.assert_close(model(x, lens), model.score(x, lens))
+    assert traced_keys(model) == []
+
+
+def test_inference_buckets_parameters_changed():
+    torch.manual_seed(0)
+    model = PairwiseBilinearModel(16, 1, hidden_width=32, inference_buckets=[8])
+    model.eval()
+    x = torch.randn(2, 6, 16)
+    lens = torch.tensor([6, 3], dtype=torch.int32)
+    model(x, lens)
+    assert traced_keys(model) == [8]
+
+    with torch.no_grad():
+        model.head.weight.mul_(2.0)
+    assert traced_keys(model) == []
+    torch.testing.assert_close(model(x, lens), model.score(x, lens))
+
+
+def test_invalid_inference_buckets():
+    with pytest.raises(ValueError, match=r"Inference buckets must be positive"):
+        PairwiseBilinearModel(16, 1, inference_buckets=[0, 8])
+
+
+def test_warm_up_on_load():
+    nlp = English.from_config()
+    nlp.add_pipe("sentencizer")
+    nlp.add_pipe("arc_predicter", config={"model": {"inference_buckets": [8, 16]}})
+    train_examples = []
+    for t in TRAIN_DATA:
+        train_examples.append(Example.from_dict(nlp.make_doc(t[0]), t[1]))
+    nlp.initialize(get_examples=lambda: train_examples)
+
+    texts = ["She likes green eggs. Eat blue ham.", " ".join(["word"] * 20)]
+    expected = [[token.head.i for token in doc] for doc in nlp.pipe(texts)]
+
+    nlp2 = English()
+    nlp2.add_pipe("sentencizer")
+    nlp2.add_pipe("arc_predicter", config={"model": {"inference_buckets": [8, 16]}})
+    nlp2.from_bytes(nlp.to_bytes())
+    model = nlp2.get_pipe("arc_predicter").model
+    pytorch_model = model.get_ref("pairwise_bilinear").layers[0].shims[0]._model
+    assert traced_keys(pytorch_model) == [8, 16]
+    assert [[token.head.i for token in doc] for doc in nlp2.pipe(texts)] == expected
+
+
+def test_length_buckets():
+    torch.manual_seed(0)
+    layer = build_pairwise_bilinear_layer(8, 1, dropout=0.0, hidden_width=16, length_buckets=[2, 4])
+    lens = layer.ops.asarray1i([5, 1, 3, 2, 4, 7])
+    X = layer.ops.asarray2f(np.random.default_rng(0).normal(size=(int(lens.sum()), 8)))
+    layer.initialize(X=(X, lens))
+
+    def run(length_buckets, is_train):
+        layer.attrs["length_buckets"] = length_buckets
+        return layer((X, lens), is_train)
+
+    # Only the scores of the heads within each sentence are compared,
+    # the scores of padding differ.
+    def unpad(Y):
+        offset = 0
+        for length in lens:
+            yield Y[offset : offset + length, :length]
+            offset += length
+
+    Y, _ = run(None, False)
+    Y_bucketed, _ = run([2, 4], False)
+    assert Y_bucketed.shape == Y.shape
+    for sent_Y, sent_Y_bucketed in zip(unpad(Y), unpad(Y_bucketed)):
+        np.testing.assert_allclose(sent_Y_bucketed, sent_Y, rtol=1e-5, atol=1e-5)
+    # The sentence of length 1 is in a bucket of length 2.
+    assert (Y_bucketed[5, 2:] == -10000.0).all()
+
+    dY = layer.ops.alloc2f(*Y.shape)
+    for sent_dY in unpad(dY):
+        sent_dY[:] = 1.0
+    Y, backprop = run(None, True)
+    Y_bucketed, backprop_bucketed = run([2, 4], True)
+    for sent_Y, sent_Y_bucketed in zip(unpad(Y), unpad(Y_bucketed)):
+        np.testing.assert_allclose(sent_Y_bucketed, sent_Y, rtol=1e-5, atol=1e-5)
+    dX, _ = backprop(dY)
+    dX_bucketed, _ = backprop_bucketed(dY)
+    np.testing.assert_allclose(dX_bucketed, dX, rtol=1e-4, atol=1e-5)
+
+
+def test_invalid_length_buckets():
+    with pytest.raises(ValueError, match=r"Length buckets must be positive"):
+        build_pairwise_bilinear_layer(8, 1, length_buckets=[0, 4])
+
+
+@pytest.mark.parametrize("length_buckets", [None, [2, 4]])
+def test_ragged_scores(length_buckets):
+    torch.manual_seed(0)
+    layer = build_pairwise_bilinear_layer(
+        8, 1, dropout=0.0, hidden_width=16, length_buckets=length_buckets
+    )
+    lens = layer.ops.asarray1i([5, 1, 3, 2, 4, 7])
+    X = layer.ops.asarray2f(np.random.default_rng(0).normal(size=(int(lens.sum()), 8)))
+    layer.initialize(X=(X, lens))
+    mask = pairwise_bilinear.ragged_score_mask(lens, 7)
+
+    for is_train in [False, True]:
+        layer.attrs["ragged_scores"] = False
+        Y, backprop = layer((X, lens), is_train)
+        layer.attrs["ragged_scores"] = True
+        Y_ragged, backprop_ragged = layer((X, lens), is_train)
+        assert Y_ragged.shape == (int((lens ** 2).sum()),)
+        np.testing.assert_allclose(Y_ragged, Y[mask], rtol=1e-5, atol=1e-5)
+        np.testing.assert_allclose(
+            pairwise_bilinear.pad_ragged_scores(Y_ragged, lens), np.where(mask, Y, 0.0), rtol=1e-5, atol=1e-5
+        )
+
+    dY = np.random.default_rng(1).normal(size=Y.shape).astype(np.float32) * mask
+    dX, _ = backprop(dY)
+    dX_ragged, _ = backprop_ragged(dY[mask])
+    np.testing.assert_allclose(dX_ragged, dX, rtol=1e-4, atol=1e-5)
+
+
+def test_ragged_score_mask():
+    mask = pairwise_bilinear.ragged_score_mask(np.array([2, 0, 1], dtype=np.int32), 3)
+    assert mask.tolist() == [[True, True, False], [True, True, False], [True, False, False]]
+    assert pairwise_bilinear.ragged_score_mask(np.array([], dtype=np.int32), 0).shape == (0, 0)
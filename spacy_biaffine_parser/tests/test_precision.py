@@ -0,0 +1,102 @@
+import pytest
+import torch
+from spacy import util
+from spacy.lang.en import English
+from spacy.training import Example
+
+from spacy_biaffine_parser import arc_labeler, arc_predicter, bilinear, pairwise_bilinear
+from spacy_biaffine_parser.precision import compare_precision, set_inference_precision
+from spacy_biaffine_parser.pytorch_bilinear import BilinearModel
+from spacy_biaffine_parser.pytorch_pairwise_bilinear import PairwiseBilinearModel
+
+TRAIN_DATA = [
+    (
+        "She likes green eggs",
+        {
+            "heads": [1, 1, 3, 1],
+            "deps": ["nsubj", "ROOT", "amod", "dobj"],
+            "sent_starts": [1, 0, 0, 0],
+        },
+    ),
+    (
+        "Eat blue ham",
+        {
+            "heads": [0, 2, 0],
+            "deps": ["ROOT", "amod", "dobj"],
+            "sent_starts": [1, 0, 0],
+        },
+    ),
+]
+
+
+@pytest.mark.parametrize("precision", ["bf16", "int8"])
+def test_pairwise_bilinear_precision(precision):
+    torch.manual_seed(0)
+    model = PairwiseBilinearModel(16, 1, hidden_width=32)
+    model.eval()
+    x = torch.randn(3, 7, 16)
+    lens = torch.tensor([7, 4, 2])
+    expected = model(x, lens)
+
+    model.inference_precision = precision
+    state_dict_keys = set(model.state_dict())
+    logits = model(x, lens)
+    assert logits.dtype == torch.float32
+    assert torch.allclose(logits, expected, atol=0.05, rtol=0.05)
+    # Quantized copies are not part of the model's state.
+    assert set(model.state_dict()) == state_dict_keys
+
+    # Training always uses fp32.
+    model.train()
+    model.dropout = 0.0
+    torch.testing.assert_close(model(x, lens), expected.softmax(-1))
+
+
+@pytest.mark.parametrize("precision", ["bf16", "int8"])
+def test_bilinear_precision(precision):
+    torch.manual_seed(0)
+    model = BilinearModel(16, 5, hidden_width=32)
+    model.eval()
+    x = torch.randn(6, 16)
+    heads = torch.tensor([1, 1, 1, 4, 4, 4])
+    expected = model(x, heads)
+
+    model.inference_precision = precision
+    logits = model(x, heads)
+    assert logits.dtype == torch.float32
+    assert torch.allclose(logits, expected, atol=0.05, rtol=0.05)
+
+
+def test_invalid_precision():
+    with pytest.raises(ValueError, match=r"Unknown inference precision 'fp8'"):
+        PairwiseBilinearModel(16, 1, inference_precision="fp8")
+
+
+def test_compare_precision():
+    util.fix_random_seed(0)
+    nlp = English.from_config()
+    nlp.add_pipe("sentencizer")
+    nlp.add_pipe("arc_predicter", config={"model": {"inference_precision": "bf16"}})
+    nlp.add_pipe("arc_labeler")
+    train_examples = []
+    for t in TRAIN_DATA:
+        train_examples.append(Example.from_dict(nlp.make_doc(t[0]), t[1]))
+    optimizer = nlp.initialize(get_examples=lambda: train_examples)
+    for i in range(50):
+        nlp.update(train_examples, sgd=optimizer, annotates=["sentencizer"])
+
+    # The precision from the config is used after loading.
+    predicter_model = nlp.get_pipe("arc_predicter").model
+    pytorch_model = predicter_model.get_ref("pairwise_bilinear").layers[0].shims[0]._model
+    assert pytorch_model.inference_precision == "bf16"
+
+    results = compare_precision(nlp, train_examples)
+    assert list(results) == ["fp32", "bf16", "int8"]
+    assert results["fp32"]["uas_delta"] == 0.0
+    for result in results.values():
+        assert 0.0 <= result["uas"] <= 1.0
+        assert 0.0 <= result["las"] <= 1.0
+    assert pytorch_model.inference_precision == "fp32"
+
+    with pytest.raises(ValueError, match=r"Unknown inference precision"):
+        set_inference_precision(predicter_model, "fp8")
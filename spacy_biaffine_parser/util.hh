@@ -1,12 +1,83 @@
+#include <atomic>
+#include <cstdint>
+#include <cstring>
 #include <functional>
+#include <thread>
 #include <unordered_map>
 #include <utility>
+#include <vector>
 
 struct pair_hash {
     template <typename T1, typename T2>
     size_t operator()(std::pair<T1, T2> const &pair) const {
-        return std::hash<T1>()(pair.first) ^ std::hash<T2>()(pair.second);
+        // Combine the hashes as boost::hash_combine does. Plain XOR would
+        // hash (a, b) and (b, a) to the same value and (a, a) to zero.
+        size_t seed = std::hash<T1>()(pair.first);
+        seed ^= std::hash<T2>()(pair.second) + 0x9e3779b9 + (seed << 6) + (seed >> 2);
+        return seed;
     }
 };
 
 using replacement_map = std::unordered_map<std::pair<int, int>, int, pair_hash>;
+
+typedef void (*range_fn)(void *ctx, int worker, int begin, int end);
+
+// Call fn for every item in [0, n_items), using up to n_threads threads.
+// Items are handed out one at a time, so that a few expensive items do
+// not leave the other threads idle. The calling thread also processes
+// items, so n_threads <= 1 does not start any threads. fn also receives
+// the index of the worker in [0, n_threads), so that it can use
+// per-thread scratch space.
+inline void parallel_for(int n_items, int n_threads, range_fn fn, void *ctx) {
+    if (n_threads > n_items)
+        n_threads = n_items;
+
+    if (n_threads <= 1) {
+        fn(ctx, 0, 0, n_items);
+        return;
+    }
+
+    std::atomic<int> next(0);
+    auto worker = [&](int worker_idx) {
+        int item;
+        while ((item = next.fetch_add(1)) < n_items)
+            fn(ctx, worker_idx, item, item + 1);
+    };
+
+    std::vector<std::thread> threads;
+    for (int i = 1; i < n_threads; ++i)
+        threads.emplace_back(worker, i);
+    worker(0);
+    for (auto &thread : threads)
+        thread.join();
+}
+
+// Convert an IEEE 754 half-precision float, given as its bit pattern, to a
+// single-precision float.
+inline float half_to_float(uint16_t half) {
+    uint32_t sign = static_cast<uint32_t>(half & 0x8000) << 16;
+    uint32_t exponent = (half >> 10) & 0x1f;
+    uint32_t mantissa = half & 0x3ff;
+    uint32_t bits;
+
+    if (exponent == 0x1f) {
+        // Infinity or NaN.
+        bits = sign | 0x7f800000 | (mantissa << 13);
+    } else if (exponent != 0) {
+        bits = sign | ((exponent + 112) << 23) | (mantissa << 13);
+    } else if (mantissa == 0) {
+        bits = sign;
+    } else {
+        // Subnormal half, which is a normal single-precision float.
+        exponent = 113;
+        while (!(mantissa & 0x400)) {
+            mantissa <<= 1;
+            --exponent;
+        }
+        bits = sign | (exponent << 23) | ((mantissa & 0x3ff) << 13);
+    }
+
+    float result;
+    std::memcpy(&result, &bits, sizeof(result));
+    return result;
+}